@@ -2,18 +2,19 @@
 import sys
 import json
 import os
-import traceback
 import urllib.parse
 
 DEBUG = os.environ.get("DEBUG", "") == "1"
 
-try:
-    import cgitb
-    if DEBUG:
+if DEBUG:
+    # cgitb is heavy (pydoc, inspect, tempfile) and deprecated: load it only
+    # when tracebacks are wanted in the browser.
+    try:
+        import cgitb
         cgitb.enable()
-except Exception:
-    # cgitb may be unavailable in newer Python versions.
-    pass
+    except Exception:
+        # cgitb may be unavailable in newer Python versions.
+        pass
 
 MAX_CONTENT_LENGTH = 64 * 1024  # 64KB
 
@@ -31,15 +32,20 @@ def get_query_params():
             params[key] = value
     return params
 
-def read_json_body():
-    """Reads and parses JSON body with size limit"""
+def get_content_length(max_length=MAX_CONTENT_LENGTH):
+    """CONTENT_LENGTH as an int, refusing bodies over max_length"""
     try:
         content_length = int(os.environ.get("CONTENT_LENGTH", 0))
     except (ValueError, TypeError):
         content_length = 0
 
-    if content_length > MAX_CONTENT_LENGTH:
+    if content_length > max_length:
         raise ValueError("Payload too large")
+    return content_length
+
+def read_json_body(max_length=MAX_CONTENT_LENGTH):
+    """Reads and parses JSON body with size limit"""
+    content_length = get_content_length(max_length)
 
     if content_length <= 0:
         return {}
@@ -47,15 +53,33 @@ def read_json_body():
     try:
         body = sys.stdin.read(content_length)
         return json.loads(body)
-    except json.JSONDecodeError:
+    except (json.JSONDecodeError, RecursionError):
         raise ValueError("Invalid JSON")
 
+def iter_body_lines(max_length=MAX_CONTENT_LENGTH):
+    """Yields the body one line at a time (for NDJSON) with size limit
+
+    Only one line is held in memory, so handlers can start answering
+    before the whole body has arrived.
+    """
+    remaining = get_content_length(max_length)
+    while remaining > 0:
+        line = sys.stdin.readline(remaining)
+        if not line:
+            break
+        remaining -= len(line)
+        yield line
+
 STATUS_TEXT = {
     200: "OK",
+    304: "Not Modified",
     400: "Bad Request",
     500: "Internal Server Error",
 }
 
+NO_STORE = "no-store, no-cache, must-revalidate, max-age=0"
+GZIP_MIN_BYTES = 1024  # smaller bodies are not worth the CPU
+
 def print_cors_headers(allowed_origins=None):
     """Output CORS headers for cross-origin requests
     
@@ -85,8 +109,100 @@ def print_cors_headers(allowed_origins=None):
     print("Access-Control-Allow-Headers: Content-Type")
     print("Vary: Origin")
 
-def send_response(data=None, error=None, status=200):
-    """Sends JSON response"""
+def make_etag(body):
+    """Weak ETag from a hash of the response body"""
+    import hashlib
+
+    digest = hashlib.blake2b(body.encode("utf-8"), digest_size=12).hexdigest()
+    return f'W/"{digest}"'
+
+def quote_etag(etag):
+    """Turns a data version such as 42 or "2026-10-18" into a weak ETag"""
+    etag = str(etag)
+    if etag.startswith(('"', 'W/"')):
+        return etag
+    return f'W/"{etag}"'
+
+def etag_matches(etag):
+    """True when If-None-Match already names etag (weak comparison)"""
+    header = os.environ.get("HTTP_IF_NONE_MATCH", "").strip()
+    if not header or not etag:
+        return False
+    if header == "*":
+        return True
+    wanted = etag[2:] if etag.startswith("W/") else etag
+    for candidate in header.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == wanted:
+            return True
+    return False
+
+def accepts_gzip():
+    """True when Accept-Encoding allows gzip"""
+    for item in os.environ.get("HTTP_ACCEPT_ENCODING", "").split(","):
+        coding, _, params = item.partition(";")
+        if coding.strip().lower() not in ("gzip", "x-gzip"):
+            continue
+        q = params.replace(" ", "").lower()
+        if q.startswith("q="):
+            try:
+                return float(q[2:]) > 0
+            except ValueError:
+                return False
+        return True
+    return False
+
+def gzip_bytes(data):
+    import zlib
+
+    # wbits=31 writes the gzip container instead of a raw zlib stream.
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    return compressor.compress(data) + compressor.flush()
+
+def cache_control(max_age=None, stale_while_revalidate=None, etag=None):
+    """Cache-Control value for a response
+
+    Without max_age or etag the response is not stored at all. An etag alone
+    lets clients keep the response but revalidate it on every use.
+    """
+    if max_age is None and etag is None:
+        return NO_STORE
+    if max_age is None:
+        return "no-cache"
+    value = f"public, max-age={int(max_age)}"
+    if stale_while_revalidate:
+        value += f", stale-while-revalidate={int(stale_while_revalidate)}"
+    return value
+
+def print_cache_headers(max_age=None, stale_while_revalidate=None, etag=None):
+    value = cache_control(max_age, stale_while_revalidate, etag)
+    print(f"Cache-Control: {value}")
+    if value == NO_STORE:
+        print("Pragma: no-cache")
+        print("Expires: 0")
+    if etag:
+        print(f"ETag: {etag}")
+
+def send_not_modified(etag, max_age=None, stale_while_revalidate=None):
+    """Sends 304 with the validators and no body"""
+    print(f"Status: 304 {STATUS_TEXT[304]}")
+    print_cors_headers()
+    print_cache_headers(max_age, stale_while_revalidate, etag)
+    print()
+
+def send_response(data=None, error=None, status=200, max_age=None, stale_while_revalidate=None, etag=None):
+    """Sends JSON response
+
+    Responses are not cached unless the handler opts in:
+        max_age: seconds clients and proxies may reuse the response
+        stale_while_revalidate: seconds a stale copy may be served while
+            it is refreshed in the background
+        etag: True to derive one from the body, or a data version string
+    A GET whose If-None-Match matches the ETag gets 304 without a body.
+    Bodies of GZIP_MIN_BYTES or more are gzipped when the client accepts it.
+    """
     result = {}
     if error:
         result["ok"] = False
@@ -97,18 +213,53 @@ def send_response(data=None, error=None, status=200):
 
     body = json.dumps(result, ensure_ascii=False)
 
+    if error or status != 200:
+        # Errors are never cached.
+        max_age = stale_while_revalidate = etag = None
+    if etag is True:
+        etag = make_etag(body)
+    elif etag is not None:
+        etag = quote_etag(etag)
+    if etag and os.environ.get("REQUEST_METHOD", "GET") in ("GET", "HEAD") and etag_matches(etag):
+        send_not_modified(etag, max_age, stale_while_revalidate)
+        return
+
+    payload = None
+    large = len(body) >= GZIP_MIN_BYTES
+    # Text-only streams (tests, some embedders) cannot carry binary bodies.
+    if large and accepts_gzip() and hasattr(sys.stdout, "buffer"):
+        payload = gzip_bytes((body + "\n").encode("utf-8"))
+
     status_text = STATUS_TEXT.get(status, "OK")
     print(f"Status: {status} {status_text}")
     print("Content-Type: application/json; charset=utf-8")
     print_cors_headers()
-    print("Cache-Control: no-store, no-cache, must-revalidate, max-age=0")
-    print("Pragma: no-cache")
-    print("Expires: 0")
+    print_cache_headers(max_age, stale_while_revalidate, etag)
+    if large:
+        print("Vary: Accept-Encoding")
+    if payload is not None:
+        print("Content-Encoding: gzip")
+    print()
+    if payload is None:
+        print(body)
+    else:
+        sys.stdout.flush()
+        sys.stdout.buffer.write(payload)
+        sys.stdout.buffer.flush()
+
+def start_stream(content_type):
+    """Sends 200 headers for a body the handler writes itself"""
+    print(f"Status: 200 {STATUS_TEXT[200]}")
+    print(f"Content-Type: {content_type}")
+    print_cors_headers()
+    print_cache_headers()
     print()
-    print(body)
+    sys.stdout.flush()
 
 def handle_exception(e):
     """Standard exception handler"""
+    import traceback
+
     # Log full traceback to server logs only.
     sys.stderr.write(traceback.format_exc())
 
@@ -121,6 +272,7 @@ def handle_exception(e):
         safe_map = {
             "Payload too large": ("payload_too_large", "Payload too large"),
             "Invalid JSON": ("invalid_json", "Invalid JSON"),
+            "Invalid schema": ("invalid_schema", "Invalid schema"),
         }
         code_message = safe_map.get(str(e))
         if code_message:
@@ -148,9 +300,7 @@ def main(handler_func):
             print("Status: 204 No Content")
             print("Content-Type: text/plain")
             print_cors_headers()
-            print("Cache-Control: no-store, no-cache, must-revalidate, max-age=0")
-            print("Pragma: no-cache")
-            print("Expires: 0")
+            print_cache_headers()
             print()
             return
 
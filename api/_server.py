@@ -0,0 +1,380 @@
+#!/usr/local/bin/python3
+"""Long-running front controller for the CGI endpoints.
+
+Loads every handler once and serves them as a WSGI application, so a request
+costs a function call instead of a fresh interpreter:
+
+    python3 api/_server.py --port 8080          # threaded wsgiref server
+    gunicorn --chdir api _server:application    # any WSGI server
+
+Handlers run unchanged: each request sees its own os.environ, sys.stdin and
+sys.stdout, and the printed headers are translated back into a WSGI
+response. While requests are in flight those three names are proxies that
+follow a context variable, so requests run concurrently. Unlike a CGI child,
+a handler shares the process: threads it starts see the request only when
+they run in a copy of its context (contextvars.copy_context(), as
+bookmark's worker.fetch_many does); other threads see the server's own
+environment. Scripts that keep state in the process between requests
+(caches, pooled connections, id counters) run one request at a time, each
+behind its own lock.
+
+The request body is read from the client as the handler asks for it, and
+output is sent as soon as the handler flushes it after the headers, so
+streamed responses (uuid bulk, validate batch, db ndjson, bookmark export)
+are not held in memory.
+"""
+import argparse
+import contextvars
+import http
+import importlib.util
+import io
+import os
+import sys
+import threading
+from collections.abc import MutableMapping
+from importlib.machinery import SourceFileLoader
+from socketserver import ThreadingMixIn
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, make_server
+
+API_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(API_DIR)
+
+# Request path suffix -> (script relative to the repo root, entry point,
+# serialized). "lib" scripts expose handler() for _lib.main; "main" scripts
+# run main(). Serialized scripts share unsynchronized state across requests.
+ROUTES = {
+    '/api/now.cgi': ('api/now.cgi', 'lib', False),
+    '/api/uuid.cgi': ('api/uuid.cgi', 'lib', True),
+    '/api/convert.cgi': ('api/convert.cgi', 'lib', False),
+    '/api/validate.cgi': ('api/validate.cgi', 'lib', True),
+    '/api/db.cgi': ('api/db.cgi', 'lib', True),
+    '/api/visitor.cgi': ('api/visitor.cgi', 'lib', True),
+    '/bookmark/cgi/api.cgi': ('bookmark/cgi/api.cgi', 'main', False),
+}
+
+# Largest body any endpoint accepts (bookmark import); anything bigger is
+# refused before reading. Handlers still apply their own, smaller limits.
+MAX_CONTENT_LENGTH = 20 * 1024 * 1024
+# Output is held back until the handler flushes it or it grows past this,
+# so ordinary responses still get a Content-Length.
+OUTPUT_BUFFER_BYTES = 64 * 1024
+
+# CGI variables copied from the WSGI environ besides HTTP_*.
+CGI_KEYS = (
+    'REQUEST_METHOD', 'QUERY_STRING', 'CONTENT_TYPE', 'CONTENT_LENGTH', 'SCRIPT_NAME', 'PATH_INFO',
+    'SERVER_NAME', 'SERVER_PORT', 'SERVER_PROTOCOL', 'REMOTE_ADDR', 'REMOTE_HOST', 'HTTPS',
+)
+
+# Variables like BOOKMARK_DB_PATH set when the server starts stay visible to
+# every request, as they would be for a CGI child.
+_base_environ = dict(os.environ)
+
+# Path prefix stripped before routing when the bundled server is reached
+# under a sub-path (--prefix /cgi).
+mount_prefix = ''
+
+_handlers = {}
+_load_lock = threading.Lock()
+_route_locks = {route: threading.Lock() for route, (_, _, serialized) in ROUTES.items() if serialized}
+
+class RequestRouted:
+    """Stands in for sys.stdin or sys.stdout: the current request's stream
+    inside a request's context, the process-wide one anywhere else"""
+
+    def __init__(self, name, default):
+        self._name = name
+        self._default = default
+
+    def _target(self):
+        streams = _request_streams.get()
+        return streams[self._name] if streams is not None else self._default
+
+    def __getattr__(self, name):
+        return getattr(self._target(), name)
+
+    def __iter__(self):
+        return iter(self._target())
+
+class RequestRoutedEnviron(MutableMapping):
+    """Stands in for os.environ, routed like RequestRouted"""
+
+    def __init__(self, default):
+        self._default = default
+
+    def _target(self):
+        streams = _request_streams.get()
+        return streams['environ'] if streams is not None else self._default
+
+    def __getitem__(self, key):
+        return self._target()[key]
+
+    def __setitem__(self, key, value):
+        self._target()[key] = value
+
+    def __delitem__(self, key):
+        del self._target()[key]
+
+    def __iter__(self):
+        return iter(self._target())
+
+    def __len__(self):
+        return len(self._target())
+
+    def copy(self):
+        return dict(self._target())
+
+# Proxies are installed while at least one request is running and removed
+# when the last one finishes, so the process looks untouched in between.
+_request_streams = contextvars.ContextVar('request_streams', default=None)
+_install_lock = threading.Lock()
+_active_requests = 0
+_saved_globals = None
+
+def enter_request(environ, stdin, stdout):
+    global _active_requests, _saved_globals
+    with _install_lock:
+        if _active_requests == 0:
+            _saved_globals = os.environ, sys.stdin, sys.stdout
+            os.environ = RequestRoutedEnviron(os.environ)
+            sys.stdin = RequestRouted('stdin', sys.stdin)
+            sys.stdout = RequestRouted('stdout', sys.stdout)
+        _active_requests += 1
+    return _request_streams.set({'environ': environ, 'stdin': stdin, 'stdout': stdout})
+
+def leave_request(token):
+    global _active_requests, _saved_globals
+    _request_streams.reset(token)
+    with _install_lock:
+        _active_requests -= 1
+        if _active_requests == 0:
+            os.environ, sys.stdin, sys.stdout = _saved_globals
+            _saved_globals = None
+
+def load_script(script):
+    path = os.path.join(REPO_DIR, script)
+    # A unique name keeps uuid.cgi from shadowing the uuid module.
+    name = 'cgi_' + script.replace('/', '_').replace('.', '_')
+    loader = SourceFileLoader(name, path)
+    spec = importlib.util.spec_from_loader(name, loader)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
+
+def get_handler(route):
+    handler = _handlers.get(route)
+    if handler is not None:
+        return handler
+    with _load_lock:
+        if route not in _handlers:
+            script, kind, _ = ROUTES[route]
+            module = load_script(script)
+            if kind == 'lib':
+                _handlers[route] = lambda: module._lib.main(module.handler)
+            else:
+                _handlers[route] = module.main
+        return _handlers[route]
+
+def preload():
+    for route in ROUTES:
+        get_handler(route)
+
+def find_route(path, prefix=''):
+    # Exact match after the mount prefix (e.g. /cgi), nothing else.
+    if prefix:
+        if not path.startswith(prefix + '/'):
+            return None
+        path = path[len(prefix):]
+    return path if path in ROUTES else None
+
+def cgi_environ(environ, base):
+    # Request variables always come from the request, never from the server
+    # process: a missing or empty one is '', and server-side HTTP_* are dropped.
+    env = {key: value for key, value in base.items()
+           if key not in CGI_KEYS and not key.startswith('HTTP_')}
+    for key in CGI_KEYS:
+        env[key] = environ.get(key) or ''
+    for key, value in environ.items():
+        if key.startswith('HTTP_'):
+            env[key] = value
+    env['GATEWAY_INTERFACE'] = 'CGI/1.1'
+    return env
+
+def parse_cgi_head(head):
+    # Turns printed CGI headers into a WSGI status and header list.
+    status = '200 OK'
+    headers = []
+    for line in head.decode('latin-1').splitlines():
+        name, _, value = line.partition(':')
+        name, value = name.strip(), value.strip()
+        if not name:
+            continue
+        if name.lower() == 'status':
+            code, _, reason = value.partition(' ')
+            if not reason and code.isdigit():
+                try:
+                    reason = http.HTTPStatus(int(code)).phrase
+                except ValueError:
+                    reason = 'Unknown'
+            status = f'{code} {reason}'
+        else:
+            headers.append((name, value))
+    return status, headers
+
+def find_head_end(data):
+    # (end of the header block, start of the body), or None while incomplete.
+    ends = [(data.find(sep), len(sep)) for sep in (b'\r\n\r\n', b'\n\n')]
+    found = [(pos, pos + size) for pos, size in ends if pos >= 0]
+    return min(found) if found else None
+
+class LimitedInput(io.RawIOBase):
+    """wsgi.input cut off after CONTENT_LENGTH bytes, read on demand"""
+
+    def __init__(self, stream, length):
+        self.stream = stream
+        self.remaining = length
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        if self.remaining <= 0:
+            return 0
+        data = self.stream.read(min(len(b), self.remaining))
+        self.remaining -= len(data)
+        b[:len(data)] = data
+        return len(data)
+
+class CGIOutput(io.BufferedIOBase):
+    """Collects a handler's stdout and hands it to the WSGI server
+
+    Output is buffered until the header block is complete and the handler
+    flushes (or OUTPUT_BUFFER_BYTES is exceeded); from then on every write
+    goes straight to the client through start_response's write().
+    """
+
+    def __init__(self, start_response):
+        self.start_response = start_response
+        self.pending = bytearray()
+        self.write_body = None
+        self.finished = False
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        if self.write_body is not None:
+            if data:
+                self.write_body(bytes(data))
+        else:
+            self.pending += data
+            if len(self.pending) > OUTPUT_BUFFER_BYTES:
+                self.start_streaming()
+        return len(data)
+
+    def flush(self):
+        if not self.finished and self.write_body is None and find_head_end(self.pending) is not None:
+            self.start_streaming()
+
+    def split(self):
+        bounds = find_head_end(self.pending)
+        if bounds is None:
+            return b'', bytes(self.pending)
+        head_end, body_start = bounds
+        return bytes(self.pending[:head_end]), bytes(self.pending[body_start:])
+
+    def start_streaming(self):
+        head, body = self.split()
+        status, headers = parse_cgi_head(head)
+        self.write_body = self.start_response(status, headers)
+        self.pending = None
+        if body:
+            self.write_body(body)
+
+    def finish(self, stdout):
+        # Text still buffered in stdout goes out with the rest; a handler
+        # that never flushed gets its whole response sent with a length.
+        self.finished = True
+        stdout.flush()
+        if self.write_body is not None:
+            return []
+        head, body = self.split()
+        status, headers = parse_cgi_head(head)
+        headers.append(('Content-Length', str(len(body))))
+        self.start_response(status, headers)
+        return [body]
+
+def run_cgi(handler, env, body_stream, start_response, lock=None):
+    # Runs a CGI-style handler with its own environment, stdin and stdout;
+    # returns the WSGI body for whatever the handler did not stream.
+    out = CGIOutput(start_response)
+    stdout = io.TextIOWrapper(out, encoding='utf-8')
+    stdin = io.TextIOWrapper(io.BufferedReader(body_stream), encoding='utf-8')
+    token = enter_request(env, stdin, stdout)
+    try:
+        if lock is None:
+            handler()
+        else:
+            with lock:
+                handler()
+    except SystemExit:
+        pass
+    except BaseException:
+        # Left to the WSGI server; nothing may reach start_response later.
+        out.finished = True
+        raise
+    finally:
+        leave_request(token)
+    return out.finish(stdout)
+
+def application(environ, start_response):
+    # SCRIPT_NAME is where a WSGI server mounted the app; routes are below it.
+    route = find_route(environ.get('PATH_INFO', ''), mount_prefix)
+    if route is None:
+        start_response('404 Not Found', [('Content-Type', 'text/plain; charset=utf-8')])
+        return [b'Not Found\n']
+
+    try:
+        length = int(environ.get('CONTENT_LENGTH') or 0)
+    except ValueError:
+        length = 0
+    if length > MAX_CONTENT_LENGTH:
+        start_response('413 Payload Too Large', [('Content-Type', 'text/plain; charset=utf-8')])
+        return [b'Payload Too Large\n']
+
+    body_stream = LimitedInput(environ['wsgi.input'], max(length, 0))
+    return run_cgi(get_handler(route), cgi_environ(environ, _base_environ), body_stream, start_response,
+                   _route_locks.get(route))
+
+class ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+class QuietRequestHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        if os.environ.get('DEBUG') == '1':
+            super().log_message(format, *args)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Serve the CGI endpoints from one long-running process.')
+    parser.add_argument('--host', default='127.0.0.1', help='address to bind')
+    parser.add_argument('--port', type=int, default=8080, help='port to bind')
+    parser.add_argument('--prefix', default='', help='path prefix the routes live under, e.g. /cgi')
+    args = parser.parse_args(argv)
+
+    global mount_prefix
+    mount_prefix = args.prefix.rstrip('/')
+
+    preload()
+    httpd = make_server(args.host, args.port, application, ThreadingWSGIServer, QuietRequestHandler)
+    print(f"Serving {', '.join(mount_prefix + route for route in sorted(ROUTES))} on http://{args.host}:{args.port}",
+          file=sys.stderr)
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,67 @@
+#!/usr/local/bin/python3
+"""convert.cgi: one POST batch vs one GET per value.
+
+    python3 api/bench/bench_convert.py [--values 5000] [--sample 20]
+
+The in-process line times convert_values() alone (array module, or NumPy
+when importable and the batch has at least NUMPY_MIN_VALUES values). The
+CGI lines run convert.cgi as the web server does; the per-value side times
+--sample requests and extrapolates.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+import importlib.util
+from importlib.machinery import SourceFileLoader
+
+API_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCRIPT = os.path.join(API_DIR, 'convert.cgi')
+
+def load_convert_cgi():
+    loader = SourceFileLoader('convert_cgi', SCRIPT)
+    spec = importlib.util.spec_from_loader(loader.name, loader)
+    module = importlib.util.module_from_spec(spec)
+    loader.exec_module(module)
+    return module
+
+def run(method, query='', body=b''):
+    env = dict(os.environ, REQUEST_METHOD=method, QUERY_STRING=query, CONTENT_LENGTH=str(len(body)),
+               CONTENT_TYPE='application/json')
+    proc = subprocess.run([sys.executable, '-S', SCRIPT], input=body, env=env, stdout=subprocess.PIPE, check=True)
+    assert b'"ok": true' in proc.stdout, proc.stdout
+    return proc.stdout
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--values', type=int, default=5000, help='values to convert (at most MAX_BATCH_VALUES)')
+    parser.add_argument('--sample', type=int, default=20, help='single-value requests to time')
+    args = parser.parse_args(argv)
+
+    convert_cgi = load_convert_cgi()
+    values = [i * 0.5 for i in range(args.values)]
+
+    start = time.perf_counter()
+    convert_cgi.convert_values('temp', 'c', 'f', values)
+    in_process = time.perf_counter() - start
+    backend = 'numpy' if convert_cgi._numpy else 'array'
+
+    start = time.perf_counter()
+    for value in values[:args.sample]:
+        run('GET', f'kind=temp&value={value}&from=c&to=f')
+    single = (time.perf_counter() - start) / args.sample * args.values
+
+    body = json.dumps({'kind': 'temp', 'from': 'c', 'to': 'f', 'values': values}).encode('utf-8')
+    start = time.perf_counter()
+    run('POST', body=body)
+    batch = time.perf_counter() - start
+
+    print(f"in-process ({backend}): {in_process * 1000:.2f}ms for {args.values} values")
+    print(f"{args.values} GET requests (estimated): {single:.2f}s")
+    print(f"1 POST batch request: {batch * 1000:.1f}ms")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,74 @@
+#!/usr/local/bin/python3
+"""Syncing N rows through db.cgi: N insert requests vs one action=batch.
+
+    python3 api/bench/bench_db_batch.py [--rows 100]
+
+Both sides run db.cgi the way the web server does (a fresh python3 per
+request). The per-request side pays N interpreter starts, connections and
+commits; the batch side pays one of each. The scratch database is removed
+afterwards.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+API_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCRIPT = os.path.join(API_DIR, 'db.cgi')
+DATABASE = 'bench_batch'
+
+def post(body):
+    data = json.dumps(body).encode('utf-8')
+    env = dict(os.environ, REQUEST_METHOD='POST', CONTENT_LENGTH=str(len(data)),
+               CONTENT_TYPE='application/json', HTTP_ORIGIN='http://localhost')
+    proc = subprocess.run([sys.executable, SCRIPT], input=data, env=env, stdout=subprocess.PIPE, check=True)
+    assert b'"ok": true' in proc.stdout, proc.stdout
+    return proc.stdout
+
+def query(operation, **fields):
+    return post(dict(fields, action='query', database=DATABASE, operation=operation, table='items'))
+
+def reset():
+    query('create_table', schema={'id': 'INTEGER PRIMARY KEY', 'name': 'TEXT', 'qty': 'INTEGER'})
+    query('delete', where={'qty': 1})
+
+def rows(count):
+    return [{'name': f'item-{i}', 'qty': 1} for i in range(count)]
+
+def run_single(count):
+    start = time.perf_counter()
+    for row in rows(count):
+        query('insert', data=row)
+    return time.perf_counter() - start
+
+def run_batch(count):
+    operations = [{'operation': 'insert', 'table': 'items', 'data': row} for row in rows(count)]
+    start = time.perf_counter()
+    post({'action': 'batch', 'database': DATABASE, 'operations': operations})
+    return time.perf_counter() - start
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=100, help='rows to sync (at most 100 per batch)')
+    args = parser.parse_args(argv)
+
+    try:
+        reset()
+        single = run_single(args.rows)
+        reset()
+        batch = run_batch(args.rows)
+    finally:
+        path = os.path.join(API_DIR, '_data', 'databases', f'{DATABASE}.db')
+        for suffix in ('', '-journal', '-wal', '-shm'):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+
+    print(f"{args.rows} insert requests: {single:.3f}s ({single / args.rows * 1000:.1f}ms/row)")
+    print(f"1 batch request:    {batch:.3f}s ({batch / args.rows * 1000:.2f}ms/row)")
+    print(f"speedup: {single / batch:.1f}x")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
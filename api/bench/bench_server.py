@@ -0,0 +1,78 @@
+#!/usr/local/bin/python3
+"""Requests per second: one interpreter per request (CGI) vs api/_server.py.
+
+    python3 api/bench/bench_server.py [--requests 200] [--path /api/now.cgi?tz=utc]
+
+The CGI side runs the script the way the web server does (a fresh python3
+with the request in the environment); the server side sends real HTTP
+requests to a _server.py subprocess.
+"""
+import argparse
+import http.client
+import os
+import socket
+import subprocess
+import sys
+import time
+import urllib.parse
+
+API_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+REPO_DIR = os.path.dirname(API_DIR)
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def run_cgi(script, query, count):
+    env = dict(os.environ, REQUEST_METHOD='GET', QUERY_STRING=query, CONTENT_LENGTH='0')
+    start = time.perf_counter()
+    for _ in range(count):
+        proc = subprocess.run([sys.executable, script], env=env, stdout=subprocess.PIPE, check=True)
+        assert b'"ok": true' in proc.stdout, proc.stdout
+    return time.perf_counter() - start
+
+def run_server(path, count):
+    port = free_port()
+    server = subprocess.Popen([sys.executable, os.path.join(API_DIR, '_server.py'), '--port', str(port)],
+                              stderr=subprocess.DEVNULL)
+    try:
+        deadline = time.time() + 10
+        while True:
+            try:
+                socket.create_connection(('127.0.0.1', port), timeout=0.2).close()
+                break
+            except OSError:
+                if time.time() > deadline:
+                    raise
+                time.sleep(0.05)
+
+        start = time.perf_counter()
+        for _ in range(count):
+            conn = http.client.HTTPConnection('127.0.0.1', port)
+            conn.request('GET', path)
+            body = conn.getresponse().read()
+            conn.close()
+            assert b'"ok": true' in body, body
+        return time.perf_counter() - start
+    finally:
+        server.terminate()
+        server.wait()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--path', default='/api/now.cgi?tz=utc', help='request path (an /api/*.cgi GET endpoint)')
+    args = parser.parse_args(argv)
+
+    parts = urllib.parse.urlsplit(args.path)
+    script = os.path.join(REPO_DIR, parts.path.lstrip('/'))
+    cgi = run_cgi(script, parts.query, args.requests)
+    served = run_server(args.path, args.requests)
+    for name, elapsed in (('cgi', cgi), ('server', served)):
+        print(f"{name:7s} {args.requests} requests  {elapsed:.3f}s  {args.requests / elapsed:8.1f} req/s")
+    print(f"speedup {cgi / served:.1f}x")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
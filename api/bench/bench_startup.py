@@ -0,0 +1,142 @@
+#!/usr/local/bin/python3
+"""Cold-start cost of every CGI entry point, with per-script budgets.
+
+Each script is run the way the web server runs it (a fresh interpreter with
+the flags from its shebang and the request in the environment) under
+-X importtime. Prints wall time, total import time and the most expensive
+modules, and exits 1 when a script exceeds its import budget or loads a
+module it should not need for that request:
+
+    python3 api/bench/bench_startup.py [--runs 5] [--top 5] [--json]
+"""
+import argparse
+import json
+import os
+import shlex
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+API_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+REPO_DIR = os.path.dirname(API_DIR)
+
+# Modules that only belong on error, debug or network paths.
+HEAVY = ('cgitb', 'pydoc', 'inspect', 'traceback')
+NETWORK = ('http.client', 'ssl', 'socket', 'email.parser', 'html.parser', 'fetcher')
+
+# (script, method, query, body, import budget in ms, modules that must not load)
+ENTRY_POINTS = [
+    ('api/now.cgi', 'GET', 'tz=utc', b'', 60, HEAVY),
+    ('api/uuid.cgi', 'GET', 'n=5', b'', 60, HEAVY),
+    ('api/convert.cgi', 'GET', 'kind=temp&value=1&from=c&to=f', b'', 60, HEAVY),
+    ('api/validate.cgi', 'POST', '', b'{"schema": {"type": "integer"}, "data": 1}', 60, HEAVY),
+    ('api/db.cgi', 'GET', '', b'', 80, ('cgitb', 'pydoc', 'inspect')),
+    ('api/visitor.cgi', 'GET', 'action=stats', b'', 80, ('cgitb', 'pydoc', 'inspect')),
+    ('bookmark/cgi/api.cgi', 'GET', 'action=health', b'', 80, HEAVY + NETWORK),
+    ('bookmark/cgi/api.cgi', 'GET', 'action=list&q=python', b'', 80, HEAVY + NETWORK),
+]
+
+def shebang_flags(path):
+    with open(path, encoding='utf-8') as f:
+        line = f.readline()
+    if not line.startswith('#!'):
+        return []
+    return [arg for arg in shlex.split(line[2:])[1:] if arg.startswith('-')]
+
+def parse_importtime(stderr):
+    # Returns {module: (self_us, cumulative_us)} and the top-level total.
+    modules = {}
+    total = 0
+    for line in stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        fields = line[len('import time:'):].split('|')
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            continue
+        self_us, cumulative, name = int(fields[0]), int(fields[1]), fields[2].rstrip()
+        # Nested imports are indented two spaces per level.
+        if len(name) - len(name.lstrip()) == 1:
+            total += cumulative
+        modules[name.strip()] = (self_us, cumulative)
+    return modules, total
+
+def measure(script, method, query, body, env):
+    path = os.path.join(REPO_DIR, script)
+    cmd = [sys.executable, *shebang_flags(path), '-X', 'importtime', path]
+    env = dict(env, REQUEST_METHOD=method, QUERY_STRING=query, CONTENT_LENGTH=str(len(body)),
+               CONTENT_TYPE='application/json')
+    start = time.perf_counter()
+    proc = subprocess.run(cmd, input=body, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                          cwd=os.path.dirname(path), check=False)
+    wall = time.perf_counter() - start
+    stderr = proc.stderr.decode('utf-8', errors='replace')
+    modules, total = parse_importtime(stderr)
+    # A failed module-level import exits non-zero; one inside a handler is a 500.
+    # A 400 (wrong method, no origin) still means everything imported.
+    clean = proc.returncode == 0 and not proc.stdout.startswith(b'Status: 500')
+    return wall, total, modules, clean
+
+def run(runs=5, top=5, entry_points=ENTRY_POINTS):
+    results = []
+    with tempfile.TemporaryDirectory() as tmpdir:
+        env = {key: value for key, value in os.environ.items() if not key.startswith('PYTHON')}
+        env['BOOKMARK_DB_PATH'] = os.path.join(tmpdir, 'startup.sqlite3')
+        # visitor.cgi only answers allowed origins.
+        env['HTTP_ORIGIN'] = 'http://localhost'
+        for script, method, query, body, budget_ms, forbidden in entry_points:
+            walls, totals = [], []
+            modules = {}
+            clean = True
+            for _ in range(runs):
+                wall, total, modules, run_clean = measure(script, method, query, body, env)
+                walls.append(wall)
+                totals.append(total)
+                clean = clean and run_clean
+            import_ms = min(totals) / 1000
+            loaded = sorted(set(forbidden) & set(modules))
+            results.append({
+                'script': script,
+                'request': f"{method} ?{query}" if query else method,
+                'wall_ms': {'min': round(min(walls) * 1000, 1), 'median': round(statistics.median(walls) * 1000, 1)},
+                'import_ms': round(import_ms, 1),
+                'budget_ms': budget_ms,
+                'modules': len(modules),
+                'top': [{'module': name, 'cumulative_ms': round(cum / 1000, 1), 'self_ms': round(self_us / 1000, 1)}
+                        for name, (self_us, cum) in sorted(modules.items(), key=lambda kv: -kv[1][1])[:top]],
+                'forbidden_loaded': loaded,
+                'clean': clean,
+                'ok': import_ms <= budget_ms and not loaded and clean,
+            })
+    return results
+
+def print_report(results):
+    for r in results:
+        mark = 'ok  ' if r['ok'] else 'OVER'
+        print(f"{mark} {r['script']:22s} {r['request']:28s} wall {r['wall_ms']['min']:6.1f}ms "
+              f"(median {r['wall_ms']['median']:.1f})  imports {r['import_ms']:5.1f}/{r['budget_ms']}ms  "
+              f"{r['modules']} modules")
+        for t in r['top']:
+            print(f"       {t['cumulative_ms']:6.1f}ms  {t['module']}")
+        if r['forbidden_loaded']:
+            print(f"       unexpected: {', '.join(r['forbidden_loaded'])}")
+        if not r['clean']:
+            print("       failed: non-zero exit or a 500 response")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5, help='runs per script (the best one is kept)')
+    parser.add_argument('--top', type=int, default=5, help='most expensive modules to list per script')
+    parser.add_argument('--json', action='store_true', help='print results as JSON')
+    args = parser.parse_args(argv)
+
+    results = run(args.runs, args.top)
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print_report(results)
+    return 0 if all(r['ok'] for r in results) else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,67 @@
+#!/usr/local/bin/python3
+"""SQLite insert throughput with uuid4 vs UUIDv7 vs ULID primary keys.
+
+    python3 api/bench/bench_uuid_insert.py [--rows 200000] [--batch 1000]
+
+Each run fills a fresh `id TEXT PRIMARY KEY` table (as db.cgi would create
+it, with db.cgi's default PRAGMAs) in --batch row transactions, with ids
+from uuid.cgi generated up front. Random uuid4 keys land all over the
+primary key index, so once it outgrows the page cache most inserts touch a
+different page; time-ordered keys append to the right-most leaf. Prints
+rows/s and the resulting file size.
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+import importlib.util
+from importlib.machinery import SourceFileLoader
+
+API_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def load_uuid_cgi():
+    loader = SourceFileLoader('uuid_cgi', os.path.join(API_DIR, 'uuid.cgi'))
+    spec = importlib.util.spec_from_loader(loader.name, loader)
+    module = importlib.util.module_from_spec(spec)
+    loader.exec_module(module)
+    return module
+
+def run(path, ids, batch):
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA cache_size=-2048")
+    conn.execute("CREATE TABLE items (id TEXT PRIMARY KEY, name TEXT)")
+    start = time.perf_counter()
+    for i in range(0, len(ids), batch):
+        with conn:
+            conn.executemany("INSERT INTO items (id, name) VALUES (?, ?)",
+                             ((value, f"item-{n}") for n, value in enumerate(ids[i:i + batch], i)))
+    elapsed = time.perf_counter() - start
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    conn.close()
+    return elapsed, os.path.getsize(path)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=200000, help='rows to insert per key type')
+    parser.add_argument('--batch', type=int, default=1000, help='rows per transaction')
+    args = parser.parse_args(argv)
+
+    uuid_cgi = load_uuid_cgi()
+    results = {}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for version, label in (('4', 'uuid4'), ('7', 'uuid7'), ('ulid', 'ulid')):
+            ids = []
+            while len(ids) < args.rows:
+                ids.extend(uuid_cgi.generate(version, min(uuid_cgi.MAX_BULK_IDS, args.rows - len(ids))))
+            elapsed, size = run(os.path.join(tmpdir, f'{label}.db'), ids, args.batch)
+            results[label] = elapsed
+            print(f"{label:6s} {args.rows / elapsed:10.0f} rows/s  {elapsed:6.2f}s  {size / 1048576:6.1f}MB")
+    print(f"uuid7 vs uuid4: {results['uuid4'] / results['uuid7']:.1f}x")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,181 @@
+#!/usr/local/bin/python3
+"""validate.cgi: the compiled validator vs the old per-node interpreter.
+
+    python3 api/bench/bench_validate.py [--rounds 5] [--width 5000] [--depth 200]
+
+"wide" is an array of records checked against an object schema with string,
+pattern and number constraints; "deep" is a chain of nested objects. The
+interpreter below is validate() as it was before schemas were compiled; both
+sides must report the same errors. "compiled" reuses a cached validator,
+"compile+run" includes building it.
+
+The last lines run validate.cgi itself: one request per record (a sample,
+extrapolated) against a single ?action=batch request for every record.
+"""
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+import time
+import importlib.util
+from importlib.machinery import SourceFileLoader
+
+API_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def load_validate_cgi():
+    loader = SourceFileLoader('validate_cgi', os.path.join(API_DIR, 'validate.cgi'))
+    spec = importlib.util.spec_from_loader(loader.name, loader)
+    module = importlib.util.module_from_spec(spec)
+    loader.exec_module(module)
+    return module
+
+validate_cgi = load_validate_cgi()
+
+def interpret(schema, data, path="$"):
+    errors = []
+    schema_type = schema.get("type")
+    if schema_type:
+        valid_type = True
+        if schema_type == "object":
+            if not isinstance(data, dict): valid_type = False
+        elif schema_type == "array":
+            if not isinstance(data, list): valid_type = False
+        elif schema_type == "string":
+            if not isinstance(data, str): valid_type = False
+        elif schema_type == "integer":
+            if not isinstance(data, int) or isinstance(data, bool): valid_type = False
+        elif schema_type == "number":
+            if not isinstance(data, (int, float)) or isinstance(data, bool): valid_type = False
+        elif schema_type == "boolean":
+            if not isinstance(data, bool): valid_type = False
+        elif schema_type == "null":
+            if data is not None: valid_type = False
+        if not valid_type:
+            errors.append({"path": path, "message": f"expected {schema_type} but got {type(data).__name__}"})
+            return errors
+
+    if schema_type == "object":
+        for req in schema.get("required", []):
+            if req not in data:
+                errors.append({"path": path, "message": f"missing required property '{req}'"})
+        properties = schema.get("properties", {})
+        additional_properties = schema.get("additionalProperties", True)
+        for key, value in data.items():
+            if key in properties:
+                errors.extend(interpret(properties[key], value, f"{path}.{key}"))
+            elif additional_properties is False:
+                errors.append({"path": path, "message": f"additional property '{key}' not allowed"})
+
+    if schema_type == "string":
+        if "minLength" in schema and len(data) < schema["minLength"]:
+            errors.append({"path": path, "message": f"length {len(data)} < minLength {schema['minLength']}"})
+        if "maxLength" in schema and len(data) > schema["maxLength"]:
+            errors.append({"path": path, "message": f"length {len(data)} > maxLength {schema['maxLength']}"})
+        if "pattern" in schema:
+            try:
+                if not re.search(schema["pattern"], data):
+                    errors.append({"path": path, "message": f"does not match pattern '{schema['pattern']}'"})
+            except re.error:
+                errors.append({"path": path, "message": f"invalid regex pattern '{schema['pattern']}'"})
+
+    if schema_type in ("integer", "number"):
+        if "minimum" in schema and data < schema["minimum"]:
+            errors.append({"path": path, "message": f"value {data} < minimum {schema['minimum']}"})
+        if "maximum" in schema and data > schema["maximum"]:
+            errors.append({"path": path, "message": f"value {data} > maximum {schema['maximum']}"})
+
+    if schema_type == "array":
+        if "minItems" in schema and len(data) < schema["minItems"]:
+            errors.append({"path": path, "message": f"items {len(data)} < minItems {schema['minItems']}"})
+        if "maxItems" in schema and len(data) > schema["maxItems"]:
+            errors.append({"path": path, "message": f"items {len(data)} > maxItems {schema['maxItems']}"})
+        items_schema = schema.get("items")
+        if items_schema:
+            for i, item in enumerate(data):
+                errors.extend(interpret(items_schema, item, f"{path}[{i}]"))
+    return errors
+
+def wide_case(width):
+    record = {
+        "type": "object",
+        "required": ["id", "name", "email"],
+        "additionalProperties": False,
+        "properties": {
+            "id": {"type": "integer", "minimum": 1},
+            "name": {"type": "string", "minLength": 1, "maxLength": 64},
+            "email": {"type": "string", "pattern": r"^[^@\s]+@[^@\s]+\.[a-z]+$"},
+            "score": {"type": "number", "minimum": 0, "maximum": 100},
+            "tags": {"type": "array", "maxItems": 8, "items": {"type": "string", "maxLength": 16}},
+        },
+    }
+    schema = {"type": "array", "items": record}
+    data = [{"id": i + 1, "name": f"user{i}", "email": f"user{i}@example.com",
+             "score": i % 101, "tags": ["a", "b", "c"]} for i in range(width)]
+    # A few failures so both sides also build error paths.
+    data[width // 2]["email"] = "not-an-email"
+    data[-1]["score"] = 101
+    return schema, data
+
+def deep_case(depth):
+    schema = {"type": "integer", "minimum": 0}
+    data = 1
+    for i in range(depth):
+        schema = {"type": "object", "required": ["child"],
+                  "properties": {"child": schema, "name": {"type": "string", "maxLength": 32}}}
+        data = {"child": data, "name": f"level{i}"}
+    return schema, data
+
+def post(body, query=''):
+    data = json.dumps(body).encode('utf-8')
+    env = dict(os.environ, REQUEST_METHOD='POST', QUERY_STRING=query, CONTENT_LENGTH=str(len(data)),
+               CONTENT_TYPE='application/json')
+    proc = subprocess.run([sys.executable, '-S', os.path.join(API_DIR, 'validate.cgi')], input=data,
+                          env=env, stdout=subprocess.PIPE, check=True)
+    assert b'Status: 200' in proc.stdout, proc.stdout
+    return proc.stdout
+
+def run_cgi(schema, data, sample):
+    item_schema = schema['items']
+    start = time.perf_counter()
+    for document in data[:sample]:
+        post({'schema': item_schema, 'data': document})
+    single = (time.perf_counter() - start) / sample * len(data)
+    start = time.perf_counter()
+    post({'schema': item_schema, 'documents': data}, 'action=batch')
+    return single, time.perf_counter() - start
+
+def best(func, rounds):
+    times = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rounds', type=int, default=5, help='runs per case (the best one is kept)')
+    parser.add_argument('--width', type=int, default=5000, help='records in the wide document')
+    parser.add_argument('--depth', type=int, default=200, help='nesting of the deep document')
+    parser.add_argument('--sample', type=int, default=20, help='single-document requests to time')
+    args = parser.parse_args(argv)
+
+    sys.setrecursionlimit(max(sys.getrecursionlimit(), args.depth * 4 + 100))
+    for name, (schema, data) in (('wide', wide_case(args.width)), ('deep', deep_case(args.depth))):
+        assert interpret(schema, data) == validate_cgi.compile_schema(schema)(data)
+        validator = validate_cgi.get_validator(schema)
+        interpreted = best(lambda: interpret(schema, data), args.rounds)
+        compiled = best(lambda: validator(data), args.rounds)
+        cold = best(lambda: validate_cgi.compile_schema(schema)(data), args.rounds)
+        print(f"{name}: interpreter {interpreted * 1000:8.2f}ms  compiled {compiled * 1000:8.2f}ms  "
+              f"compile+run {cold * 1000:8.2f}ms  speedup {interpreted / compiled:.1f}x")
+
+    single, batch = run_cgi(*wide_case(args.width), args.sample)
+    print(f"{args.width} requests (estimated): {single:.2f}s  1 batch request: {batch:.2f}s  "
+          f"({args.width / batch:.0f} documents/s)")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,91 @@
+#!/usr/local/bin/python3
+"""visitor.cgi stats: daily rollups vs re-parsing every JSONL line.
+
+    python3 api/bench/bench_visitor_stats.py [--visits 10000 100000] [--tail 100]
+
+For each size, today's log in a scratch DATA_DIR is filled with that many
+visits. "full scan" is get_stats() as it was before rollups (parse, sort
+and count every line); "cold" builds the rollup, "warm" finds nothing new
+and "tail" counts --tail freshly appended visits.
+"""
+import argparse
+import datetime
+import json
+import os
+import sys
+import tempfile
+import time
+import importlib.util
+from importlib.machinery import SourceFileLoader
+
+API_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def load_visitor_cgi():
+    loader = SourceFileLoader('visitor_cgi', os.path.join(API_DIR, 'visitor.cgi'))
+    spec = importlib.util.spec_from_loader(loader.name, loader)
+    module = importlib.util.module_from_spec(spec)
+    loader.exec_module(module)
+    return module
+
+visitor_cgi = load_visitor_cgi()
+
+def full_scan_stats(data_dir, days=7):
+    visitors = []
+    end_date = datetime.datetime.now()
+    for i in range(days + 1):
+        date_str = (end_date - datetime.timedelta(days=days - i)).strftime("%Y-%m-%d")
+        path = os.path.join(data_dir, f"{date_str}.jsonl")
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                visitors.extend(json.loads(line) for line in f if line.strip())
+    today = end_date.strftime("%Y-%m-%d")
+    today_visitors = [v for v in visitors if v['timestamp'].startswith(today)]
+    five_min_ago = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(minutes=5)
+    online = [v for v in visitors if datetime.datetime.fromisoformat(v['timestamp']) > five_min_ago]
+    recent = sorted(visitors, key=lambda x: x['timestamp'], reverse=True)[:100]
+    hourly, countries = {}, {}
+    for v in today_visitors:
+        hourly[v['timestamp'][11:13]] = hourly.get(v['timestamp'][11:13], 0) + 1
+    for v in visitors:
+        countries[v['location']['country']] = countries.get(v['location']['country'], 0) + 1
+    return len(visitors), len(online), recent, hourly, countries
+
+def write_visits(path, count, start, step):
+    locations = list(visitor_cgi.DEMO_LOCATIONS.values())
+    with open(path, 'a', encoding='utf-8') as f:
+        for i in range(count):
+            f.write(json.dumps({
+                "id": f"{i:016x}", "location": locations[i % len(locations)], "page": "/",
+                "referrer": "", "timestamp": (start + step * i).isoformat(),
+                "user_agent": "bench",
+            }) + '\n')
+
+def timed(func):
+    start = time.perf_counter()
+    func()
+    return (time.perf_counter() - start) * 1000
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--visits', type=int, nargs='+', default=[10000, 100000], help='visits in the log')
+    parser.add_argument('--tail', type=int, default=100, help='visits appended before the tail run')
+    args = parser.parse_args(argv)
+
+    for visits in args.visits:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            visitor_cgi.DATA_DIR = tmpdir
+            path = os.path.join(tmpdir, f"{datetime.datetime.now():%Y-%m-%d}.jsonl")
+            # Spread over the last day, like a day's real traffic.
+            day = datetime.timedelta(days=1)
+            write_visits(path, visits, datetime.datetime.now(datetime.timezone.utc) - day, day / visits)
+            full = timed(lambda: full_scan_stats(tmpdir))
+            cold = timed(visitor_cgi.get_stats)
+            warm = timed(visitor_cgi.get_stats)
+            write_visits(path, args.tail, datetime.datetime.now(datetime.timezone.utc), datetime.timedelta(milliseconds=10))
+            tail = timed(visitor_cgi.get_stats)
+            print(f"{visits:7d} visits: full scan {full:8.1f}ms  cold {cold:8.1f}ms  "
+                  f"warm {warm:6.2f}ms  +{args.tail} tail {tail:6.2f}ms")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
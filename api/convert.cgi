@@ -1,53 +1,235 @@
-#!/usr/local/bin/python3
+#!/usr/local/bin/python3 -S
 import sys
 import os
 import math
+from array import array
 
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 import _lib
 
-def convert_temp(val, u_from, u_to):
-    # Convert to Celsius first
-    if u_from == 'c': c = val
-    elif u_from == 'f': c = (val - 32) * 5/9
-    elif u_from == 'k': c = val - 273.15
-    else: raise ValueError(f"Unknown unit {u_from}")
-    
-    # Convert from Celsius
-    if u_to == 'c': 
-        return c, "C"
-    elif u_to == 'f': 
-        return c * 9/5 + 32, "(C * 9/5) + 32"
-    elif u_to == 'k': 
-        return c + 273.15, "C + 273.15"
-    else: raise ValueError(f"Unknown unit {u_to}")
-
-def convert_length(val, u_from, u_to):
-    # Convert to meters first
-    factors = {
-        'mm': 0.001, 'cm': 0.01, 'm': 1.0, 'km': 1000.0,
-        'inch': 0.0254, 'ft': 0.3048
-    }
-    if u_from not in factors: raise ValueError(f"Unknown unit {u_from}")
-    m = val * factors[u_from]
-    
-    if u_to not in factors: raise ValueError(f"Unknown unit {u_to}")
-    return m / factors[u_to], f"val * {factors[u_from]} / {factors[u_to]}"
-
-def convert_pressure(val, u_from, u_to):
-    # Convert to Pascal first
-    factors = {
-        'pa': 1.0, 'kpa': 1000.0, 'mpa': 1000000.0,
-        'bar': 100000.0, 'psi': 6894.76
-    }
-    if u_from not in factors: raise ValueError(f"Unknown unit {u_from}")
-    pa = val * factors[u_from]
-    
-    if u_to not in factors: raise ValueError(f"Unknown unit {u_to}")
-    return pa / factors[u_to], f"val * {factors[u_from]} / {factors[u_to]}"
+# Same query, same answer: let browsers and proxies keep results for a day.
+CACHE_MAX_AGE = 24 * 60 * 60
+
+# POST batches: values per request and body limit
+MAX_BATCH_VALUES = 10000
+MAX_BATCH_CONTENT_LENGTH = 1024 * 1024  # 1MB
+
+# NumPy only pays for its import on large batches (and is usually not on
+# sys.path at all under python3 -S); smaller ones use the array module.
+NUMPY_MIN_VALUES = 256
+_numpy = None
+
+# kind -> unit -> factor to the kind's base unit, or (factor, offset) for
+# affine units: base = (value + offset) * factor. Strings keep decimal
+# factors exact until the conversion table is built.
+UNITS = {
+    "temp": {  # Celsius
+        "c": "1", "f": ("5/9", "-32"), "k": ("1", "-273.15"),
+    },
+    "length": {  # metre
+        "mm": "0.001", "cm": "0.01", "m": "1", "km": "1000",
+        "inch": "0.0254", "ft": "0.3048", "yd": "0.9144", "mi": "1609.344",
+    },
+    "pressure": {  # pascal
+        "pa": "1", "kpa": "1000", "mpa": "1000000", "bar": "100000", "psi": "6894.76",
+    },
+    "mass": {  # kilogram
+        "mg": "0.000001", "g": "0.001", "kg": "1", "t": "1000",
+        "oz": "0.028349523125", "lb": "0.45359237",
+    },
+    "volume": {  # litre
+        "ml": "0.001", "l": "1", "m3": "1000",
+        "floz": "0.0295735295625", "cup": "0.2365882365", "qt": "0.946352946", "gal": "3.785411784",
+    },
+    "speed": {  # metre per second
+        "mps": "1", "kph": "1000/3600", "mph": "0.44704", "knot": "1852/3600", "fps": "0.3048",
+    },
+    "energy": {  # joule
+        "j": "1", "kj": "1000", "cal": "4.184", "kcal": "4184",
+        "wh": "3600", "kwh": "3600000", "btu": "1055.05585262",
+    },
+    "data": {  # byte
+        "bit": "1/8", "b": "1", "kb": "1000", "mb": "1000000", "gb": "1000000000", "tb": "1000000000000",
+        "kib": "1024", "mib": "1048576", "gib": "1073741824", "tib": "1099511627776",
+    },
+}
+
+# GET formula strings from before UNITS existed, kept for the original
+# kinds and units so clients that show or compare them see no change.
+LEGACY_TEMP_FORMULAS = {"c": "C", "f": "(C * 9/5) + 32", "k": "C + 273.15"}
+LEGACY_FACTORS = {
+    "length": {"mm": 0.001, "cm": 0.01, "m": 1.0, "km": 1000.0, "inch": 0.0254, "ft": 0.3048},
+    "pressure": {"pa": 1.0, "kpa": 1000.0, "mpa": 1000000.0, "bar": 100000.0, "psi": 6894.76},
+}
+
+# kind -> {(from, to): (shift, scale, add)}, built on first use
+_tables = {}
+
+def parse_ratio(text):
+    """"0.0254" -> (254, 10000), "5/9" -> (5, 9): exact, unlike float()"""
+    num, _, den = text.partition("/")
+    whole, _, frac = num.partition(".")
+    n, d = int(whole + frac), 10 ** len(frac)
+    if den:
+        return n, d * int(den)
+    return n, d
+
+def conversion_table(kind):
+    """Coefficients for every unit pair of a kind: out = (value + shift) * scale + add
+
+    Factors are combined as integer ratios and rounded to float once (int / int
+    is correctly rounded), so e.g. C to F gets exactly 1.8.
+    """
+    table = _tables.get(kind)
+    if table is None:
+        if kind not in UNITS:
+            raise ValueError("Unknown kind")
+        units = {}
+        for unit, spec in UNITS[kind].items():
+            factor, offset = spec if isinstance(spec, tuple) else (spec, "0")
+            units[unit] = (parse_ratio(factor), parse_ratio(offset))
+        table = {
+            (u_from, u_to): (n_off_from / d_off_from, (n_from * d_to) / (d_from * n_to), -n_off_to / d_off_to)
+            for u_from, ((n_from, d_from), (n_off_from, d_off_from)) in units.items()
+            for u_to, ((n_to, d_to), (n_off_to, d_off_to)) in units.items()
+        }
+        _tables[kind] = table
+    return table
+
+def get_coefficients(kind, u_from, u_to):
+    table = conversion_table(kind)
+    for unit in (u_from, u_to):
+        if unit not in UNITS[kind]:
+            raise ValueError(f"Unknown unit {unit}")
+    return table[(u_from, u_to)]
+
+def format_number(x):
+    return str(int(x)) if x.is_integer() else repr(x)
+
+def describe(coefficients):
+    shift, scale, add = coefficients
+    formula = "val"
+    if shift:
+        formula = f"(val {'-' if shift < 0 else '+'} {format_number(abs(shift))})"
+    if scale != 1:
+        formula += f" * {format_number(scale)}"
+    if add:
+        formula += f" {'-' if add < 0 else '+'} {format_number(abs(add))}"
+    return formula
+
+def formula(kind, u_from, u_to, coefficients):
+    """The legacy string for an original unit pair, else describe()"""
+    if kind == "temp" and u_from in LEGACY_TEMP_FORMULAS and u_to in LEGACY_TEMP_FORMULAS:
+        return LEGACY_TEMP_FORMULAS[u_to]
+    factors = LEGACY_FACTORS.get(kind, {})
+    if u_from in factors and u_to in factors:
+        return f"val * {factors[u_from]} / {factors[u_to]}"
+    return describe(coefficients)
+
+def convert(val, coefficients):
+    shift, scale, add = coefficients
+    return (val + shift) * scale + add
+
+def get_numpy():
+    global _numpy
+    if _numpy is None:
+        try:
+            import numpy
+            _numpy = numpy
+        except ImportError:
+            _numpy = False
+    return _numpy
+
+def to_array(values):
+    """Pack JSON numbers into array('d'), rejecting anything else"""
+    if not isinstance(values, list):
+        raise ValueError("values must be a list")
+    if any(isinstance(v, bool) for v in values):
+        raise ValueError("Invalid value")
+    try:
+        data = array('d', values)
+    except (TypeError, OverflowError):
+        raise ValueError("Invalid value")
+    if not all(map(math.isfinite, data)):
+        raise ValueError("Invalid value")
+    return data
+
+def convert_array(data, coefficients):
+    """Convert a whole array('d') with one pair's coefficients"""
+    shift, scale, add = coefficients
+    numpy = get_numpy() if len(data) >= NUMPY_MIN_VALUES else False
+    if numpy:
+        with numpy.errstate(over='ignore'):
+            results = ((numpy.frombuffer(data, dtype=numpy.float64) + shift) * scale + add).tolist()
+    else:
+        results = [(v + shift) * scale + add for v in data]
+    # Huge inputs can overflow to inf, which JSON cannot carry.
+    if not all(map(math.isfinite, results)):
+        raise ValueError("Result out of range")
+    return results
+
+def convert_values(kind, u_from, u_to, values):
+    """Many values, one unit pair"""
+    return convert_array(to_array(values), get_coefficients(kind, u_from, u_to))
+
+def convert_triples(kind, conversions):
+    """[[value, from, to], ...]: grouped by unit pair, converted a group at a time"""
+    if not isinstance(conversions, list):
+        raise ValueError("conversions must be a list")
+    groups = {}
+    for i, item in enumerate(conversions):
+        if not isinstance(item, list) or len(item) != 3:
+            raise ValueError("Each conversion must be [value, from, to]")
+        value, u_from, u_to = item
+        if not isinstance(u_from, str) or not isinstance(u_to, str):
+            raise ValueError("Missing parameters")
+        indexes, values = groups.setdefault((u_from.lower(), u_to.lower()), ([], []))
+        indexes.append(i)
+        values.append(value)
+
+    results = [None] * len(conversions)
+    for (u_from, u_to), (indexes, values) in groups.items():
+        for i, res in zip(indexes, convert_values(kind, u_from, u_to, values)):
+            results[i] = res
+    return results
+
+def handle_batch():
+    """POST {kind, from, to, values} or {kind, conversions: [[value, from, to], ...]}"""
+    body = _lib.read_json_body(MAX_BATCH_CONTENT_LENGTH)
+    if not isinstance(body, dict):
+        raise ValueError("Invalid request body")
+    kind = body.get('kind')
+    if not isinstance(kind, str):
+        raise ValueError("Unknown kind")
+
+    if 'conversions' in body:
+        items = body['conversions']
+        if isinstance(items, list) and len(items) > MAX_BATCH_VALUES:
+            raise ValueError("Too many values")
+        results = convert_triples(kind, items)
+        _lib.send_response(data={"kind": kind, "results": results, "count": len(results)})
+        return
+
+    values = body.get('values')
+    u_from, u_to = body.get('from'), body.get('to')
+    if not isinstance(u_from, str) or not isinstance(u_to, str) or values is None:
+        raise ValueError("Missing parameters")
+    if isinstance(values, list) and len(values) > MAX_BATCH_VALUES:
+        raise ValueError("Too many values")
+    results = convert_values(kind, u_from.lower(), u_to.lower(), values)
+    _lib.send_response(data={
+        "kind": kind,
+        "from": u_from,
+        "to": u_to,
+        "values": results,
+        "count": len(results)
+    })
 
 def handler():
     method = os.environ.get('REQUEST_METHOD', 'GET')
+    if method == 'POST':
+        handle_batch()
+        return
     if method != 'GET':
         raise ValueError("Method not allowed")
 
@@ -59,28 +241,25 @@ def handler():
         raise ValueError("Invalid value")
     if not math.isfinite(val):
         raise ValueError("Invalid value")
-        
+
     u_from = params.get('from')
     u_to = params.get('to')
-    
+
     if not kind or not u_from or not u_to:
         raise ValueError("Missing parameters")
-        
-    if kind == 'temp':
-        res, formula = convert_temp(val, u_from.lower(), u_to.lower())
-    elif kind == 'length':
-        res, formula = convert_length(val, u_from.lower(), u_to.lower())
-    elif kind == 'pressure':
-        res, formula = convert_pressure(val, u_from.lower(), u_to.lower())
-    else:
-        raise ValueError("Unknown kind")
+
+    u_from_key, u_to_key = u_from.lower(), u_to.lower()
+    coefficients = get_coefficients(kind, u_from_key, u_to_key)
+    result = convert(val, coefficients)
+    if not math.isfinite(result):
+        raise ValueError("Result out of range")
 
     _lib.send_response(data={
         "kind": kind,
         "input": {"value": val, "unit": u_from},
-        "output": {"value": res, "unit": u_to},
-        "formula": formula
-    })
+        "output": {"value": result, "unit": u_to},
+        "formula": formula(kind, u_from_key, u_to_key, coefficients)
+    }, max_age=CACHE_MAX_AGE, etag=True)
 
 if __name__ == "__main__":
     _lib.main(handler)
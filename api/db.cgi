@@ -1,10 +1,11 @@
-#!/usr/local/bin/python3
+#!/usr/local/bin/python3 -S
 import sys
 import os
 import sqlite3
 import json
-import hashlib
 import re
+import base64
+import time
 
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 import _lib
@@ -20,6 +21,79 @@ ALLOWED_ORIGINS = [
 # Maximum limits for safety
 MAX_LIMIT = 1000
 MAX_BATCH_SIZE = 100
+MAX_CURSOR_LENGTH = 1024
+STREAM_BATCH_SIZE = 500
+MAX_IN_VALUES = 500  # stays under SQLITE_MAX_VARIABLE_NUMBER on older builds
+MAX_GROUPS = 1000
+MAX_GROUP_COLUMNS = 8
+MAX_METRICS = 16
+
+COMPARISON_OPERATORS = ('=', '!=', '<', '<=', '>', '>=')
+AGGREGATE_FUNCTIONS = {
+    'count': 'COUNT({})',
+    'count_distinct': 'COUNT(DISTINCT {})',
+    'sum': 'SUM({})',
+    'avg': 'AVG({})',
+    'min': 'MIN({})',
+    'max': 'MAX({})',
+}
+MAX_INDEX_COLUMNS = 8
+
+# Slow-query log: set DB_SLOW_QUERY_MS (e.g. SetEnv DB_SLOW_QUERY_MS 200) to
+# append every operation slower than that, with its query plans, to
+# _data/databases/slow_queries.jsonl (covered by the .htaccess there).
+# Parameter values are not logged.
+try:
+    SLOW_QUERY_MS = float(os.environ["DB_SLOW_QUERY_MS"])
+except (KeyError, ValueError):
+    SLOW_QUERY_MS = None
+SLOW_QUERY_LOG = "slow_queries.jsonl"
+
+# Per-database connection settings, stored as <name>.settings.json next to
+# <name>.db and changed with operation=configure. cache_size is in KiB,
+# mmap_size in bytes and busy_timeout in milliseconds. The defaults keep
+# SQLite's own rollback journal; configure opts a database into WAL.
+DEFAULT_SETTINGS = {
+    "journal_mode": "delete",
+    "synchronous": "full",
+    "cache_size": 2048,
+    "mmap_size": 0,
+    "busy_timeout": 5000,
+}
+SETTING_CHOICES = {
+    "journal_mode": ('delete', 'truncate', 'persist', 'wal'),
+    "synchronous": ('off', 'normal', 'full', 'extra'),
+}
+SETTING_RANGES = {
+    "cache_size": (0, 64 * 1024),
+    "mmap_size": (0, 256 * 1024 * 1024),
+    "busy_timeout": (0, 60 * 1000),
+}
+SYNCHRONOUS_NAMES = ('off', 'normal', 'full', 'extra')
+
+# Prepared statements kept per connection; generated SQL has a few shapes.
+STATEMENT_CACHE_SIZE = 256
+# When db.cgi is loaded into a long-running process (_server.py) connections
+# stay open between requests, so each SQL shape is prepared once per process.
+# A CGI run closes its connection. The pool is least-recently-used first
+# and capped, closing the connection it evicts.
+KEEP_CONNECTIONS = __name__ != "__main__"
+MAX_POOLED_CONNECTIONS = 8
+_connections = {}
+
+WRITE_OPERATIONS = ('insert', 'update', 'delete', 'create_table', 'create_index', 'drop_index')
+BATCH_OPERATIONS = ('select', 'insert', 'update', 'delete', 'count', 'aggregate')
+READ_OPERATIONS = ('select', 'count', 'aggregate', 'explain')
+
+class BatchError(Exception):
+    """A batch operation failed; the whole batch was rolled back"""
+
+    def __init__(self, index, operation, size=1):
+        super().__init__(f"Batch operation {index} ({operation}) failed")
+        self.details = {"index": index, "operation": operation}
+        if size > 1:
+            # Grouped inserts share one statement and fail together.
+            self.details["grouped"] = size
 
 def ensure_database_dir():
     """Ensure database directory exists"""
@@ -59,8 +133,83 @@ def get_db_path(database_name):
     
     return db_path
 
-def execute_select(conn, table, fields=None, where=None, order_by=None, limit=None):
-    """Execute SELECT query"""
+def where_terms(where):
+    """WHERE terms and parameters for a where dictionary
+
+    {"col": value} tests equality; {"col": {op: value, ...}} applies the
+    operators =, !=, <, <=, >, >=, between ([low, high]) and in ([values]).
+    """
+    terms = []
+    params = []
+    if not where or not isinstance(where, dict):
+        return terms, params
+    for key, value in where.items():
+        key = sanitize_identifier(key)
+        if not isinstance(value, dict):
+            terms.append(f"{key} = ?")
+            params.append(value)
+            continue
+        if not value:
+            raise ValueError(f"No operator for {key}")
+        for op, operand in value.items():
+            if op in COMPARISON_OPERATORS:
+                terms.append(f"{key} {op} ?")
+                params.append(operand)
+            elif op == 'between':
+                if not isinstance(operand, list) or len(operand) != 2:
+                    raise ValueError("between takes [low, high]")
+                terms.append(f"{key} BETWEEN ? AND ?")
+                params.extend(operand)
+            elif op == 'in':
+                if not isinstance(operand, list) or not 1 <= len(operand) <= MAX_IN_VALUES:
+                    raise ValueError(f"in takes a list of 1 to {MAX_IN_VALUES} values")
+                terms.append(f"{key} IN ({', '.join(['?'] * len(operand))})")
+                params.extend(operand)
+            else:
+                raise ValueError(f"Unknown operator: {op}")
+    return terms, params
+
+def encode_cursor(table, order, key, rowid):
+    """Opaque continuation token: the last row's order-by value and rowid"""
+    raw = json.dumps([table, order, key, rowid], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+def decode_cursor(token, table, order):
+    """Returns (key, rowid) of a token issued for the same table and order"""
+    if not isinstance(token, str) or len(token) > MAX_CURSOR_LENGTH:
+        raise ValueError("Invalid cursor")
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        cursor_table, cursor_order, key, rowid = json.loads(raw)
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cursor")
+    if cursor_table != table or cursor_order != order or not isinstance(rowid, int):
+        raise ValueError("Cursor does not match query")
+    return key, rowid
+
+def keyset_condition(col, direction, key, rowid):
+    """Rows after (key, rowid) in ORDER BY col direction, rowid direction
+
+    Spelled out instead of a row value comparison because NULL keys sort
+    first (ASC) or last (DESC) but compare as unknown.
+    """
+    if col is None:
+        op = '>' if direction == 'ASC' else '<'
+        return f"_rowid_ {op} ?", [rowid]
+    if direction == 'ASC':
+        if key is None:
+            return f"(({col} IS NULL AND _rowid_ > ?) OR {col} IS NOT NULL)", [rowid]
+        return f"({col} > ? OR ({col} = ? AND _rowid_ > ?))", [key, key, rowid]
+    if key is None:
+        return f"({col} IS NULL AND _rowid_ < ?)", [rowid]
+    return f"({col} < ? OR ({col} = ? AND _rowid_ < ?) OR {col} IS NULL)", [key, key, rowid]
+
+def build_select(table, fields=None, where=None, order_by=None, cursor=None):
+    """Build a SELECT ordered by (order-by column, rowid)
+
+    Two extra trailing columns carry the keyset of each row; callers strip
+    them and turn the last ones into the next cursor.
+    """
     table = sanitize_identifier(table)
     
     # Build SELECT clause
@@ -69,38 +218,90 @@ def execute_select(conn, table, fields=None, where=None, order_by=None, limit=No
     else:
         field_list = '*'
     
-    query = f"SELECT {field_list} FROM {table}"
-    params = []
-    
-    # Build WHERE clause
-    if where and isinstance(where, dict):
-        conditions = []
-        for key, value in where.items():
-            key = sanitize_identifier(key)
-            conditions.append(f"{key} = ?")
-            params.append(value)
-        
-        if conditions:
-            query += " WHERE " + " AND ".join(conditions)
-    
     # Build ORDER BY clause
+    col = None
+    direction = 'ASC'
     if order_by and isinstance(order_by, list) and len(order_by) >= 1:
         col = sanitize_identifier(order_by[0])
         direction = order_by[1].upper() if len(order_by) > 1 else 'ASC'
         if direction not in ('ASC', 'DESC'):
             direction = 'ASC'
-        query += f" ORDER BY {col} {direction}"
+    order = [col, direction]
     
-    # Build LIMIT clause
-    if limit:
-        limit = min(int(limit), MAX_LIMIT)
-        query += f" LIMIT {limit}"
+    query = f"SELECT {field_list}, {col or 'NULL'} AS __cursor_key, _rowid_ AS __cursor_rowid FROM {table}"
     
-    cursor = conn.execute(query, params)
-    columns = [desc[0] for desc in cursor.description]
-    rows = [dict(zip(columns, row)) for row in cursor.fetchall()]
+    # Build WHERE clause
+    conditions, params = where_terms(where)
+    if cursor:
+        condition, cursor_params = keyset_condition(col, direction, *decode_cursor(cursor, table, order))
+        conditions.append(condition)
+        params.extend(cursor_params)
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    
+    if col:
+        query += f" ORDER BY {col} {direction}, _rowid_ {direction}"
+    else:
+        query += f" ORDER BY _rowid_ {direction}"
+    
+    return query, params, table, order
+
+def page_size(limit):
+    if not limit:
+        return MAX_LIMIT
+    return max(1, min(int(limit), MAX_LIMIT))
+
+def execute_select(conn, table, fields=None, where=None, order_by=None, limit=None, cursor=None, format='objects'):
+    """Execute SELECT query, one page of at most MAX_LIMIT rows
+
+    format "objects" returns a dict per row; "columns" returns the column
+    names once and an array per row. next_cursor fetches the following page.
+    """
+    if format not in ('objects', 'columns'):
+        raise ValueError(f"Unknown format: {format}")
+    query, params, table, order = build_select(table, fields, where, order_by, cursor)
+    size = page_size(limit)
+    query += f" LIMIT {size + 1}"
+    
+    cur = conn.execute(query, params)
+    columns = [desc[0] for desc in cur.description][:-2]
+    rows = cur.fetchmany(size + 1)
+    next_cursor = None
+    if len(rows) > size:
+        rows = rows[:size]
+        next_cursor = encode_cursor(table, order, rows[-1][-2], rows[-1][-1])
+    
+    if format == 'columns':
+        result = {"columns": columns, "rows": [list(row)[:-2] for row in rows]}
+    else:
+        result = {"rows": [dict(zip(columns, row)) for row in rows]}
+    result["count"] = len(rows)
+    result["next_cursor"] = next_cursor
+    return result
+
+def stream_select(conn, table, fields=None, where=None, order_by=None, limit=None, cursor=None):
+    """Write matching rows as NDJSON, one fetchmany batch at a time
+
+    Without limit every row is streamed; memory stays at one batch.
+    """
+    query, params, _, _ = build_select(table, fields, where, order_by, cursor)
+    if limit:
+        query += f" LIMIT {max(1, int(limit))}"
     
-    return {"rows": rows, "count": len(rows)}
+    # Errors in the query surface here, before any header is written.
+    cur = conn.execute(query, params)
+    columns = [desc[0] for desc in cur.description][:-2]
+    _lib.start_stream("application/x-ndjson; charset=utf-8")
+    try:
+        while True:
+            rows = cur.fetchmany(STREAM_BATCH_SIZE)
+            if not rows:
+                break
+            sys.stdout.write(''.join(json.dumps(dict(zip(columns, row)), ensure_ascii=False) + '\n' for row in rows))
+            sys.stdout.flush()
+    except Exception as e:
+        # Headers are already out; a truncated body is all we can signal.
+        sys.stderr.write(f"db.cgi stream failed: {e!r}\n")
 
 def execute_insert(conn, table, data):
     """Execute INSERT query"""
@@ -118,6 +319,26 @@ def execute_insert(conn, table, data):
     
     return {"inserted_id": cursor.lastrowid, "affected_rows": cursor.rowcount}
 
+def execute_insert_many(conn, table, rows):
+    """Execute one prepared INSERT for many rows with the same columns"""
+    table = sanitize_identifier(table)
+    columns = [sanitize_identifier(k) for k in rows[0].keys()]
+    placeholders = ', '.join(['?'] * len(columns))
+    column_list = ', '.join(columns)
+
+    query = f"INSERT INTO {table} ({column_list}) VALUES ({placeholders})"
+    # One cursor re-runs the cached statement per row: executemany would
+    # not report each row's id. The caller's transaction covers them all.
+    cursor = conn.cursor()
+    results = []
+    for row in rows:
+        cursor.execute(query, list(row.values()))
+        results.append({"inserted_id": cursor.lastrowid, "affected_rows": cursor.rowcount})
+    if isinstance(conn, LoggedConnection):
+        # One slow-query log entry for the group, not one per row.
+        conn.statements.append((query, None))
+    return results
+
 def execute_update(conn, table, data, where):
     """Execute UPDATE query"""
     table = sanitize_identifier(table)
@@ -137,12 +358,7 @@ def execute_update(conn, table, data, where):
         set_params.append(value)
     
     # Build WHERE clause
-    where_clauses = []
-    where_params = []
-    for key, value in where.items():
-        key = sanitize_identifier(key)
-        where_clauses.append(f"{key} = ?")
-        where_params.append(value)
+    where_clauses, where_params = where_terms(where)
     
     query = f"UPDATE {table} SET {', '.join(set_clauses)} WHERE {' AND '.join(where_clauses)}"
     cursor = conn.execute(query, set_params + where_params)
@@ -157,12 +373,7 @@ def execute_delete(conn, table, where):
         raise ValueError("WHERE clause is required for DELETE")
     
     # Build WHERE clause
-    where_clauses = []
-    params = []
-    for key, value in where.items():
-        key = sanitize_identifier(key)
-        where_clauses.append(f"{key} = ?")
-        params.append(value)
+    where_clauses, params = where_terms(where)
     
     query = f"DELETE FROM {table} WHERE {' AND '.join(where_clauses)}"
     cursor = conn.execute(query, params)
@@ -174,23 +385,88 @@ def execute_count(conn, table, where=None):
     table = sanitize_identifier(table)
     
     query = f"SELECT COUNT(*) as count FROM {table}"
-    params = []
-    
-    if where and isinstance(where, dict):
-        conditions = []
-        for key, value in where.items():
-            key = sanitize_identifier(key)
-            conditions.append(f"{key} = ?")
-            params.append(value)
-        
-        if conditions:
-            query += " WHERE " + " AND ".join(conditions)
+    conditions, params = where_terms(where)
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
     
     cursor = conn.execute(query, params)
     result = cursor.fetchone()
     
     return {"count": result[0]}
 
+def execute_aggregate(conn, table, metrics, group_by=None, where=None, order_by=None, limit=None, format='objects'):
+    """Execute an aggregate query, one row per group
+
+    metrics: [{"fn": "sum", "column": "qty", "as": "total"}, {"fn": "count"}]
+    with fn from AGGREGATE_FUNCTIONS. At most limit (MAX_GROUPS) groups are
+    returned; truncated tells whether there were more.
+    """
+    table = sanitize_identifier(table)
+    if format not in ('objects', 'columns'):
+        raise ValueError(f"Unknown format: {format}")
+    
+    groups = []
+    if group_by:
+        if not isinstance(group_by, list) or len(group_by) > MAX_GROUP_COLUMNS:
+            raise ValueError(f"group_by must be a list of up to {MAX_GROUP_COLUMNS} columns")
+        groups = [sanitize_identifier(col) for col in group_by]
+    
+    if not isinstance(metrics, list) or not metrics or len(metrics) > MAX_METRICS:
+        raise ValueError(f"Metrics must be a list of 1 to {MAX_METRICS} entries")
+    select_terms = list(groups)
+    names = list(groups)
+    for metric in metrics:
+        if not isinstance(metric, dict) or metric.get('fn') not in AGGREGATE_FUNCTIONS:
+            raise ValueError(f"Metric functions: {', '.join(AGGREGATE_FUNCTIONS)}")
+        fn = metric['fn']
+        column = metric.get('column')
+        if column is None:
+            if fn != 'count':
+                raise ValueError(f"{fn} needs a column")
+            expr, default_name = "COUNT(*)", "count"
+        else:
+            column = sanitize_identifier(column)
+            expr, default_name = AGGREGATE_FUNCTIONS[fn].format(column), f"{fn}_{column}"
+        name = sanitize_identifier(metric.get('as') or default_name)
+        if name in names:
+            raise ValueError(f"Duplicate result column: {name}")
+        select_terms.append(f"{expr} AS {name}")
+        names.append(name)
+    
+    query = f"SELECT {', '.join(select_terms)} FROM {table}"
+    conditions, params = where_terms(where)
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    if groups:
+        query += f" GROUP BY {', '.join(groups)}"
+    
+    # Order by a group column or metric name; groups by default.
+    if order_by and isinstance(order_by, list) and len(order_by) >= 1:
+        col = sanitize_identifier(order_by[0])
+        if col not in names:
+            raise ValueError(f"Cannot order by {col}")
+        direction = order_by[1].upper() if len(order_by) > 1 else 'ASC'
+        if direction not in ('ASC', 'DESC'):
+            direction = 'ASC'
+        query += f" ORDER BY {col} {direction}"
+    elif groups:
+        query += f" ORDER BY {', '.join(groups)}"
+    
+    size = max(1, min(int(limit), MAX_GROUPS)) if limit else MAX_GROUPS
+    query += f" LIMIT {size + 1}"
+    
+    rows = conn.execute(query, params).fetchall()
+    truncated = len(rows) > size
+    rows = rows[:size]
+    
+    if format == 'columns':
+        result = {"columns": names, "rows": [list(row) for row in rows]}
+    else:
+        result = {"rows": [dict(zip(names, row)) for row in rows]}
+    result["groups"] = len(rows)
+    result["truncated"] = truncated
+    return result
+
 def execute_create_table(conn, table, schema):
     """Execute CREATE TABLE query"""
     table = sanitize_identifier(table)
@@ -217,6 +493,452 @@ def execute_create_table(conn, table, schema):
     
     return {"table_created": table}
 
+def sql_literal(value):
+    """Render a constant for a partial index, which cannot bind parameters"""
+    if value is None:
+        return "NULL"
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    if isinstance(value, int):
+        return str(value)
+    if isinstance(value, float) and value == value and value not in (float('inf'), float('-inf')):
+        return repr(value)
+    if isinstance(value, str):
+        return "'" + value.replace("'", "''") + "'"
+    raise ValueError("Invalid partial index value")
+
+def execute_create_index(conn, table, columns, name=None, unique=False, where=None, not_null=None):
+    """Execute CREATE INDEX query
+
+    columns: ["a", ["b", "DESC"]]. where ({col: value}, None meaning IS NULL)
+    and not_null ([col, ...]) make it a partial index.
+    """
+    table = sanitize_identifier(table)
+    
+    if not isinstance(columns, list) or not columns or len(columns) > MAX_INDEX_COLUMNS:
+        raise ValueError(f"Columns must be a list of 1 to {MAX_INDEX_COLUMNS} names")
+    
+    terms = []
+    names = []
+    for column in columns:
+        if isinstance(column, list) and len(column) == 2:
+            col, direction = sanitize_identifier(column[0]), str(column[1]).upper()
+            if direction not in ('ASC', 'DESC'):
+                raise ValueError(f"Invalid direction: {column[1]}")
+            terms.append(f"{col} {direction}")
+        else:
+            col = sanitize_identifier(column)
+            terms.append(col)
+        names.append(col)
+    
+    name = sanitize_identifier(name) if name else f"idx_{table}_{'_'.join(names)}"
+    
+    conditions = []
+    if where:
+        if not isinstance(where, dict):
+            raise ValueError("Partial index where must be a dictionary")
+        for key, value in where.items():
+            key = sanitize_identifier(key)
+            if value is None:
+                conditions.append(f"{key} IS NULL")
+            else:
+                conditions.append(f"{key} = {sql_literal(value)}")
+    if not_null:
+        if not isinstance(not_null, list):
+            raise ValueError("not_null must be a list of columns")
+        conditions.extend(f"{sanitize_identifier(key)} IS NOT NULL" for key in not_null)
+    
+    query = f"CREATE {'UNIQUE ' if unique else ''}INDEX IF NOT EXISTS {name} ON {table} ({', '.join(terms)})"
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    conn.execute(query)
+    
+    return {"index_created": name}
+
+def execute_drop_index(conn, name):
+    """Execute DROP INDEX query"""
+    name = sanitize_identifier(name)
+    
+    # Only indexes this API could have created: not a table's internal ones.
+    row = conn.execute("SELECT sql FROM sqlite_master WHERE type = 'index' AND name = ?", (name,)).fetchone()
+    if row is not None and row[0] is None:
+        raise ValueError(f"Cannot drop automatic index: {name}")
+    conn.execute(f"DROP INDEX IF EXISTS {name}")
+    
+    return {"index_dropped": name, "existed": row is not None}
+
+def query_plan(conn, query, params):
+    """EXPLAIN QUERY PLAN rows as {id, parent, detail}"""
+    # The base execute keeps plans out of LoggedConnection.statements.
+    execute = sqlite3.Connection.execute
+    # A cached EXPLAIN never notices schema changes; keying its text on the
+    # schema version makes a new index show up in the next plan.
+    version = execute(conn, "PRAGMA schema_version").fetchone()[0]
+    cur = execute(conn, f"EXPLAIN QUERY PLAN /* schema {version} */ {query}", params)
+    return [{"id": row[0], "parent": row[1], "detail": row[3]} for row in cur.fetchall()]
+
+def execute_explain(conn, table, fields=None, where=None, order_by=None, limit=None, cursor=None):
+    """Return the plan SQLite would use for the same select
+
+    full_scan lists tables read without an index (SCAN t, as opposed to
+    SEARCH t USING INDEX or a covering SCAN t USING INDEX).
+    """
+    query, params, _, _ = build_select(table, fields, where, order_by, cursor)
+    query += f" LIMIT {page_size(limit) + 1}"
+    plan = query_plan(conn, query, params)
+    
+    return {
+        "sql": query,
+        "plan": plan,
+        "full_scan": [step["detail"] for step in plan
+                      if step["detail"].startswith("SCAN ") and " USING " not in step["detail"]],
+        "temp_btree": [step["detail"] for step in plan if "TEMP B-TREE" in step["detail"]],
+    }
+
+class Connection(sqlite3.Connection):
+    """Connection that knows its database name"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.database = None
+
+class LoggedConnection(Connection):
+    """Connection that remembers its statements for the slow-query log"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.statements = []
+
+    def execute(self, sql, parameters=()):
+        self.statements.append((sql, parameters))
+        return super().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        # No single parameter set to explain with.
+        self.statements.append((sql, None))
+        return super().executemany(sql, seq_of_parameters)
+
+def get_settings_path(database):
+    return os.path.join(DATABASE_DIR, f"{sanitize_identifier(database)}.settings.json")
+
+def validate_settings(settings):
+    """Normalized copy of the given settings; unknown keys are rejected"""
+    if not isinstance(settings, dict):
+        raise ValueError("Settings must be a dictionary")
+    result = {}
+    for key, value in settings.items():
+        if key in SETTING_CHOICES:
+            value = str(value).lower()
+            if value not in SETTING_CHOICES[key]:
+                raise ValueError(f"{key} must be one of {', '.join(SETTING_CHOICES[key])}")
+        elif key in SETTING_RANGES:
+            low, high = SETTING_RANGES[key]
+            if isinstance(value, bool) or not isinstance(value, int) or not low <= value <= high:
+                raise ValueError(f"{key} must be an integer from {low} to {high}")
+        else:
+            raise ValueError(f"Unknown setting: {key}")
+        result[key] = value
+    return result
+
+def load_settings(path):
+    """Defaults overlaid with the database's settings file, if any"""
+    settings = dict(DEFAULT_SETTINGS)
+    try:
+        with open(path, encoding="utf-8") as f:
+            settings.update(validate_settings(json.load(f)))
+    except FileNotFoundError:
+        pass
+    except (OSError, ValueError) as e:
+        sys.stderr.write(f"db.cgi ignoring settings {path}: {e!r}\n")
+    return settings
+
+def save_settings(path, settings):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(settings, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+def settings_version(path):
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+def apply_settings(conn, settings):
+    # busy_timeout first, so switching the journal mode waits for other writers.
+    conn.execute(f"PRAGMA busy_timeout = {int(settings['busy_timeout'])}")
+    conn.execute(f"PRAGMA journal_mode = {settings['journal_mode']}")
+    conn.execute(f"PRAGMA synchronous = {settings['synchronous']}")
+    conn.execute(f"PRAGMA cache_size = -{int(settings['cache_size'])}")
+    conn.execute(f"PRAGMA mmap_size = {int(settings['mmap_size'])}")
+
+def effective_settings(conn):
+    """The values SQLite is actually using on this connection"""
+    def pragma(name):
+        return conn.execute(f"PRAGMA {name}").fetchone()[0]
+
+    cache_size = pragma("cache_size")
+    return {
+        "journal_mode": pragma("journal_mode"),
+        "synchronous": SYNCHRONOUS_NAMES[pragma("synchronous")],
+        # Negative values are KiB, positive ones pages.
+        "cache_size": -cache_size if cache_size < 0 else cache_size * pragma("page_size") // 1024,
+        "mmap_size": pragma("mmap_size"),
+        "busy_timeout": pragma("busy_timeout"),
+    }
+
+def connect(database):
+    """Open (or reuse) a database connection with its settings applied"""
+    db_path = get_db_path(database)
+    settings_path = get_settings_path(database)
+    version = settings_version(settings_path)
+    factory = Connection if SLOW_QUERY_MS is None else LoggedConnection
+
+    cached = _connections.pop(db_path, None)
+    if cached is not None:
+        conn, cached_version = cached
+        if cached_version == version and type(conn) is factory:
+            _connections[db_path] = cached
+            return conn
+        conn.close()
+
+    settings = load_settings(settings_path)
+    conn = sqlite3.connect(
+        db_path,
+        timeout=settings["busy_timeout"] / 1000,
+        factory=factory,
+        cached_statements=STATEMENT_CACHE_SIZE,
+        # Requests on the long-running server are serialized but may come
+        # from different threads.
+        check_same_thread=False,
+    )
+    conn.database = database
+    conn.row_factory = sqlite3.Row
+    apply_settings(conn, settings)
+    if KEEP_CONNECTIONS:
+        while len(_connections) >= MAX_POOLED_CONNECTIONS:
+            oldest, _ = _connections.pop(next(iter(_connections)))
+            oldest.close()
+        _connections[db_path] = (conn, version)
+    return conn
+
+def release(conn):
+    """End a request's use of a connection from connect()"""
+    if conn.in_transaction:
+        conn.rollback()
+    # execute_batch switches to explicit transactions.
+    conn.isolation_level = ''
+    if not any(cached is conn for cached, _ in _connections.values()):
+        conn.close()
+
+def close_connections():
+    """Close connections kept open between requests"""
+    while _connections:
+        _, (conn, _) = _connections.popitem()
+        conn.close()
+
+def execute_configure(conn, settings=None):
+    """Update the database's settings and apply them; returns both views"""
+    path = get_settings_path(conn.database)
+    current = load_settings(path)
+    if settings:
+        current.update(validate_settings(settings))
+        save_settings(path, current)
+        apply_settings(conn, current)
+        # Not pooled any more: release() closes it and the next request
+        # opens a connection with the new settings from the start.
+        _connections.pop(get_db_path(conn.database), None)
+    return {"settings": current, "effective": effective_settings(conn)}
+
+def log_slow_query(conn, operation, elapsed_ms):
+    """Append one JSON line with the operation's statements and plans"""
+    statements = []
+    for sql, params in conn.statements:
+        entry = {"sql": sql}
+        if params is not None and sql.lstrip().upper().startswith(('SELECT', 'UPDATE', 'DELETE', 'INSERT')):
+            try:
+                entry["plan"] = [step["detail"] for step in query_plan(conn, sql, params)]
+            except sqlite3.Error:
+                pass
+        statements.append(entry)
+    record = {
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "database": conn.database,
+        "operation": operation,
+        "ms": round(elapsed_ms, 1),
+        "statements": statements,
+    }
+    try:
+        with open(os.path.join(DATABASE_DIR, SLOW_QUERY_LOG), "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    except OSError as e:
+        sys.stderr.write(f"db.cgi slow-query log failed: {e!r}\n")
+
+def timed(conn, operation, func, *args, **kwargs):
+    """Run func, logging it when it takes SLOW_QUERY_MS or longer"""
+    if SLOW_QUERY_MS is None or not isinstance(conn, LoggedConnection):
+        return func(*args, **kwargs)
+    conn.statements = []
+    start = time.perf_counter()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        if elapsed_ms >= SLOW_QUERY_MS:
+            log_slow_query(conn, operation, elapsed_ms)
+
+def execute_operation(conn, op):
+    """Execute one operation described like a query request body"""
+    operation = op.get('operation', '')
+    table = op.get('table', '')
+
+    if operation == 'configure':
+        return execute_configure(conn, op.get('settings'))
+
+    if operation == 'drop_index':
+        name = op.get('name')
+        if not name:
+            raise ValueError("Index name is required for drop_index")
+        return execute_drop_index(conn, name)
+
+    if not table:
+        raise ValueError("Table name is required")
+
+    if operation == 'select':
+        return execute_select(
+            conn,
+            table,
+            fields=op.get('fields'),
+            where=op.get('where'),
+            order_by=op.get('order_by'),
+            limit=op.get('limit'),
+            cursor=op.get('cursor'),
+            format=op.get('format') or 'objects'
+        )
+
+    elif operation == 'insert':
+        data = op.get('data')
+        if not data:
+            raise ValueError("Data is required for insert")
+        return execute_insert(conn, table, data)
+
+    elif operation == 'update':
+        data = op.get('data')
+        where = op.get('where')
+        if not data or not where:
+            raise ValueError("Data and where are required for update")
+        return execute_update(conn, table, data, where)
+
+    elif operation == 'delete':
+        where = op.get('where')
+        if not where:
+            raise ValueError("Where is required for delete")
+        return execute_delete(conn, table, where)
+
+    elif operation == 'count':
+        return execute_count(conn, table, where=op.get('where'))
+
+    elif operation == 'aggregate':
+        return execute_aggregate(
+            conn,
+            table,
+            op.get('metrics'),
+            group_by=op.get('group_by'),
+            where=op.get('where'),
+            order_by=op.get('order_by'),
+            limit=op.get('limit'),
+            format=op.get('format') or 'objects'
+        )
+
+    elif operation == 'create_table':
+        schema = op.get('schema')
+        if not schema:
+            raise ValueError("Schema is required for create_table")
+        return execute_create_table(conn, table, schema)
+
+    elif operation == 'create_index':
+        return execute_create_index(
+            conn,
+            table,
+            op.get('columns'),
+            name=op.get('name'),
+            unique=op.get('unique') is True,
+            where=op.get('where'),
+            not_null=op.get('not_null')
+        )
+
+    elif operation == 'explain':
+        return execute_explain(
+            conn,
+            table,
+            fields=op.get('fields'),
+            where=op.get('where'),
+            order_by=op.get('order_by'),
+            limit=op.get('limit'),
+            cursor=op.get('cursor')
+        )
+
+    else:
+        raise ValueError(f"Unknown operation: {operation}")
+
+def insert_group_key(op):
+    """Inserts with the same key can share one prepared statement"""
+    data = op.get('data')
+    if op.get('operation') != 'insert' or not isinstance(data, dict) or not data:
+        return None
+    return (op.get('table'), tuple(data.keys()))
+
+def plan_batch(operations, group_inserts=True):
+    """Split operations into runs of (start index, operations)
+
+    Consecutive inserts into the same table with the same columns form
+    one run; every other operation runs on its own.
+    """
+    if not isinstance(operations, list) or not operations:
+        raise ValueError("Operations must be a non-empty list")
+    if len(operations) > MAX_BATCH_SIZE:
+        raise ValueError(f"Too many operations (max {MAX_BATCH_SIZE})")
+
+    runs = []
+    last_key = None
+    for index, op in enumerate(operations):
+        if not isinstance(op, dict) or op.get('operation') not in BATCH_OPERATIONS:
+            raise ValueError(f"Invalid batch operation at {index}")
+        key = insert_group_key(op) if group_inserts else None
+        if key is not None and key == last_key:
+            runs[-1][1].append(op)
+        else:
+            runs.append((index, [op]))
+        last_key = key
+    return runs
+
+def execute_batch(conn, operations, group_inserts=True):
+    """Execute operations in order in one transaction, all or nothing"""
+    runs = plan_batch(operations, group_inserts)
+    read_only = all(op['operation'] in READ_OPERATIONS for op in operations)
+
+    # Explicit transaction control: one BEGIN, one COMMIT (one fsync).
+    conn.isolation_level = None
+    conn.execute("BEGIN" if read_only else "BEGIN IMMEDIATE")
+    results = []
+    try:
+        for index, ops in runs:
+            try:
+                if len(ops) > 1:
+                    results.extend(timed(conn, 'insert', execute_insert_many, conn, ops[0]['table'],
+                                         [op['data'] for op in ops]))
+                else:
+                    results.append(timed(conn, ops[0]['operation'], execute_operation, conn, ops[0]))
+            except (ValueError, sqlite3.Error) as e:
+                sys.stderr.write(f"db.cgi batch operation {index} failed: {e!r}\n")
+                raise BatchError(index, ops[0]['operation'], len(ops)) from e
+        conn.execute("COMMIT")
+    except Exception:
+        conn.rollback()
+        raise
+    return results
+
 def handler():
     method = os.environ.get('REQUEST_METHOD', 'GET')
     
@@ -237,75 +959,51 @@ def handler():
     if not database:
         raise ValueError("Database name is required")
     
-    # Get database path
-    db_path = get_db_path(database)
-    
     # Connect to database
-    conn = sqlite3.connect(db_path)
-    conn.row_factory = sqlite3.Row
+    conn = connect(database)
     
     try:
-        if action == 'query':
-            operation = body.get('operation', '')
-            table = body.get('table', '')
-            
-            if not table:
+        if action == 'query' and body.get('operation') == 'select' and body.get('format') == 'ndjson':
+            if not body.get('table'):
                 raise ValueError("Table name is required")
-            
-            result = None
-            
-            if operation == 'select':
-                result = execute_select(
-                    conn,
-                    table,
-                    fields=body.get('fields'),
-                    where=body.get('where'),
-                    order_by=body.get('order_by'),
-                    limit=body.get('limit')
-                )
-            
-            elif operation == 'insert':
-                data = body.get('data')
-                if not data:
-                    raise ValueError("Data is required for insert")
-                result = execute_insert(conn, table, data)
-                conn.commit()
-            
-            elif operation == 'update':
-                data = body.get('data')
-                where = body.get('where')
-                if not data or not where:
-                    raise ValueError("Data and where are required for update")
-                result = execute_update(conn, table, data, where)
-                conn.commit()
-            
-            elif operation == 'delete':
-                where = body.get('where')
-                if not where:
-                    raise ValueError("Where is required for delete")
-                result = execute_delete(conn, table, where)
-                conn.commit()
-            
-            elif operation == 'count':
-                result = execute_count(conn, table, where=body.get('where'))
-            
-            elif operation == 'create_table':
-                schema = body.get('schema')
-                if not schema:
-                    raise ValueError("Schema is required for create_table")
-                result = execute_create_table(conn, table, schema)
+            timed(
+                conn,
+                'select',
+                stream_select,
+                conn,
+                body['table'],
+                fields=body.get('fields'),
+                where=body.get('where'),
+                order_by=body.get('order_by'),
+                limit=body.get('limit'),
+                cursor=body.get('cursor')
+            )
+        
+        elif action == 'query':
+            result = timed(conn, body.get('operation'), execute_operation, conn, body)
+            if body.get('operation') in WRITE_OPERATIONS:
                 conn.commit()
             
-            else:
-                raise ValueError(f"Unknown operation: {operation}")
-            
             _lib.send_response(data=result)
         
+        elif action == 'batch':
+            try:
+                results = execute_batch(conn, body.get('operations'), body.get('group_inserts', True) is not False)
+            except BatchError as e:
+                _lib.send_response(error={
+                    "code": "batch_failed",
+                    "message": "Batch rolled back",
+                    "details": e.details,
+                }, status=400)
+                return
+            
+            _lib.send_response(data={"results": results, "count": len(results)})
+        
         else:
             raise ValueError(f"Unknown action: {action}")
     
     finally:
-        conn.close()
+        release(conn)
 
 if __name__ == "__main__":
     _lib.main(handler)
@@ -3,6 +3,9 @@ import sys
 import os
 import json
 import io
+import gzip
+import time
+import uuid
 import importlib.util
 
 from importlib.machinery import SourceFileLoader
@@ -84,6 +87,10 @@ class TestApi(unittest.TestCase):
         res = self.get_json_output()
         self.assertTrue(res['ok'])
         self.assertEqual(len(res['data']['uuids']), 5)
+        for value in res['data']['uuids']:
+            parsed = uuid.UUID(value)
+            self.assertEqual((parsed.version, parsed.variant), (4, uuid.RFC_4122))
+            self.assertEqual(str(parsed), value)
 
     def test_convert(self):
         os.environ['REQUEST_METHOD'] = 'GET'
@@ -92,6 +99,160 @@ class TestApi(unittest.TestCase):
         res = self.get_json_output()
         self.assertTrue(res['ok'])
         self.assertEqual(res['data']['output']['value'], 212)
+        self.assertEqual(res['data']['formula'], '(C * 9/5) + 32')
+
+    def test_convert_keeps_legacy_formulas(self):
+        cases = [
+            ('temp', 'f', 'k', 'C + 273.15'), ('length', 'inch', 'cm', 'val * 0.0254 / 0.01'),
+            ('pressure', 'bar', 'psi', 'val * 100000.0 / 6894.76'), ('length', 'mi', 'km', 'val * 1.609344'),
+            ('mass', 'lb', 'kg', 'val * 0.45359237'),
+        ]
+        for kind, u_from, u_to, expected in cases:
+            with self.subTest(kind=kind, u_from=u_from, u_to=u_to):
+                coefficients = convert_cgi.get_coefficients(kind, u_from, u_to)
+                self.assertEqual(convert_cgi.formula(kind, u_from, u_to, coefficients), expected)
+
+    def test_uuid_v7_and_ulid_are_ordered(self):
+        os.environ['REQUEST_METHOD'] = 'GET'
+        os.environ['QUERY_STRING'] = 'n=50&version=7'
+        uuid_cgi.handler()
+        values = self.get_json_output()['data']['uuids']
+        self.assertEqual(values, sorted(values))
+        for value in values:
+            parsed = uuid.UUID(value)
+            self.assertEqual((parsed.version, parsed.variant), (7, uuid.RFC_4122))
+        self.assertLessEqual(abs(int(values[0][:8] + values[0][9:13], 16) / 1000 - time.time()), 5)
+
+        ulids = uuid_cgi.generate('ulid', 5000)
+        self.assertEqual(ulids, sorted(ulids))
+        self.assertEqual(len(set(ulids)), 5000)
+        self.assertTrue(all(len(value) == 26 and set(value) <= set(uuid_cgi.CROCKFORD) for value in ulids))
+
+    def test_uuid_bulk_stream(self):
+        os.environ['REQUEST_METHOD'] = 'GET'
+        os.environ['QUERY_STRING'] = 'n=20000&version=7&format=text'
+        uuid_cgi.handler()
+        head, body = self.stdout.getvalue().split('\n\n', 1)
+        self.assertIn('Content-Type: text/plain', head)
+        lines = body.splitlines()
+        self.assertEqual(len(lines), 20000)
+        self.assertEqual(lines, sorted(lines))
+
+        self.stdout.seek(0)
+        self.stdout.truncate()
+        os.environ['QUERY_STRING'] = 'n=3&version=ulid&format=ndjson'
+        uuid_cgi.handler()
+        body = self.stdout.getvalue().split('\n\n', 1)[1]
+        self.assertEqual(len([json.loads(line) for line in body.splitlines()]), 3)
+
+    def test_uuid_limits(self):
+        for query in ('n=51', 'n=50001&format=text', 'version=5', 'format=xml'):
+            with self.subTest(query=query):
+                self.stdout.seek(0)
+                self.stdout.truncate()
+                os.environ['REQUEST_METHOD'] = 'GET'
+                os.environ['QUERY_STRING'] = query
+                uuid_cgi._lib.main(uuid_cgi.handler)
+                self.assertFalse(self.get_json_output()['ok'])
+
+    def post_convert(self, body):
+        os.environ['REQUEST_METHOD'] = 'POST'
+        body = json.dumps(body)
+        sys.stdin = io.StringIO(body)
+        os.environ['CONTENT_LENGTH'] = str(len(body))
+        convert_cgi._lib.main(convert_cgi.handler)
+        return self.get_json_output()
+
+    def test_convert_registry_kinds(self):
+        cases = [
+            ('temp', 'f', 'c', 212, 100), ('temp', 'k', 'c', 0, -273.15),
+            ('mass', 'lb', 'g', 1, 453.59237), ('volume', 'gal', 'l', 1, 3.785411784),
+            ('speed', 'kph', 'mps', 36, 10), ('energy', 'kwh', 'kj', 1, 3600),
+            ('data', 'gib', 'mib', 1, 1024), ('data', 'b', 'bit', 1, 8),
+        ]
+        for kind, u_from, u_to, value, expected in cases:
+            with self.subTest(kind=kind, u_from=u_from, u_to=u_to):
+                coefficients = convert_cgi.get_coefficients(kind, u_from, u_to)
+                self.assertAlmostEqual(convert_cgi.convert(value, coefficients), expected, places=9)
+        self.assertEqual(convert_cgi.describe(convert_cgi.get_coefficients('temp', 'c', 'f')), 'val * 1.8 + 32')
+        with self.assertRaises(ValueError):
+            convert_cgi.get_coefficients('mass', 'kg', 'm')
+
+    def test_convert_batch_values(self):
+        res = self.post_convert({'kind': 'temp', 'from': 'C', 'to': 'F', 'values': list(range(-40, 5000))})
+        self.assertTrue(res['ok'])
+        self.assertEqual(res['data']['count'], 5040)
+        self.assertEqual(res['data']['values'][:2], [-40, -38.2])
+        self.assertEqual(res['data']['values'][140], 212)
+
+    def test_convert_batch_triples(self):
+        res = self.post_convert({'kind': 'length', 'conversions': [[1, 'km', 'm'], [12, 'inch', 'ft'], [2, 'km', 'm']]})
+        self.assertEqual(res['data']['results'], [1000, 1, 2000])
+
+    def test_convert_batch_rejects_bad_values(self):
+        for values in (['1'], [True], [1, None]):
+            with self.subTest(values=values):
+                self.stdout.seek(0)
+                self.stdout.truncate()
+                res = self.post_convert({'kind': 'length', 'from': 'm', 'to': 'km', 'values': values})
+                self.assertFalse(res['ok'])
+
+    def test_convert_rejects_out_of_range(self):
+        bodies = [
+            {'kind': 'mass', 'from': 't', 'to': 'mg', 'values': [10 ** 400]},
+            {'kind': 'mass', 'from': 't', 'to': 'mg', 'values': [1e308]},
+            {'kind': 'mass', 'from': 't', 'to': 'mg', 'values': [1] * 300 + [1e308]},
+            {'kind': 'mass', 'conversions': [[1e308, 't', 'mg']]},
+        ]
+        for body in bodies:
+            with self.subTest(values=str(body)[:60]):
+                self.stdout.seek(0)
+                self.stdout.truncate()
+                res = self.post_convert(body)
+                self.assertFalse(res['ok'])
+                self.assertEqual(res['error']['code'], 'bad_request')
+
+        self.stdout.seek(0)
+        self.stdout.truncate()
+        os.environ['REQUEST_METHOD'] = 'GET'
+        os.environ['QUERY_STRING'] = 'kind=mass&value=1e308&from=t&to=mg'
+        convert_cgi._lib.main(convert_cgi.handler)
+        self.assertFalse(self.get_json_output()['ok'])
+
+    def test_convert_is_cacheable(self):
+        os.environ['REQUEST_METHOD'] = 'GET'
+        os.environ['QUERY_STRING'] = 'kind=temp&value=100&from=c&to=f'
+        convert_cgi.handler()
+        headers = dict(line.split(': ', 1) for line in self.stdout.getvalue().split('\n\n', 1)[0].splitlines())
+        self.assertIn('max-age=86400', headers['Cache-Control'])
+        self.assertNotIn('Pragma', headers)
+
+        self.stdout.seek(0)
+        self.stdout.truncate()
+        os.environ['HTTP_IF_NONE_MATCH'] = headers['ETag']
+        convert_cgi.handler()
+        head, _, body = self.stdout.getvalue().partition('\n\n')
+        self.assertIn('Status: 304 Not Modified', head)
+        self.assertIn(f"ETag: {headers['ETag']}", head)
+        self.assertEqual(body, '')
+
+    def test_large_response_is_gzipped(self):
+        raw = io.BytesIO()
+        sys.stdout = io.TextIOWrapper(raw, encoding='utf-8', write_through=True)
+        os.environ['REQUEST_METHOD'] = 'GET'
+        os.environ['HTTP_ACCEPT_ENCODING'] = 'deflate, gzip;q=0.5'
+        convert_cgi._lib.send_response(data={'text': 'x' * 5000})
+        head, _, body = raw.getvalue().partition(b'\n\n')
+        self.assertIn(b'Content-Encoding: gzip', head)
+        self.assertIn(b'no-store', head)
+        self.assertEqual(json.loads(gzip.decompress(body))['data']['text'], 'x' * 5000)
+
+    def test_errors_are_not_cached(self):
+        os.environ['REQUEST_METHOD'] = 'GET'
+        convert_cgi._lib.send_response(error={'code': 'bad_request'}, status=400, max_age=60, etag=True)
+        output = self.stdout.getvalue()
+        self.assertIn('Cache-Control: no-store', output)
+        self.assertNotIn('ETag', output)
 
     def test_validate_valid(self):
         os.environ['REQUEST_METHOD'] = 'POST'
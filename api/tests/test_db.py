@@ -0,0 +1,300 @@
+import io
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import unittest
+import importlib.util
+
+from importlib.machinery import SourceFileLoader
+
+def load_cgi_module(name):
+    path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', f'{name}.cgi'))
+    module_name = f"cgi_api_{name}"
+    loader = SourceFileLoader(module_name, path)
+    spec = importlib.util.spec_from_loader(module_name, loader)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[module_name] = module
+    spec.loader.exec_module(module)
+    return module
+
+db_cgi = load_cgi_module('db')
+
+class TestDb(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.original_dir = db_cgi.DATABASE_DIR
+        db_cgi.DATABASE_DIR = self.tmpdir.name
+        self.original_environ = os.environ.copy()
+        self.original_stdout = sys.stdout
+        self.original_stdin = sys.stdin
+        self.request('query', operation='create_table', table='items',
+                     schema={'id': 'INTEGER PRIMARY KEY', 'name': 'TEXT NOT NULL', 'qty': 'INTEGER'})
+
+    def tearDown(self):
+        db_cgi.close_connections()
+        sys.stdout = self.original_stdout
+        sys.stdin = self.original_stdin
+        os.environ = self.original_environ
+        db_cgi.DATABASE_DIR = self.original_dir
+        self.tmpdir.cleanup()
+
+    def call(self, action, **fields):
+        body = json.dumps(dict(fields, action=action, database='test'))
+        os.environ['REQUEST_METHOD'] = 'POST'
+        os.environ['HTTP_ORIGIN'] = 'http://localhost'
+        os.environ['CONTENT_LENGTH'] = str(len(body))
+        sys.stdin = io.StringIO(body)
+        sys.stdout = io.StringIO()
+        db_cgi._lib.main(db_cgi.handler)
+        output = sys.stdout.getvalue()
+        sys.stdout = self.original_stdout
+        return output.split('\n\n', 1)
+
+    def request(self, action, **fields):
+        return json.loads(self.call(action, **fields)[1])
+
+    def insert_rows(self, qtys):
+        res = self.request('batch', operations=[
+            {'operation': 'insert', 'table': 'items', 'data': {'name': f'n{i}', 'qty': qty}}
+            for i, qty in enumerate(qtys)
+        ])
+        self.assertTrue(res['ok'])
+
+    def count(self):
+        return self.request('query', operation='count', table='items')['data']['count']
+
+    def test_batch_runs_in_order(self):
+        res = self.request('batch', operations=[
+            {'operation': 'insert', 'table': 'items', 'data': {'name': 'a', 'qty': 1}},
+            {'operation': 'insert', 'table': 'items', 'data': {'name': 'b', 'qty': 2}},
+            {'operation': 'insert', 'table': 'items', 'data': {'name': 'c', 'qty': 3}},
+            {'operation': 'update', 'table': 'items', 'data': {'qty': 20}, 'where': {'name': 'b'}},
+            {'operation': 'insert', 'table': 'items', 'data': {'name': 'd'}},
+            {'operation': 'select', 'table': 'items', 'fields': ['name', 'qty'], 'order_by': ['name']},
+            {'operation': 'count', 'table': 'items'},
+        ])
+        self.assertTrue(res['ok'])
+        results = res['data']['results']
+        self.assertEqual(res['data']['count'], 7)
+        self.assertEqual(results[:3], [{'inserted_id': i, 'affected_rows': 1} for i in (1, 2, 3)])
+        self.assertEqual(results[3], {'affected_rows': 1})
+        self.assertEqual(results[4]['inserted_id'], 4)
+        self.assertEqual([(r['name'], r['qty']) for r in results[5]['rows']],
+                         [('a', 1), ('b', 20), ('c', 3), ('d', None)])
+        self.assertEqual(results[6], {'count': 4})
+
+    def test_failed_batch_rolls_back(self):
+        res = self.request('batch', operations=[
+            {'operation': 'insert', 'table': 'items', 'data': {'name': 'a'}},
+            {'operation': 'delete', 'table': 'items', 'where': {'name': 'missing'}},
+            {'operation': 'insert', 'table': 'items', 'data': {'qty': 1}},
+        ])
+        self.assertFalse(res['ok'])
+        self.assertEqual(res['error']['code'], 'batch_failed')
+        self.assertEqual(res['error']['details'], {'index': 2, 'operation': 'insert'})
+        self.assertEqual(self.count(), 0)
+
+    def test_invalid_batches_are_rejected(self):
+        for operations in ([], [{'operation': 'create_table', 'table': 'x', 'schema': {'a': 'TEXT'}}],
+                           [{'operation': 'count', 'table': 'items'}] * (db_cgi.MAX_BATCH_SIZE + 1)):
+            res = self.request('batch', operations=operations)
+            self.assertFalse(res['ok'])
+            self.assertEqual(res['error']['code'], 'bad_request')
+
+    def test_select_pages_with_cursor(self):
+        qtys = [3, None, 1, 3, None, 2, 3, 1]
+        self.insert_rows(qtys)
+        for direction in ('ASC', 'DESC'):
+            seen = []
+            cursor = None
+            while True:
+                res = self.request('query', operation='select', table='items', fields=['name'],
+                                   order_by=['qty', direction], limit=3, cursor=cursor)
+                self.assertLessEqual(res['data']['count'], 3)
+                seen.extend(row['name'] for row in res['data']['rows'])
+                cursor = res['data']['next_cursor']
+                if cursor is None:
+                    break
+            expected = self.request('query', operation='select', table='items', fields=['name'],
+                                    order_by=['qty', direction])['data']['rows']
+            self.assertEqual(seen, [row['name'] for row in expected])
+            self.assertEqual(sorted(seen), sorted(f'n{i}' for i in range(len(qtys))))
+
+        res = self.request('query', operation='select', table='items', limit=2)
+        res = self.request('query', operation='select', table='items', order_by=['name'],
+                           cursor=res['data']['next_cursor'])
+        self.assertEqual(res['error']['code'], 'bad_request')
+
+    def test_select_columns_format(self):
+        self.insert_rows([5, 6])
+        res = self.request('query', operation='select', table='items', fields=['name', 'qty'], format='columns')
+        self.assertEqual(res['data']['columns'], ['name', 'qty'])
+        self.assertEqual(res['data']['rows'], [['n0', 5], ['n1', 6]])
+        self.assertIsNone(res['data']['next_cursor'])
+
+    def test_select_streams_ndjson(self):
+        # More rows than one batch request or one page can hold.
+        with sqlite3.connect(db_cgi.get_db_path('test')) as conn:
+            conn.executemany("INSERT INTO items (name, qty) VALUES ('x', ?)", [(i,) for i in range(1200)])
+        head, body = self.call('query', operation='select', table='items', fields=['qty'],
+                               order_by=['qty', 'DESC'], format='ndjson')
+        self.assertIn('Content-Type: application/x-ndjson', head)
+        rows = [json.loads(line) for line in body.splitlines()]
+        self.assertEqual(len(rows), 1200)
+        self.assertEqual(rows[0], {'qty': 1199})
+
+        head, body = self.call('query', operation='select', table='missing', format='ndjson')
+        self.assertIn('Status: 500', head)
+
+    def test_indexes_remove_full_scans(self):
+        explain = dict(operation='explain', table='items', where={'name': 'n1'})
+        res = self.request('query', **explain)
+        self.assertEqual(res['data']['full_scan'], ['SCAN items'])
+
+        res = self.request('query', operation='create_index', table='items', columns=['name'], unique=True)
+        self.assertEqual(res['data'], {'index_created': 'idx_items_name'})
+        res = self.request('query', **explain)
+        self.assertEqual(res['data']['full_scan'], [])
+        self.assertTrue(any('USING INDEX idx_items_name' in step['detail'] for step in res['data']['plan']))
+
+        self.insert_rows([1])
+        res = self.request('query', operation='insert', table='items', data={'name': 'n0'})
+        self.assertFalse(res['ok'])
+
+        res = self.request('query', operation='drop_index', name='idx_items_name')
+        self.assertEqual(res['data'], {'index_dropped': 'idx_items_name', 'existed': True})
+        res = self.request('query', **explain)
+        self.assertEqual(res['data']['full_scan'], ['SCAN items'])
+
+    def test_partial_index(self):
+        res = self.request('query', operation='create_index', table='items', name='open_items',
+                           columns=[['qty', 'DESC']], where={'name': "it's"}, not_null=['qty'])
+        self.assertTrue(res['ok'])
+        with sqlite3.connect(db_cgi.get_db_path('test')) as conn:
+            sql = conn.execute("SELECT sql FROM sqlite_master WHERE name = 'open_items'").fetchone()[0]
+        self.assertEqual(sql, "CREATE INDEX open_items ON items (qty DESC) WHERE name = 'it''s' AND qty IS NOT NULL")
+
+        for bad in ({'columns': ['qty; DROP TABLE items']}, {'columns': ['qty'], 'where': {'name': ['x']}},
+                    {'columns': []}):
+            res = self.request('query', operation='create_index', table='items', **bad)
+            self.assertFalse(res['ok'])
+
+    def test_slow_query_log(self):
+        self.insert_rows([1, 2])
+        original = db_cgi.SLOW_QUERY_MS
+        db_cgi.SLOW_QUERY_MS = 0
+        try:
+            self.request('query', operation='select', table='items', where={'qty': 2})
+            self.request('batch', operations=[{'operation': 'count', 'table': 'items', 'where': {'qty': 1}}])
+        finally:
+            db_cgi.SLOW_QUERY_MS = original
+        with open(os.path.join(self.tmpdir.name, db_cgi.SLOW_QUERY_LOG), encoding='utf-8') as f:
+            records = [json.loads(line) for line in f]
+        self.assertEqual([(r['database'], r['operation']) for r in records], [('test', 'select'), ('test', 'count')])
+        self.assertIn('SCAN items', records[0]['statements'][0]['plan'])
+        self.assertEqual(set(records[0]['statements'][0]), {'sql', 'plan'})
+
+    def test_aggregate_by_group(self):
+        res = self.request('batch', operations=[
+            {'operation': 'insert', 'table': 'items', 'data': {'name': name, 'qty': qty}}
+            for name, qty in [('a', 1), ('a', 3), ('b', 5), ('b', 5), ('c', 10), ('a', None)]
+        ])
+        self.assertTrue(res['ok'])
+        res = self.request('query', operation='aggregate', table='items', group_by=['name'], metrics=[
+            {'fn': 'count'}, {'fn': 'sum', 'column': 'qty', 'as': 'total'}, {'fn': 'avg', 'column': 'qty'},
+            {'fn': 'count_distinct', 'column': 'qty'}, {'fn': 'max', 'column': 'qty'},
+        ])
+        self.assertEqual(res['data']['rows'], [
+            {'name': 'a', 'count': 3, 'total': 4, 'avg_qty': 2.0, 'count_distinct_qty': 2, 'max_qty': 3},
+            {'name': 'b', 'count': 2, 'total': 10, 'avg_qty': 5.0, 'count_distinct_qty': 1, 'max_qty': 5},
+            {'name': 'c', 'count': 1, 'total': 10, 'avg_qty': 10.0, 'count_distinct_qty': 1, 'max_qty': 10},
+        ])
+        self.assertEqual((res['data']['groups'], res['data']['truncated']), (3, False))
+
+        res = self.request('query', operation='aggregate', table='items', group_by=['name'],
+                           metrics=[{'fn': 'sum', 'column': 'qty', 'as': 'total'}],
+                           where={'qty': {'>': 1, '<=': 10}, 'name': {'in': ['a', 'b']}},
+                           order_by=['total', 'desc'], limit=1, format='columns')
+        self.assertEqual(res['data'], {'columns': ['name', 'total'], 'rows': [['b', 10]], 'groups': 1,
+                                       'truncated': True})
+
+        res = self.request('query', operation='aggregate', table='items', metrics=[{'fn': 'min', 'column': 'qty'}],
+                           where={'qty': {'between': [2, 6]}})
+        self.assertEqual(res['data']['rows'], [{'min_qty': 3}])
+
+        for bad in ({'metrics': [{'fn': 'group_concat', 'column': 'name'}]}, {'metrics': [{'fn': 'sum'}]},
+                    {'metrics': [{'fn': 'count'}], 'where': {'qty': {'like': '%'}}},
+                    {'metrics': [{'fn': 'count'}], 'order_by': ['qty']}):
+            res = self.request('query', operation='aggregate', table='items', **bad)
+            self.assertEqual(res['error']['code'], 'bad_request')
+
+    def test_range_operators_in_where(self):
+        self.insert_rows([1, 2, 3, 4])
+        res = self.request('query', operation='select', table='items', fields=['qty'],
+                           where={'qty': {'>=': 2, '!=': 3}})
+        self.assertEqual([r['qty'] for r in res['data']['rows']], [2, 4])
+        res = self.request('query', operation='delete', table='items', where={'qty': {'in': [1, 4]}})
+        self.assertEqual(res['data']['affected_rows'], 2)
+        res = self.request('query', operation='count', table='items', where={'qty': {'between': [2, 3]}})
+        self.assertEqual(res['data']['count'], 2)
+
+    def test_connections_use_database_settings(self):
+        res = self.request('query', operation='configure')
+        self.assertEqual(res['data']['settings'], db_cgi.DEFAULT_SETTINGS)
+        self.assertEqual(res['data']['effective'], db_cgi.DEFAULT_SETTINGS)
+
+        self.assertEqual(res['data']['effective']['journal_mode'], 'delete')
+
+        settings = {'journal_mode': 'WAL', 'synchronous': 'normal', 'cache_size': 4096,
+                    'mmap_size': 1 << 20, 'busy_timeout': 1000}
+        res = self.request('query', operation='configure', settings=settings)
+        expected = dict(settings, journal_mode='wal')
+        self.assertEqual(res['data']['effective'], expected)
+        with open(db_cgi.get_settings_path('test'), encoding='utf-8') as f:
+            self.assertEqual(json.load(f), expected)
+
+        # A fresh connection picks the stored settings up.
+        db_cgi.close_connections()
+        res = self.request('query', operation='configure')
+        self.assertEqual(res['data']['effective'], expected)
+
+        for bad in ({'journal_mode': 'off'}, {'cache_size': -1}, {'mmap_size': '1'}, {'page_size': 4096}):
+            res = self.request('query', operation='configure', settings=bad)
+            self.assertEqual(res['error']['code'], 'bad_request')
+
+    def test_connections_are_reused_until_settings_change(self):
+        conn = db_cgi.connect('test')
+        db_cgi.release(conn)
+        self.assertIs(db_cgi.connect('test'), conn)
+        self.request('query', operation='configure', settings={'synchronous': 'full'})
+        self.assertNotIn(db_cgi.get_db_path('test'), db_cgi._connections)
+        self.assertIsNot(db_cgi.connect('test'), conn)
+
+    def test_connection_pool_is_capped(self):
+        conns = [db_cgi.connect(f'db{i}') for i in range(db_cgi.MAX_POOLED_CONNECTIONS)]
+        self.assertIs(db_cgi.connect('db0'), conns[0])  # now most recently used
+        db_cgi.connect('extra')
+        self.assertEqual(len(db_cgi._connections), db_cgi.MAX_POOLED_CONNECTIONS)
+        self.assertNotIn(db_cgi.get_db_path('db1'), db_cgi._connections)
+        with self.assertRaises(sqlite3.ProgrammingError):
+            conns[1].execute('SELECT 1')
+        self.assertIs(db_cgi.connect('db0'), conns[0])
+
+    def test_plan_groups_consecutive_inserts(self):
+        ops = [
+            {'operation': 'insert', 'table': 't', 'data': {'a': 1}},
+            {'operation': 'insert', 'table': 't', 'data': {'a': 2}},
+            {'operation': 'insert', 'table': 't', 'data': {'a': 3, 'b': 1}},
+            {'operation': 'insert', 'table': 'u', 'data': {'a': 3, 'b': 1}},
+            {'operation': 'count', 'table': 't'},
+            {'operation': 'insert', 'table': 'u', 'data': {'a': 3, 'b': 1}},
+        ]
+        self.assertEqual([(start, len(run)) for start, run in db_cgi.plan_batch(ops)],
+                         [(0, 2), (2, 1), (3, 1), (4, 1), (5, 1)])
+        self.assertEqual(len(db_cgi.plan_batch(ops, group_inserts=False)), 6)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,181 @@
+import io
+import json
+import os
+import sys
+import tempfile
+import threading
+import unittest
+from unittest.mock import patch
+from wsgiref.util import setup_testing_defaults
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import _server
+
+def call(path, method='GET', query='', body=b'', headers=None):
+    environ = {
+        'REQUEST_METHOD': method,
+        'PATH_INFO': path,
+        'QUERY_STRING': query,
+        'CONTENT_LENGTH': str(len(body)),
+        'CONTENT_TYPE': 'application/json',
+        'wsgi.input': io.BytesIO(body),
+    }
+    environ.update(headers or {})
+    setup_testing_defaults(environ)
+    captured = {}
+    written = []
+
+    def start_response(status, response_headers):
+        captured['status'] = status
+        captured['headers'] = dict(response_headers)
+        return written.append
+
+    returned = b''.join(_server.application(environ, start_response))
+    captured['streamed'] = bool(written)
+    return captured['status'], captured['headers'], b''.join(written) + returned
+
+class UnreadableInput:
+    def read(self, size=-1):
+        raise AssertionError('body must not be read')
+
+class FrontControllerTests(unittest.TestCase):
+    def test_routes_lib_handlers_and_translates_headers(self):
+        status, headers, payload = call('/api/now.cgi', query='tz=utc')
+        self.assertEqual(status, '200 OK')
+        self.assertEqual(headers['Content-Type'], 'application/json; charset=utf-8')
+        self.assertIn('no-store', headers['Cache-Control'])
+        self.assertEqual(int(headers['Content-Length']), len(payload))
+        self.assertEqual(json.loads(payload)['data']['tz'], 'UTC')
+
+        status, _, payload = call('/api/convert.cgi', query='kind=temp&value=x&from=c&to=f')
+        self.assertEqual(status, '400 Bad Request')
+        self.assertFalse(json.loads(payload)['ok'])
+
+        body = json.dumps({'schema': {'type': 'integer'}, 'data': 5}).encode('utf-8')
+        status, _, payload = call('/api/validate.cgi', method='POST', body=body)
+        self.assertTrue(json.loads(payload)['data']['valid'])
+
+        status, _, _ = call('/api/missing.cgi')
+        self.assertEqual(status, '404 Not Found')
+
+    def test_routes_match_exactly_below_the_prefix(self):
+        for path in ('/anything/evil/api/db.cgi', '/api/now.cgi/', '/cgi/api/now.cgi'):
+            with self.subTest(path=path):
+                self.assertEqual(call(path)[0], '404 Not Found')
+        with patch.object(_server, 'mount_prefix', '/cgi'):
+            self.assertEqual(call('/cgi/api/now.cgi')[0], '200 OK')
+            self.assertEqual(call('/api/now.cgi')[0], '404 Not Found')
+            self.assertEqual(call('/cgiapi/now.cgi')[0], '404 Not Found')
+
+    def test_server_environment_does_not_fill_request_variables(self):
+        base = dict(_server._base_environ, QUERY_STRING='tz=utc', CONTENT_LENGTH='5', HTTP_X_SERVER='1')
+        env = _server.cgi_environ({'REQUEST_METHOD': 'GET', 'HTTP_ACCEPT': '*/*'}, base)
+        self.assertEqual((env['QUERY_STRING'], env['CONTENT_LENGTH'], env['CONTENT_TYPE']), ('', '', ''))
+        self.assertNotIn('HTTP_X_SERVER', env)
+        self.assertEqual(env['HTTP_ACCEPT'], '*/*')
+        with patch.object(_server, '_base_environ', base):
+            _, _, payload = call('/api/now.cgi')
+        self.assertEqual(json.loads(payload)['data']['tz'], 'JST')
+
+    def test_conditional_request_gets_304(self):
+        status, headers, _ = call('/api/convert.cgi', query='kind=length&value=1&from=km&to=m')
+        self.assertEqual(status, '200 OK')
+        status, headers, payload = call('/api/convert.cgi', query='kind=length&value=1&from=km&to=m',
+                                        headers={'HTTP_IF_NONE_MATCH': headers['ETag']})
+        self.assertEqual((status, payload, headers['Content-Length']), ('304 Not Modified', b'', '0'))
+
+    def test_requests_are_isolated(self):
+        before = dict(os.environ)
+        stdout, stdin = sys.stdout, sys.stdin
+        call('/api/now.cgi', query='tz=utc', headers={'HTTP_X_TEST': '1'})
+        self.assertEqual(dict(os.environ), before)
+        self.assertIs(sys.stdout, stdout)
+        self.assertIs(sys.stdin, stdin)
+
+        # No QUERY_STRING leaks into the next request: it falls back to JST.
+        _, _, payload = call('/api/now.cgi')
+        self.assertEqual(json.loads(payload)['data']['tz'], 'JST')
+
+    def test_concurrent_requests_get_their_own_responses(self):
+        results = {}
+
+        def worker(i):
+            _, _, payload = call('/api/uuid.cgi', query=f'n={i}')
+            results[i] = len(json.loads(payload)['data']['uuids'])
+
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(1, 21)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(results, {i: i for i in range(1, 21)})
+
+    def test_streamed_output_is_not_buffered(self):
+        status, headers, payload = call('/api/uuid.cgi', query='n=5000&format=text')
+        self.assertEqual(status, '200 OK')
+        self.assertNotIn('Content-Length', headers)
+        self.assertEqual(len(payload.splitlines()), 5000)
+
+    def test_oversized_body_is_refused_before_reading(self):
+        environ = {'REQUEST_METHOD': 'POST', 'PATH_INFO': '/api/validate.cgi',
+                   'CONTENT_LENGTH': str(_server.MAX_CONTENT_LENGTH + 1), 'wsgi.input': UnreadableInput()}
+        setup_testing_defaults(environ)
+        captured = {}
+        payload = b''.join(_server.application(environ, lambda status, headers: captured.setdefault('status', status)))
+        self.assertEqual(captured['status'], '413 Payload Too Large')
+        self.assertEqual(payload, b'Payload Too Large\n')
+
+    def test_unserialized_routes_do_not_wait_for_locked_ones(self):
+        results = {}
+
+        def worker(i):
+            tz = 'utc' if i % 2 else 'jst'
+            _, _, payload = call('/api/now.cgi', query=f'tz={tz}')
+            results[i] = (tz.upper(), json.loads(payload)['data']['tz'])
+
+        # Holding db.cgi's lock must not hold up other scripts.
+        with _server._route_locks['/api/db.cgi']:
+            threads = [threading.Thread(target=worker, args=(i,)) for i in range(20)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join(timeout=5)
+        self.assertEqual(len(results), 20)
+        for expected, tz in results.values():
+            self.assertEqual(tz, expected)
+        self.assertNotIn('/bookmark/cgi/api.cgi', _server._route_locks)
+
+    def test_bookmark_api_is_routable(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            base = dict(_server._base_environ, BOOKMARK_DB_PATH=os.path.join(tmpdir, 'test.sqlite3'),
+                        BOOKMARK_FETCH_STUB='1')
+            with patch.object(_server, '_base_environ', base):
+                body = json.dumps({'url': 'http://93.184.216.34/sample', 'tags': ['ai']}).encode('utf-8')
+                status, _, payload = call('/bookmark/cgi/api.cgi', method='POST', query='action=add', body=body)
+                self.assertEqual(status, '200 OK')
+                bookmark_id = json.loads(payload)['data']['bookmark']['id']
+
+                status, _, payload = call('/bookmark/cgi/api.cgi', query=f'action=get&id={bookmark_id}')
+                self.assertEqual(json.loads(payload)['data']['bookmark']['tags'], 'ai')
+
+                status, _, _ = call('/bookmark/cgi/api.cgi', query='action=nope')
+                self.assertEqual(status, '400 Bad Request')
+
+    def test_threads_started_by_a_handler_see_the_request(self):
+        # import fetch=now fetches on a thread pool; the stub switch and the
+        # database path exist only in the request's environment.
+        self.assertNotIn('BOOKMARK_FETCH_STUB', os.environ)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            base = dict(_server._base_environ, BOOKMARK_DB_PATH=os.path.join(tmpdir, 'test.sqlite3'),
+                        BOOKMARK_FETCH_STUB='1')
+            with patch.object(_server, '_base_environ', base):
+                body = b'"http://93.184.216.34/a"\n"http://93.184.216.34/b"\n'
+                status, _, payload = call('/bookmark/cgi/api.cgi', method='POST',
+                                          query='action=import&format=ndjson&fetch=now', body=body)
+                self.assertEqual(json.loads(payload)['data']['summary']['added'], 2)
+                _, _, payload = call('/bookmark/cgi/api.cgi', query='action=list')
+                items = json.loads(payload)['data']['items']
+                self.assertEqual([item['title'] for item in items], ['Stub Title', 'Stub Title'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,31 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'bench'))
+import bench_startup
+
+# Import-time budgets are wall-clock numbers and flaky on loaded machines;
+# they are enforced by api/bench/bench_startup.py, or here with STARTUP_BUDGETS=1.
+CHECK_BUDGETS = os.environ.get('STARTUP_BUDGETS', '') == '1'
+
+class StartupTests(unittest.TestCase):
+    def test_entry_points_import_cleanly(self):
+        for result in bench_startup.run(runs=1, top=5):
+            with self.subTest(script=result['script'], request=result['request']):
+                self.assertTrue(result['clean'], result['top'])
+                self.assertEqual(result['forbidden_loaded'], [], result['top'])
+
+    @unittest.skipUnless(CHECK_BUDGETS, 'set STARTUP_BUDGETS=1 to check import-time budgets')
+    def test_entry_points_stay_within_import_budget(self):
+        for result in bench_startup.run(runs=3, top=5):
+            with self.subTest(script=result['script'], request=result['request']):
+                self.assertLessEqual(result['import_ms'], result['budget_ms'], result['top'])
+
+    def test_cgi_scripts_skip_site_packages(self):
+        for script, *_ in bench_startup.ENTRY_POINTS:
+            path = os.path.join(bench_startup.REPO_DIR, script)
+            self.assertIn('-S', bench_startup.shebang_flags(path), script)
+
+if __name__ == '__main__':
+    unittest.main()
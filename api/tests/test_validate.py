@@ -0,0 +1,229 @@
+import io
+import json
+import os
+import sys
+import tempfile
+import unittest
+import importlib.util
+
+from importlib.machinery import SourceFileLoader
+
+def load_cgi_module(name):
+    path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', f'{name}.cgi'))
+    module_name = f"cgi_api_{name}"
+    loader = SourceFileLoader(module_name, path)
+    spec = importlib.util.spec_from_loader(module_name, loader)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[module_name] = module
+    spec.loader.exec_module(module)
+    return module
+
+validate_cgi = load_cgi_module('validate')
+
+class TestValidate(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.original_dir = validate_cgi.SCHEMA_DIR
+        validate_cgi.SCHEMA_DIR = os.path.join(self.tmpdir.name, 'schemas')
+        validate_cgi._compiled.clear()
+        self.original_environ = os.environ.copy()
+        self.original_stdout = sys.stdout
+        self.original_stdin = sys.stdin
+
+    def tearDown(self):
+        sys.stdout = self.original_stdout
+        sys.stdin = self.original_stdin
+        os.environ = self.original_environ
+        validate_cgi.SCHEMA_DIR = self.original_dir
+        validate_cgi._compiled.clear()
+        self.tmpdir.cleanup()
+
+    def call(self, body, query='', content_type='application/json'):
+        os.environ['REQUEST_METHOD'] = 'POST'
+        os.environ['QUERY_STRING'] = query
+        os.environ['CONTENT_TYPE'] = content_type
+        os.environ['CONTENT_LENGTH'] = str(len(body))
+        sys.stdin = io.StringIO(body)
+        sys.stdout = io.StringIO()
+        validate_cgi._lib.main(validate_cgi.handler)
+        output = sys.stdout.getvalue()
+        sys.stdout = self.original_stdout
+        return output.split('\n\n', 1)
+
+    def request(self, **fields):
+        return json.loads(self.call(json.dumps(fields))[1])
+
+    def batch_lines(self, body, query='action=batch', content_type='application/json'):
+        headers, output = self.call(body, query, content_type)
+        self.assertIn('Content-Type: application/x-ndjson', headers)
+        return [json.loads(line) for line in output.splitlines()]
+
+    def test_error_paths_and_messages(self):
+        schema = {
+            "type": "object",
+            "required": ["id", "name"],
+            "additionalProperties": False,
+            "properties": {
+                "id": {"type": "integer", "minimum": 1},
+                "name": {"type": "string", "minLength": 2, "pattern": "^[a-z]+$"},
+                "tags": {"type": "array", "maxItems": 2, "items": {"type": "string"}},
+                "flag": {"type": "boolean"},
+            },
+        }
+        errors = validate_cgi.validate(schema, {"id": 0, "tags": ["a", 1, "c"], "flag": 1, "x": None})
+        self.assertEqual(errors, [
+            {"path": "$", "message": "missing required property 'name'"},
+            {"path": "$.id", "message": "value 0 < minimum 1"},
+            {"path": "$.tags", "message": "items 3 > maxItems 2"},
+            {"path": "$.tags[1]", "message": "expected string but got int"},
+            {"path": "$.flag", "message": "expected boolean but got int"},
+            {"path": "$", "message": "additional property 'x' not allowed"},
+        ])
+        self.assertEqual(validate_cgi.validate(schema, {"id": 1, "name": "A"}), [
+            {"path": "$.name", "message": "length 1 < minLength 2"},
+            {"path": "$.name", "message": "does not match pattern '^[a-z]+$'"},
+        ])
+        self.assertEqual(validate_cgi.validate({"type": "integer"}, True),
+                         [{"path": "$", "message": "expected integer but got bool"}])
+        self.assertEqual(validate_cgi.validate({"type": "string", "pattern": "("}, "a"),
+                         [{"path": "$", "message": "invalid regex pattern '('"}])
+
+    def test_validators_are_cached_by_content(self):
+        first = validate_cgi.get_validator({"type": "string", "maxLength": 3})
+        second = validate_cgi.get_validator({"maxLength": 3, "type": "string"})
+        self.assertIs(first, second)
+        self.assertIsNot(first, validate_cgi.get_validator({"type": "string", "maxLength": 4}))
+
+    def test_validator_cache_evicts_least_recently_used(self):
+        original_size = validate_cgi.COMPILE_CACHE_SIZE
+        validate_cgi.COMPILE_CACHE_SIZE = 2
+        try:
+            a = validate_cgi.get_validator({"type": "string"})
+            validate_cgi.get_validator({"type": "integer"})
+            self.assertIs(validate_cgi.get_validator({"type": "string"}), a)
+            validate_cgi.get_validator({"type": "boolean"})
+        finally:
+            validate_cgi.COMPILE_CACHE_SIZE = original_size
+        self.assertIs(validate_cgi.get_validator({"type": "string"}), a)
+        self.assertEqual(len(validate_cgi._compiled), 2)
+
+    def test_local_refs_and_recursion(self):
+        schema = {
+            "definitions": {
+                "node": {
+                    "type": "object",
+                    "required": ["value"],
+                    "properties": {
+                        "value": {"type": "integer"},
+                        "children": {"type": "array", "items": {"$ref": "#/definitions/node"}},
+                    },
+                },
+            },
+            "$ref": "#/definitions/node",
+        }
+        tree = {"value": 1, "children": [{"value": 2, "children": [{"value": "3"}]}, {}]}
+        self.assertEqual(validate_cgi.validate(schema, tree), [
+            {"path": "$.children[0].children[0].value", "message": "expected integer but got str"},
+            {"path": "$.children[1]", "message": "missing required property 'value'"},
+        ])
+        with self.assertRaises(ValueError):
+            validate_cgi.compile_schema({"$ref": "#/definitions/missing"})
+        with self.assertRaises(ValueError):
+            validate_cgi.compile_schema({"$ref": "http://example.com/schema.json"})
+
+    def test_ref_cycles_and_deep_documents(self):
+        cycle = {"definitions": {"a": {"$ref": "#/definitions/b"}, "b": {"$ref": "#/definitions/a"}},
+                 "$ref": "#/definitions/a"}
+        for schema in ({"$ref": "#"}, cycle):
+            with self.assertRaises(ValueError):
+                validate_cgi.compile_schema(schema)
+        res = self.request(schema={"$ref": "#"}, data=1)
+        self.assertFalse(res['ok'])
+        self.assertEqual(res['error']['code'], 'invalid_schema')
+
+        # A cycle through items consumes one level of input per step.
+        nested = {"type": "array", "items": {"$ref": "#"}}
+        self.assertEqual(validate_cgi.validate(nested, [[], [[]]]), [])
+        deep = []
+        for _ in range(sys.getrecursionlimit()):
+            deep = [deep]
+        self.assertEqual(validate_cgi.validate(nested, deep),
+                         [{"path": "$", "message": "document nested too deeply"}])
+
+    def test_register_and_validate_by_id(self):
+        schema = {"type": "object", "required": ["a"]}
+        res = self.request(action='register', schema=schema)
+        self.assertTrue(res['ok'])
+        schema_id = res['data']['schema_id']
+        self.assertEqual(self.request(action='register', schema=schema)['data']['schema_id'], schema_id)
+        self.assertTrue(os.path.exists(os.path.join(validate_cgi.SCHEMA_DIR, f'{schema_id}.json')))
+
+        validate_cgi._compiled.clear()
+        res = self.request(schema_id=schema_id, data={})
+        self.assertFalse(res['data']['valid'])
+        self.assertEqual(res['data']['errors'], [{"path": "$", "message": "missing required property 'a'"}])
+        self.assertTrue(self.request(schema_id=schema_id, data={"a": 1})['data']['valid'])
+
+    def test_unknown_or_malformed_schema_id(self):
+        self.assertFalse(self.request(schema_id='0' * 32, data={})['ok'])
+        self.assertFalse(self.request(schema_id='../secret', data={})['ok'])
+
+    def test_batch_streams_results_and_summary(self):
+        schema = {"type": "object", "required": ["id"], "properties": {"id": {"type": "integer"}}}
+        body = json.dumps({"schema": schema, "documents": [{"id": 1}, {}, {"id": "x"}, {"id": 4}]})
+        lines = self.batch_lines(body)
+        self.assertEqual(lines[0], {"index": 0, "valid": True})
+        self.assertEqual(lines[1]['error_count'], 1)
+        self.assertEqual(lines[2]['errors'], [{"path": "$.id", "message": "expected integer but got str"}])
+        self.assertEqual(lines[-1], {"summary": {"total": 4, "valid": 2, "invalid": 2, "stopped": False}})
+
+    def test_batch_options(self):
+        schema = {"type": "object", "required": ["a", "b", "c"]}
+        documents = [{"a": 1, "b": 1, "c": 1}, {}, {}]
+        lines = self.batch_lines(json.dumps({"schema": schema, "documents": documents,
+                                             "max_errors": 1, "fail_fast": True}))
+        self.assertEqual(len(lines), 3)
+        self.assertEqual(lines[1]['error_count'], 3)
+        self.assertEqual(len(lines[1]['errors']), 1)
+        self.assertEqual(lines[-1]['summary'], {"total": 2, "valid": 1, "invalid": 1, "stopped": True})
+
+        res = json.loads(self.call(json.dumps({"schema": schema, "documents": documents, "summary": True}),
+                                   'action=batch')[1])
+        self.assertEqual(res['data'], {"total": 3, "valid": 1, "invalid": 2, "stopped": False})
+
+        # The first invalid document was also the last: nothing was skipped.
+        lines = self.batch_lines(json.dumps({"schema": schema, "documents": documents[:2], "fail_fast": True}))
+        self.assertEqual(lines[-1]['summary'], {"total": 2, "valid": 1, "invalid": 1, "stopped": False})
+        schema_id = self.request(action='register', schema={"type": "integer"})['data']['schema_id']
+        for body, stopped in (('1\n"x"\n\n', False), ('1\n"x"\nnull\n', True)):
+            with self.subTest(body=body):
+                lines = self.batch_lines(body, f'action=batch&schema_id={schema_id}&fail_fast=1',
+                                         'application/x-ndjson')
+                self.assertEqual(lines[-1]['summary']['stopped'], stopped)
+
+    def test_batch_ndjson_stream(self):
+        schema_id = self.request(action='register', schema={"type": "integer", "minimum": 0})['data']['schema_id']
+        body = '1\n-1\n\nnot json\n7\n'
+        lines = self.batch_lines(body, f'action=batch&schema_id={schema_id}', 'application/x-ndjson')
+        self.assertEqual([line.get('valid') for line in lines[:-1]], [True, False, False, True])
+        self.assertEqual(lines[2]['errors'], [{"path": "$", "message": "invalid JSON"}])
+        self.assertEqual(lines[-1]['summary']['total'], 4)
+
+    def test_batch_has_its_own_size_limit(self):
+        documents = ['x' * 1000] * 100
+        body = json.dumps({"schema": {"type": "string"}, "documents": documents})
+        self.assertGreater(len(body), validate_cgi._lib.MAX_CONTENT_LENGTH)
+        self.assertEqual(self.batch_lines(body)[-1]['summary']['valid'], 100)
+
+        original_limit = validate_cgi.MAX_BATCH_CONTENT_LENGTH
+        validate_cgi.MAX_BATCH_CONTENT_LENGTH = len(body) - 1
+        try:
+            headers, output = self.call(body, 'action=batch')
+        finally:
+            validate_cgi.MAX_BATCH_CONTENT_LENGTH = original_limit
+        self.assertIn('Status: 400', headers)
+        self.assertEqual(json.loads(output)['error']['code'], 'payload_too_large')
+
+if __name__ == '__main__':
+    unittest.main()
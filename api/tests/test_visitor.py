@@ -0,0 +1,89 @@
+import datetime
+import json
+import os
+import sys
+import tempfile
+import unittest
+import importlib.util
+
+from importlib.machinery import SourceFileLoader
+
+def load_cgi_module(name):
+    path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', f'{name}.cgi'))
+    module_name = f"cgi_api_{name}"
+    loader = SourceFileLoader(module_name, path)
+    spec = importlib.util.spec_from_loader(module_name, loader)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[module_name] = module
+    spec.loader.exec_module(module)
+    return module
+
+visitor_cgi = load_cgi_module('visitor')
+
+class TestVisitorStats(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.original_dir = visitor_cgi.DATA_DIR
+        visitor_cgi.DATA_DIR = self.tmpdir.name
+        self.today = datetime.datetime.now().strftime("%Y-%m-%d")
+        self.path = os.path.join(self.tmpdir.name, f"{self.today}.jsonl")
+
+    def tearDown(self):
+        visitor_cgi.DATA_DIR = self.original_dir
+        self.tmpdir.cleanup()
+
+    def visit(self, country, timestamp):
+        location = dict(visitor_cgi.DEMO_LOCATIONS['default'], country=country)
+        return json.dumps({"id": "x", "location": location, "page": "/", "timestamp": timestamp}) + '\n'
+
+    def append(self, text):
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(text)
+
+    def test_stats_are_rolled_up_incrementally(self):
+        now = datetime.datetime.now(datetime.timezone.utc)
+        old = (now - datetime.timedelta(hours=1)).isoformat()
+        self.append(self.visit('Japan', old) + self.visit('USA', old) + 'not json\n' + self.visit('Japan', now.isoformat()))
+
+        stats = visitor_cgi.get_stats()
+        self.assertEqual(stats['total_visits'], 3)
+        self.assertEqual(stats['online_now'], 1)
+        self.assertEqual(stats['top_countries'][0], {"country": "Japan", "count": 2})
+        self.assertEqual(stats['recent_visitors'][0]['timestamp'], now.isoformat())
+
+        with open(visitor_cgi.get_rollup_path(self.today), encoding='utf-8') as f:
+            rollup = json.load(f)
+        self.assertEqual(rollup['offset'], os.path.getsize(self.path))
+
+        # A half-written line is left for the next request.
+        line = self.visit('USA', now.isoformat())
+        self.append(line[:20])
+        self.assertEqual(visitor_cgi.get_stats()['total_visits'], 3)
+        self.append(line[20:])
+        stats = visitor_cgi.get_stats()
+        self.assertEqual(stats['total_visits'], 4)
+        self.assertEqual(stats['online_now'], 2)
+        self.assertEqual({c['country']: c['count'] for c in stats['top_countries']}, {"Japan": 2, "USA": 2})
+
+    def test_hourly_stats_and_recent_limit(self):
+        base = datetime.datetime.now(datetime.timezone.utc).replace(minute=0, second=0, microsecond=0)
+        self.append(''.join(self.visit('Japan', (base - datetime.timedelta(seconds=i)).isoformat())
+                            for i in range(150)))
+        stats = visitor_cgi.get_stats()
+        self.assertEqual(len(stats['recent_visitors']), visitor_cgi.RECENT_LIMIT)
+        self.assertEqual(stats['recent_visitors'][0]['timestamp'], base.isoformat())
+        if base.strftime("%Y-%m-%d") == self.today:
+            hours = {h['hour']: h['count'] for h in stats['hourly_stats']}
+            self.assertEqual(hours[base.strftime("%H:00")], 1)
+
+    def test_truncated_log_is_recounted(self):
+        stamp = datetime.datetime.now(datetime.timezone.utc).isoformat()
+        self.append(self.visit('Japan', stamp) * 3)
+        self.assertEqual(visitor_cgi.get_stats()['total_visits'], 3)
+        with open(self.path, 'w', encoding='utf-8') as f:
+            f.write(self.visit('USA', stamp))
+        self.assertEqual(visitor_cgi.get_stats()['total_visits'], 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,11 +1,129 @@
-#!/usr/local/bin/python3
+#!/usr/local/bin/python3 -S
 import sys
-import uuid
 import os
+import time
 
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 import _lib
 
+MAX_JSON_IDS = 50
+MAX_BULK_IDS = 50000  # format=text / format=ndjson
+STREAM_BATCH_SIZE = 1000
+
+VERSIONS = ("4", "7", "ulid")
+FORMATS = ("json", "text", "ndjson")
+
+# Byte maps that stamp the version nibble and the RFC 4122 variant bits.
+V4_TABLE = bytes((b & 0x0F) | 0x40 for b in range(256))
+VARIANT_TABLE = bytes((b & 0x3F) | 0x80 for b in range(256))
+
+# Last (millisecond, counter) handed out, so ids stay ordered across calls
+# in one process (a whole response under CGI, every request under _server.py).
+_last_v7 = (0, 0)
+_last_ulid = (0, 0)
+
+def uuid4_bytes(n):
+    """n random UUIDs as one 16*n byte buffer
+
+    Same bits as uuid.uuid4(); the uuid module (and platform) is slow to import.
+    """
+    buf = bytearray(os.urandom(16 * n))
+    buf[6::16] = buf[6::16].translate(V4_TABLE)
+    buf[8::16] = buf[8::16].translate(VARIANT_TABLE)
+    return buf
+
+def uuid7_bytes(n):
+    """n time-ordered UUIDv7s (RFC 9562) as one 16*n byte buffer
+
+    48-bit Unix milliseconds, then a 12-bit counter in rand_a that starts at
+    a random value below 0x800 each millisecond and increments within it, so
+    ids sort in generation order. A counter overflow borrows the next
+    millisecond. The clock is read once per call.
+    """
+    global _last_v7
+    buf = uuid4_bytes(n)  # random bits and variant; the rest is overwritten
+    last_ms, counter = _last_v7
+    now = time.time_ns() // 1000000
+    for off in range(0, 16 * n, 16):
+        if now > last_ms:
+            last_ms, counter = now, ((buf[off + 6] & 0x07) << 8) | buf[off + 7]
+        else:
+            counter += 1
+            if counter > 0xFFF:
+                last_ms, counter = last_ms + 1, ((buf[off + 6] & 0x07) << 8) | buf[off + 7]
+        buf[off:off + 6] = last_ms.to_bytes(6, "big")
+        buf[off + 6] = 0x70 | (counter >> 8)
+        buf[off + 7] = counter & 0xFF
+    _last_v7 = (last_ms, counter)
+    return buf
+
+def ulid_bytes(n):
+    """n ULIDs as one 16*n byte buffer: 48-bit milliseconds and 80 random bits
+
+    Within a millisecond the random part of the previous ULID is incremented,
+    as the ULID spec's monotonic mode does.
+    """
+    global _last_ulid
+    buf = bytearray(os.urandom(16 * n))
+    last_ms, last_random = _last_ulid
+    now = time.time_ns() // 1000000
+    for off in range(0, 16 * n, 16):
+        if now > last_ms:
+            last_ms, last_random = now, int.from_bytes(buf[off + 6:off + 16], "big")
+        else:
+            last_random += 1
+            if last_random >> 80:
+                last_ms, last_random = last_ms + 1, int.from_bytes(buf[off + 6:off + 16], "big")
+        buf[off:off + 6] = last_ms.to_bytes(6, "big")
+        buf[off + 6:off + 16] = last_random.to_bytes(10, "big")
+    _last_ulid = (last_ms, last_random)
+    return buf
+
+def format_uuids(buf):
+    h = buf.hex()
+    return [f"{h[i:i + 8]}-{h[i + 8:i + 12]}-{h[i + 12:i + 16]}-{h[i + 16:i + 20]}-{h[i + 20:i + 32]}"
+            for i in range(0, len(h), 32)]
+
+CROCKFORD = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
+_crockford_pairs = None
+
+def format_ulids(buf):
+    """Crockford base32, 26 characters each
+
+    Encoded 10 bits (two characters) per lookup; base64.b32encode is pure
+    Python and slower.
+    """
+    global _crockford_pairs
+    if _crockford_pairs is None:
+        _crockford_pairs = [a + b for a in CROCKFORD for b in CROCKFORD]
+    p = _crockford_pairs
+    ulids = []
+    for i in range(0, len(buf), 16):
+        v = int.from_bytes(buf[i:i + 16], "big")
+        ulids.append(p[v >> 120] + p[v >> 110 & 1023] + p[v >> 100 & 1023] + p[v >> 90 & 1023]
+                     + p[v >> 80 & 1023] + p[v >> 70 & 1023] + p[v >> 60 & 1023] + p[v >> 50 & 1023]
+                     + p[v >> 40 & 1023] + p[v >> 30 & 1023] + p[v >> 20 & 1023] + p[v >> 10 & 1023]
+                     + p[v & 1023])
+    return ulids
+
+def generate(version, n):
+    """n ids of a version as strings, all from one os.urandom call"""
+    if version == "ulid":
+        return format_ulids(ulid_bytes(n))
+    return format_uuids(uuid7_bytes(n) if version == "7" else uuid4_bytes(n))
+
+def stream_ids(ids, fmt):
+    """Write ids one per line, STREAM_BATCH_SIZE at a time"""
+    if fmt == "ndjson":
+        _lib.start_stream("application/x-ndjson; charset=utf-8")
+        template = '"{}"\n'
+    else:
+        _lib.start_stream("text/plain; charset=utf-8")
+        template = "{}\n"
+    for i in range(0, len(ids), STREAM_BATCH_SIZE):
+        sys.stdout.write("".join(template.format(value) for value in ids[i:i + STREAM_BATCH_SIZE]))
+        sys.stdout.flush()
+
 def handler():
     method = os.environ.get('REQUEST_METHOD', 'GET')
     if method != 'GET':
@@ -17,13 +135,25 @@ def handler():
     except ValueError:
         raise ValueError("Invalid n")
 
-    if n < 1 or n > 50:
-        raise ValueError("n must be between 1 and 50")
+    version = params.get('version', '4').lower()
+    if version not in VERSIONS:
+        raise ValueError("version must be 4, 7 or ulid")
+    fmt = params.get('format', 'json')
+    if fmt not in FORMATS:
+        raise ValueError("format must be json, text or ndjson")
+
+    limit = MAX_JSON_IDS if fmt == 'json' else MAX_BULK_IDS
+    if n < 1 or n > limit:
+        raise ValueError(f"n must be between 1 and {limit}")
+
+    ids = generate(version, n)
 
-    uuids = [str(uuid.uuid4()) for _ in range(n)]
+    if fmt != 'json':
+        stream_ids(ids, fmt)
+        return
 
     _lib.send_response(data={
-        "uuids": uuids
+        "ulids" if version == "ulid" else "uuids": ids
     })
 
 if __name__ == "__main__":
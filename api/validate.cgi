@@ -1,105 +1,461 @@
-#!/usr/local/bin/python3
+#!/usr/local/bin/python3 -S
 import sys
 import os
 import re
+import json
+from collections import OrderedDict
 
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 import _lib
 
-def validate(schema, data, path="$"):
-    errors = []
-    
-    # Type check
-    schema_type = schema.get("type")
-    if schema_type:
-        valid_type = True
-        if schema_type == "object":
-            if not isinstance(data, dict): valid_type = False
-        elif schema_type == "array":
-            if not isinstance(data, list): valid_type = False
-        elif schema_type == "string":
-            if not isinstance(data, str): valid_type = False
-        elif schema_type == "integer":
-            if not isinstance(data, int) or isinstance(data, bool): valid_type = False
-        elif schema_type == "number":
-            if not isinstance(data, (int, float)) or isinstance(data, bool): valid_type = False
-        elif schema_type == "boolean":
-            if not isinstance(data, bool): valid_type = False
-        elif schema_type == "null":
-            if data is not None: valid_type = False
-            
-        if not valid_type:
-            errors.append({"path": path, "message": f"expected {schema_type} but got {type(data).__name__}"})
-            return errors # Stop further validation if type mismatches
-
-    # Object validation
-    if schema_type == "object":
+# Registered schemas, one <schema_id>.json per schema (see register_schema)
+SCHEMA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "_data", "schemas")
+SCHEMA_ID_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+
+# action=batch: larger body limit, per-document error cap, output batching
+MAX_BATCH_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB
+DEFAULT_MAX_ERRORS = 10
+MAX_ERRORS_LIMIT = 1000
+STREAM_BATCH_SIZE = 500
+
+# Compiled validators kept per process (useful under _server.py), least
+# recently used evicted first
+COMPILE_CACHE_SIZE = 64
+_compiled = OrderedDict()
+
+# Exact types as produced by json.loads (bool is not an integer here)
+JSON_TYPES = {
+    "object": (dict,),
+    "array": (list,),
+    "string": (str,),
+    "integer": (int,),
+    "number": (int, float),
+    "boolean": (bool,),
+    "null": (type(None),),
+}
+
+def format_path(path):
+    """Render a lazy path: "$" or nested (parent, key) pairs"""
+    parts = []
+    while path != "$":
+        path, key = path
+        parts.append(f"[{key}]" if isinstance(key, int) else f".{key}")
+    return "$" + "".join(reversed(parts))
+
+def error(errors, path, message):
+    errors.append({"path": format_path(path), "message": message})
+
+def no_check(data, path, errors):
+    pass
+
+def resolve_ref(root, ref):
+    """Follow a local JSON pointer such as #/definitions/item"""
+    if not isinstance(ref, str) or not ref.startswith("#"):
+        raise ValueError("Only local $ref is supported")
+    node = root
+    for part in ref[1:].split("/")[1:]:
+        part = part.replace("~1", "/").replace("~0", "~")
+        if isinstance(node, dict) and part in node:
+            node = node[part]
+        elif isinstance(node, list) and part.isdigit() and int(part) < len(node):
+            node = node[int(part)]
+        else:
+            raise ValueError(f"Unresolvable $ref {ref}")
+    return node
+
+class Compiler:
+    """Turns a schema into nested checker closures
+
+    A checker is called as check(data, path, errors) and appends error dicts.
+    Keyword lookups, type dispatch and regex compilation happen once here
+    instead of on every node, and paths are only rendered for errors.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.refs = {}
+
+    def compile(self, schema):
+        if not isinstance(schema, dict):
+            raise ValueError("Invalid schema")
+        if "$ref" in schema:
+            # Siblings of $ref are ignored, as in draft-07.
+            return self.compile_ref(schema["$ref"])
+
+        schema_type = schema.get("type")
+        accepted = JSON_TYPES.get(schema_type) if isinstance(schema_type, str) else None
+        if accepted is None:
+            return no_check
+
+        builder = getattr(self, f"compile_{schema_type}", None)
+        checks = builder(schema) if builder else []
+
+        def type_error(data, path, errors):
+            error(errors, path, f"expected {schema_type} but got {type(data).__name__}")
+
+        if not checks:
+            def check(data, path, errors):
+                if type(data) not in accepted:
+                    type_error(data, path, errors)
+        elif len(checks) == 1:
+            (constraint,) = checks
+
+            def check(data, path, errors):
+                if type(data) not in accepted:
+                    type_error(data, path, errors)
+                else:
+                    constraint(data, path, errors)
+        else:
+            def check(data, path, errors):
+                if type(data) not in accepted:
+                    type_error(data, path, errors)
+                    return
+                for constraint in checks:
+                    constraint(data, path, errors)
+        return check
+
+    def compile_ref(self, ref):
+        # Compiled once per target; the cell lets recursive schemas refer to
+        # a checker that is still being built.
+        cell = self.refs.get(ref)
+        if cell is None:
+            cell = self.refs[ref] = [no_check]
+            target = resolve_ref(self.root, ref)
+            # A chain of bare $refs that leads back to itself would recurse
+            # forever without consuming any input.
+            seen = {ref}
+            node = target
+            while isinstance(node, dict) and "$ref" in node:
+                if node["$ref"] in seen:
+                    raise ValueError("Invalid schema")
+                seen.add(node["$ref"])
+                node = resolve_ref(self.root, node["$ref"])
+            cell[0] = self.compile(target)
+
+        def check(data, path, errors):
+            cell[0](data, path, errors)
+
+        return check
+
+    def compile_object(self, schema):
+        checks = []
         required = schema.get("required", [])
-        for req in required:
-            if req not in data:
-                errors.append({"path": path, "message": f"missing required property '{req}'"})
-        
-        properties = schema.get("properties", {})
-        additional_properties = schema.get("additionalProperties", True) 
-        
-        for key, value in data.items():
-            if key in properties:
-                errors.extend(validate(properties[key], value, f"{path}.{key}"))
-            elif additional_properties is False:
-                 errors.append({"path": path, "message": f"additional property '{key}' not allowed"})
-
-    # String validation
-    if schema_type == "string":
-        if "minLength" in schema and len(data) < schema["minLength"]:
-            errors.append({"path": path, "message": f"length {len(data)} < minLength {schema['minLength']}"})
-        if "maxLength" in schema and len(data) > schema["maxLength"]:
-            errors.append({"path": path, "message": f"length {len(data)} > maxLength {schema['maxLength']}"})
+        if required:
+            def check_required(data, path, errors):
+                for req in required:
+                    if req not in data:
+                        error(errors, path, f"missing required property '{req}'")
+            checks.append(check_required)
+
+        properties = {key: self.compile(sub) for key, sub in schema.get("properties", {}).items()}
+        closed = schema.get("additionalProperties", True) is False
+        if properties or closed:
+            def check_properties(data, path, errors):
+                for key, value in data.items():
+                    sub = properties.get(key)
+                    if sub is not None:
+                        sub(value, (path, key), errors)
+                    elif closed:
+                        error(errors, path, f"additional property '{key}' not allowed")
+            checks.append(check_properties)
+        return checks
+
+    def compile_string(self, schema):
+        checks = []
+        if "minLength" in schema:
+            min_length = schema["minLength"]
+
+            def check_min_length(data, path, errors):
+                if len(data) < min_length:
+                    error(errors, path, f"length {len(data)} < minLength {min_length}")
+            checks.append(check_min_length)
+        if "maxLength" in schema:
+            max_length = schema["maxLength"]
+
+            def check_max_length(data, path, errors):
+                if len(data) > max_length:
+                    error(errors, path, f"length {len(data)} > maxLength {max_length}")
+            checks.append(check_max_length)
         if "pattern" in schema:
+            pattern = schema["pattern"]
             try:
-                if not re.search(schema["pattern"], data):
-                    errors.append({"path": path, "message": f"does not match pattern '{schema['pattern']}'"})
-            except re.error:
-                errors.append({"path": path, "message": f"invalid regex pattern '{schema['pattern']}'"})
-
-    # Number/Integer validation
-    if schema_type in ("integer", "number"):
-        if "minimum" in schema and data < schema["minimum"]:
-            errors.append({"path": path, "message": f"value {data} < minimum {schema['minimum']}"})
-        if "maximum" in schema and data > schema["maximum"]:
-            errors.append({"path": path, "message": f"value {data} > maximum {schema['maximum']}"})
-
-    # Array validation
-    if schema_type == "array":
-        if "minItems" in schema and len(data) < schema["minItems"]:
-            errors.append({"path": path, "message": f"items {len(data)} < minItems {schema['minItems']}"})
-        if "maxItems" in schema and len(data) > schema["maxItems"]:
-            errors.append({"path": path, "message": f"items {len(data)} > maxItems {schema['maxItems']}"})
-        
-        items_schema = schema.get("items")
-        if items_schema:
-            for i, item in enumerate(data):
-                errors.extend(validate(items_schema, item, f"{path}[{i}]"))
-
-    return errors
+                search = re.compile(pattern).search
+            except (re.error, TypeError):
+                def check_pattern(data, path, errors):
+                    error(errors, path, f"invalid regex pattern '{pattern}'")
+            else:
+                def check_pattern(data, path, errors):
+                    if not search(data):
+                        error(errors, path, f"does not match pattern '{pattern}'")
+            checks.append(check_pattern)
+        return checks
+
+    def compile_number(self, schema):
+        checks = []
+        if "minimum" in schema:
+            minimum = schema["minimum"]
+
+            def check_minimum(data, path, errors):
+                if data < minimum:
+                    error(errors, path, f"value {data} < minimum {minimum}")
+            checks.append(check_minimum)
+        if "maximum" in schema:
+            maximum = schema["maximum"]
+
+            def check_maximum(data, path, errors):
+                if data > maximum:
+                    error(errors, path, f"value {data} > maximum {maximum}")
+            checks.append(check_maximum)
+        return checks
+
+    compile_integer = compile_number
+
+    def compile_array(self, schema):
+        checks = []
+        if "minItems" in schema:
+            min_items = schema["minItems"]
+
+            def check_min_items(data, path, errors):
+                if len(data) < min_items:
+                    error(errors, path, f"items {len(data)} < minItems {min_items}")
+            checks.append(check_min_items)
+        if "maxItems" in schema:
+            max_items = schema["maxItems"]
+
+            def check_max_items(data, path, errors):
+                if len(data) > max_items:
+                    error(errors, path, f"items {len(data)} > maxItems {max_items}")
+            checks.append(check_max_items)
+        if schema.get("items"):
+            item_check = self.compile(schema["items"])
+
+            def check_items(data, path, errors):
+                for i, item in enumerate(data):
+                    item_check(item, (path, i), errors)
+            checks.append(check_items)
+        return checks
+
+def compile_schema(schema):
+    """Compile a schema into validator(data) -> list of errors"""
+    try:
+        check = Compiler(schema).compile(schema)
+    except (AttributeError, TypeError, RecursionError):
+        raise ValueError("Invalid schema")
+
+    def validator(data):
+        errors = []
+        try:
+            check(data, "$", errors)
+        except RecursionError:
+            errors.append({"path": "$", "message": "document nested too deeply"})
+        return errors
+
+    return validator
+
+def cache_validator(key, build):
+    validator = _compiled.get(key)
+    if validator is not None:
+        _compiled.move_to_end(key)
+        return validator
+    validator = build()
+    if len(_compiled) >= COMPILE_CACHE_SIZE:
+        _compiled.popitem(last=False)
+    _compiled[key] = validator
+    return validator
+
+def canonical_json(schema):
+    return json.dumps(schema, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+
+def get_validator(schema):
+    """Compiled validator for a schema, cached by its content"""
+    return cache_validator(canonical_json(schema), lambda: compile_schema(schema))
+
+def register_schema(schema):
+    """Store a schema under the hash of its content; returns its id"""
+    import hashlib
+
+    compile_schema(schema)  # reject schemas that would fail later
+    text = canonical_json(schema)
+    schema_id = hashlib.sha256(text.encode("utf-8")).hexdigest()[:32]
+    path = os.path.join(SCHEMA_DIR, f"{schema_id}.json")
+    if not os.path.exists(path):
+        os.makedirs(SCHEMA_DIR, mode=0o700, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+    return schema_id
+
+def get_registered_validator(schema_id):
+    """Compiled validator for a registered schema id"""
+    if not isinstance(schema_id, str) or not SCHEMA_ID_PATTERN.match(schema_id):
+        raise ValueError("Invalid schema_id")
+
+    def build():
+        try:
+            with open(os.path.join(SCHEMA_DIR, f"{schema_id}.json"), encoding="utf-8") as f:
+                schema = json.load(f)
+        except FileNotFoundError:
+            raise ValueError("Unknown schema_id")
+        return compile_schema(schema)
+
+    # An id names fixed content, so the cache entry never goes stale.
+    return cache_validator(("id", schema_id), build)
+
+def validate(schema, data):
+    return get_validator(schema)(data)
+
+def is_true(value):
+    return value is True or value in ("1", "true")
+
+# Stands in for an NDJSON line that could not be parsed
+INVALID_JSON = object()
+# Returned by next() once the documents run out (a document may be null)
+END = object()
+
+def iter_ndjson_documents():
+    """Documents from an NDJSON body, one line each"""
+    for line in _lib.iter_body_lines(MAX_BATCH_CONTENT_LENGTH):
+        if not line.strip():
+            continue
+        try:
+            yield json.loads(line)
+        except (json.JSONDecodeError, RecursionError):
+            yield INVALID_JSON
+
+def validate_documents(validator, documents, max_errors=DEFAULT_MAX_ERRORS, fail_fast=False):
+    """Yields one result per document, stopping after the first invalid one if fail_fast"""
+    for index, document in enumerate(documents):
+        if document is INVALID_JSON:
+            errors = [{"path": "$", "message": "invalid JSON"}]
+        else:
+            errors = validator(document)
+        result = {"index": index, "valid": not errors}
+        if errors:
+            result["error_count"] = len(errors)
+            result["errors"] = errors[:max_errors]
+        yield result
+        if errors and fail_fast:
+            return
+
+def batch_options(options):
+    try:
+        max_errors = int(options.get("max_errors", DEFAULT_MAX_ERRORS))
+    except (ValueError, TypeError):
+        raise ValueError("Invalid max_errors")
+    if not 0 <= max_errors <= MAX_ERRORS_LIMIT:
+        raise ValueError("Invalid max_errors")
+    return max_errors, is_true(options.get("fail_fast")), is_true(options.get("summary"))
+
+def run_batch(validator, documents, max_errors, fail_fast, summary_only):
+    """Validate many documents against one compiled schema
+
+    Per-document results are streamed as NDJSON in STREAM_BATCH_SIZE chunks
+    and followed by a summary line; summary_only sends just the summary in
+    the usual JSON envelope.
+    """
+    summary = {"total": 0, "valid": 0, "invalid": 0, "stopped": False}
+    documents = iter(documents)
+    lines = []
+    if not summary_only:
+        _lib.start_stream("application/x-ndjson; charset=utf-8")
+    try:
+        for result in validate_documents(validator, documents, max_errors, fail_fast):
+            summary["total"] += 1
+            summary["valid" if result["valid"] else "invalid"] += 1
+            if summary_only:
+                continue
+            lines.append(json.dumps(result, ensure_ascii=False) + "\n")
+            if len(lines) >= STREAM_BATCH_SIZE:
+                sys.stdout.write("".join(lines))
+                sys.stdout.flush()
+                lines = []
+        # Stopped only if fail_fast left documents unread.
+        summary["stopped"] = fail_fast and summary["invalid"] > 0 and next(documents, END) is not END
+    except Exception as e:
+        if summary_only:
+            raise
+        # Headers are already out; a body without a summary line signals failure.
+        sys.stderr.write(f"validate.cgi batch failed: {e!r}\n")
+        sys.stdout.write("".join(lines))
+        return
+
+    if summary_only:
+        _lib.send_response(data=summary)
+    else:
+        lines.append(json.dumps({"summary": summary}) + "\n")
+        sys.stdout.write("".join(lines))
+        sys.stdout.flush()
+
+def handle_batch():
+    """POST ?action=batch with a JSON body or an NDJSON stream of documents
+
+    JSON: {"schema" | "schema_id", "documents": [...], "max_errors",
+    "fail_fast", "summary"}. NDJSON: one document per line, with schema_id
+    and the options in the query string.
+    """
+    content_type = os.environ.get("CONTENT_TYPE", "").split(";")[0].strip().lower()
+    if content_type in ("application/x-ndjson", "application/jsonl"):
+        options = _lib.get_query_params()
+        if "schema_id" not in options:
+            raise ValueError("Missing schema_id")
+        validator = get_registered_validator(options["schema_id"])
+        # Checked here: once streaming starts, errors can no longer be reported.
+        _lib.get_content_length(MAX_BATCH_CONTENT_LENGTH)
+        documents = iter_ndjson_documents()
+    else:
+        options = _lib.read_json_body(MAX_BATCH_CONTENT_LENGTH)
+        if not isinstance(options, dict):
+            raise ValueError("Invalid request body")
+        documents = options.get("documents")
+        if not isinstance(documents, list):
+            raise ValueError("documents must be a list")
+        if "schema_id" in options:
+            validator = get_registered_validator(options["schema_id"])
+        elif isinstance(options.get("schema"), dict):
+            validator = get_validator(options["schema"])
+        else:
+            raise ValueError("Invalid schema")
+
+    run_batch(validator, documents, *batch_options(options))
 
 def handler():
     method = os.environ.get('REQUEST_METHOD', 'GET')
     if method != 'POST':
         raise ValueError("Method not allowed")
 
+    # The batch body limit is checked before anything is read.
+    if _lib.get_query_params().get("action") == "batch":
+        handle_batch()
+        return
+
     body = _lib.read_json_body()
-    
-    if "schema" not in body or "data" not in body:
+    action = body.get("action", "validate")
+
+    if action == "register":
+        schema = body.get("schema")
+        if not isinstance(schema, dict):
+            raise ValueError("Invalid schema")
+        _lib.send_response(data={"schema_id": register_schema(schema)})
+        return
+
+    if action != "validate":
+        raise ValueError("Unknown action")
+
+    if "data" not in body or ("schema" not in body and "schema_id" not in body):
         raise ValueError("Missing schema or data")
 
-    schema = body["schema"]
     data = body["data"]
+    if "schema_id" in body:
+        validator = get_registered_validator(body["schema_id"])
+    else:
+        schema = body["schema"]
+        if not isinstance(schema, dict):
+            raise ValueError("Invalid schema")
+        validator = get_validator(schema)
+
+    errors = validator(data)
 
-    if not isinstance(schema, dict):
-        raise ValueError("Invalid schema")
-    
-    errors = validate(schema, data)
-    
     _lib.send_response(data={
         "valid": len(errors) == 0,
         "errors": errors
@@ -1,4 +1,4 @@
-#!/usr/local/bin/python3
+#!/usr/local/bin/python3 -S
 import sys
 import os
 import datetime
@@ -19,6 +19,19 @@ ALLOWED_ORIGINS = [
     "http://127.0.0.1"
 ]
 
+# Stats move slowly; a short max-age spares get_stats() from busy pages
+# and stale-while-revalidate hides the refresh from the visitor.
+STATS_MAX_AGE = 30
+STATS_STALE_WHILE_REVALIDATE = 300
+
+# Stats cover the last STATS_DAYS days. Each <date>.jsonl gets a
+# <date>.rollup.json with its counts and the byte offset they cover, so a
+# request only parses visits appended since the last one (see update_rollup).
+STATS_DAYS = 7
+ROLLUP_VERSION = 1
+RECENT_LIMIT = 100
+ONLINE_WINDOW = datetime.timedelta(minutes=5)
+
 # Simple country/city data for demonstration
 # In production, use GeoIP database or external API
 DEMO_LOCATIONS = {
@@ -82,87 +95,160 @@ def save_visitor(data):
     with open(file_path, 'a', encoding='utf-8') as f:
         f.write(json.dumps(data, ensure_ascii=False) + '\n')
 
-def load_visitors(days=1):
-    """Load visitor data from recent days"""
+def parse_timestamp(timestamp):
+    return datetime.datetime.fromisoformat(timestamp.replace('Z', '+00:00'))
+
+def get_rollup_path(date_str):
+    return os.path.join(DATA_DIR, f"{date_str}.rollup.json")
+
+def empty_rollup():
+    return {
+        "version": ROLLUP_VERSION,
+        "offset": 0,          # bytes of the .jsonl already counted
+        "total": 0,
+        "hours": {},          # "YYYY-MM-DDTHH" (UTC, from the timestamp) -> count
+        "countries": {},      # country -> count
+        "recent": [],         # newest RECENT_LIMIT visits, map fields only
+        "online": {},         # "YYYY-MM-DDTHH:MM:SS" -> count, within ONLINE_WINDOW of the newest visit
+    }
+
+def load_rollup(date_str, size):
+    """Rollup for a day, or an empty one if missing, stale or from a shrunk file"""
+    try:
+        with open(get_rollup_path(date_str), 'r', encoding='utf-8') as f:
+            rollup = json.load(f)
+    except (OSError, ValueError):
+        return empty_rollup()
+    if not isinstance(rollup, dict) or rollup.get("version") != ROLLUP_VERSION or rollup.get("offset", 0) > size:
+        return empty_rollup()
+    return rollup
+
+def save_rollup(date_str, rollup):
+    # Counts and offset are replaced together, so concurrent requests can
+    # only redo work, never count a visit twice.
+    path = get_rollup_path(date_str)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(rollup, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+def add_visits(rollup, lines):
+    """Fold complete JSONL lines into a rollup; unreadable lines are skipped"""
+    hours = rollup["hours"]
+    countries = rollup["countries"]
+    recent = rollup["recent"]
+    online = rollup["online"]
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            visit = json.loads(line)
+            timestamp = visit["timestamp"]
+            location = visit["location"]
+            entry = {
+                "country": location["country"],
+                "city": location["city"],
+                "lat": location["lat"],
+                "lon": location["lon"],
+                "timestamp": timestamp
+            }
+            if timestamp.endswith("+00:00"):
+                second = timestamp[:19]  # what save_visitor writes
+            else:
+                second = parse_timestamp(timestamp).astimezone(datetime.timezone.utc).strftime("%Y-%m-%dT%H:%M:%S")
+        except (ValueError, KeyError, TypeError, AttributeError):
+            continue
+        rollup["total"] += 1
+        hours[timestamp[:13]] = hours.get(timestamp[:13], 0) + 1
+        countries[entry["country"]] = countries.get(entry["country"], 0) + 1
+        recent.append(entry)
+        online[second] = online.get(second, 0) + 1
+
+    recent.sort(key=lambda x: x["timestamp"], reverse=True)
+    del recent[RECENT_LIMIT:]
+    if online:
+        # Same-format UTC keys sort as strings.
+        cutoff = (datetime.datetime.fromisoformat(max(online)) - ONLINE_WINDOW).strftime("%Y-%m-%dT%H:%M:%S")
+        rollup["online"] = {second: count for second, count in online.items() if second >= cutoff}
+
+def update_rollup(date_str):
+    """Rollup for a day's .jsonl with any newly appended visits counted
+
+    Returns None when there is no file for that day. Only whole lines are
+    consumed: a visit still being appended is picked up next time.
+    """
+    file_path = os.path.join(DATA_DIR, f"{date_str}.jsonl")
+    try:
+        size = os.path.getsize(file_path)
+    except OSError:
+        return None
+
+    rollup = load_rollup(date_str, size)
+    if rollup["offset"] == size:
+        return rollup
+
+    with open(file_path, 'rb') as f:
+        f.seek(rollup["offset"])
+        tail = f.read(size - rollup["offset"])
+    end = tail.rfind(b'\n') + 1
+    if end == 0:
+        return rollup
+
+    add_visits(rollup, tail[:end].decode('utf-8', errors='replace').splitlines())
+    rollup["offset"] += end
+    try:
+        save_rollup(date_str, rollup)
+    except OSError as e:
+        # Still correct for this request; the next one redoes the tail.
+        sys.stderr.write(f"visitor.cgi: cannot save rollup for {date_str}: {e!r}\n")
+    return rollup
+
+def get_stats():
+    """Calculate visitor statistics from the daily rollups"""
     ensure_data_dir()
-    visitors = []
-    
-    # Get date range
+
+    # Same files as before rollups: today and the STATS_DAYS days before it.
     end_date = datetime.datetime.now()
-    start_date = end_date - datetime.timedelta(days=days)
-    
-    # Load files from date range
-    for i in range(days + 1):
-        date = start_date + datetime.timedelta(days=i)
-        date_str = date.strftime("%Y-%m-%d")
-        file_path = os.path.join(DATA_DIR, f"{date_str}.jsonl")
-        
-        if os.path.exists(file_path):
-            with open(file_path, 'r', encoding='utf-8') as f:
-                for line in f:
-                    line = line.strip()
-                    if line:
-                        try:
-                            visitors.append(json.loads(line))
-                        except json.JSONDecodeError:
-                            continue
-    
-    return visitors
+    start_date = end_date - datetime.timedelta(days=STATS_DAYS)
+    rollups = []
+    for i in range(STATS_DAYS + 1):
+        date_str = (start_date + datetime.timedelta(days=i)).strftime("%Y-%m-%d")
+        rollup = update_rollup(date_str)
+        if rollup:
+            rollups.append(rollup)
 
-def get_stats():
-    """Calculate visitor statistics"""
-    # Load recent visitors (last 7 days)
-    all_visitors = load_visitors(days=7)
-    
-    # Today's visitors
-    today = datetime.datetime.now().strftime("%Y-%m-%d")
-    today_visitors = [v for v in all_visitors if v['timestamp'].startswith(today)]
-    
-    # Online now (last 5 minutes)
-    now = datetime.datetime.now(datetime.timezone.utc)
-    five_min_ago = now - datetime.timedelta(minutes=5)
-    online_visitors = [
-        v for v in all_visitors 
-        if datetime.datetime.fromisoformat(v['timestamp'].replace('Z', '+00:00')) > five_min_ago
-    ]
-    
-    # Recent visitors for map (last 100)
-    recent_visitors = sorted(all_visitors, key=lambda x: x['timestamp'], reverse=True)[:100]
-    recent_for_map = [
-        {
-            "country": v["location"]["country"],
-            "city": v["location"]["city"],
-            "lat": v["location"]["lat"],
-            "lon": v["location"]["lon"],
-            "timestamp": v["timestamp"]
-        }
-        for v in recent_visitors
-    ]
-    
-    # Hourly stats for today
+    today = end_date.strftime("%Y-%m-%d")
     hourly_counts = {}
-    for v in today_visitors:
-        hour = v['timestamp'][11:13]  # Extract HH from ISO format
-        hourly_counts[hour] = hourly_counts.get(hour, 0) + 1
-    
-    hourly_stats = [{"hour": f"{h:02d}:00", "count": hourly_counts.get(f"{h:02d}", 0)} for h in range(24)]
-    
-    # Top countries
     country_counts = {}
-    for v in all_visitors:
-        country = v["location"]["country"]
-        country_counts[country] = country_counts.get(country, 0) + 1
-    
+    recent = []
+    online_now = 0
+    # Counted per second, so the oldest counted second may be partly outside the window.
+    five_min_ago = (datetime.datetime.now(datetime.timezone.utc) - ONLINE_WINDOW).strftime("%Y-%m-%dT%H:%M:%S")
+    for rollup in rollups:
+        for key, count in rollup["hours"].items():
+            if key.startswith(today):
+                hourly_counts[key[11:13]] = hourly_counts.get(key[11:13], 0) + count
+        for country, count in rollup["countries"].items():
+            country_counts[country] = country_counts.get(country, 0) + count
+        recent.extend(rollup["recent"])
+        online_now += sum(count for second, count in rollup["online"].items() if second >= five_min_ago)
+
+    # Recent visitors for map (last 100)
+    recent_for_map = sorted(recent, key=lambda x: x["timestamp"], reverse=True)[:RECENT_LIMIT]
+
+    hourly_stats = [{"hour": f"{h:02d}:00", "count": hourly_counts.get(f"{h:02d}", 0)} for h in range(24)]
+
     top_countries = sorted(
         [{"country": k, "count": v} for k, v in country_counts.items()],
         key=lambda x: x["count"],
         reverse=True
     )[:10]
-    
+
     return {
-        "total_visits": len(all_visitors),
-        "today_visits": len(today_visitors),
-        "online_now": len(online_visitors),
+        "total_visits": sum(rollup["total"] for rollup in rollups),
+        "today_visits": sum(hourly_counts.values()),
+        "online_now": online_now,
         "recent_visitors": recent_for_map,
         "hourly_stats": hourly_stats,
         "top_countries": top_countries
@@ -217,7 +303,8 @@ def handler():
             raise ValueError("Invalid action")
         
         stats = get_stats()
-        _lib.send_response(data=stats)
+        _lib.send_response(data=stats, max_age=STATS_MAX_AGE,
+                           stale_while_revalidate=STATS_STALE_WHILE_REVALIDATE, etag=True)
     
     else:
         raise ValueError("Method not allowed")
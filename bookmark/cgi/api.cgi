@@ -1,9 +1,8 @@
-#!/usr/local/bin/python3
+#!/usr/local/bin/python3 -S
 import sys
 import json
 import os
 import urllib.parse
-import traceback
 
 DEBUG = os.environ.get('DEBUG') == '1'
 if DEBUG:
@@ -18,6 +17,7 @@ if DEBUG:
 # Add current directory to path to allow importing app.py
 sys.path.append(os.path.dirname(__file__))
 import app
+from http_util import GZIP_MIN_BYTES, accepts_gzip, etag_matches, gzip_bytes
 
 MAX_BODY_BYTES = 64 * 1024
 MAX_URL_LENGTH = 2048
@@ -27,9 +27,14 @@ MAX_NOTE_LENGTH = 500
 MAX_QUERY_LENGTH = 200
 MAX_TAG_QUERY_LENGTH = 50
 MAX_OFFSET = 100000
+MAX_CURSOR_LENGTH = 512
+MAX_IMPORT_BYTES = 20 * 1024 * 1024
+MAX_IMPORT_ERRORS = 100
+MAX_SINCE_LENGTH = 40
 
 STATUS_TEXT = {
     200: "OK",
+    304: "Not Modified",
     400: "Bad Request",
     403: "Forbidden",
     404: "Not Found",
@@ -37,13 +42,42 @@ STATUS_TEXT = {
     500: "Internal Server Error",
 }
 
-def send_json(data, status=200):
+def data_etag():
+    # Every write to bookmarks bumps the data version, so it identifies the
+    # content of list and tags responses without running their queries.
+    return f'W/"bookmarks-{app.get_data_version()}"'
+
+def send_not_modified(etag):
+    print(f"Status: 304 {STATUS_TEXT[304]}")
+    print("Cache-Control: private, no-cache")
+    print(f"ETag: {etag}")
+    print()
+
+def send_json(data, status=200, etag=None):
+    # With an etag the client may keep the response but must revalidate it.
     if status != 200:
         status_text = STATUS_TEXT.get(status, "Error")
         print(f"Status: {status} {status_text}")
+    body = json.dumps(data, ensure_ascii=False)
+    payload = None
+    large = len(body) >= GZIP_MIN_BYTES
+    if large and accepts_gzip() and hasattr(sys.stdout, 'buffer'):
+        payload = gzip_bytes((body + '\n').encode('utf-8'))
     print("Content-Type: application/json; charset=utf-8")
+    if etag:
+        print("Cache-Control: private, no-cache")
+        print(f"ETag: {etag}")
+    if large:
+        print("Vary: Accept-Encoding")
+    if payload is not None:
+        print("Content-Encoding: gzip")
     print()
-    print(json.dumps(data, ensure_ascii=False))
+    if payload is None:
+        print(body)
+    else:
+        sys.stdout.flush()
+        sys.stdout.buffer.write(payload)
+        sys.stdout.buffer.flush()
 
 def send_error(code, message, status=400, details=None):
     payload = {"ok": False, "error": {"code": code, "message": message}}
@@ -52,6 +86,8 @@ def send_error(code, message, status=400, details=None):
     send_json(payload, status=status)
 
 def log_exception():
+    import traceback
+
     traceback.print_exc(file=sys.stderr)
 
 def parse_int(value, field, min_value=None, max_value=None):
@@ -125,6 +161,85 @@ def normalize_query(value, field, max_length):
         raise ValueError(f"{field} is too long")
     return text
 
+def parse_id_list(value):
+    parts = [p for p in value.split(',') if p.strip()]
+    if not parts or len(parts) > app.MAX_STATUS_IDS:
+        raise ValueError(f"ids must list 1 to {app.MAX_STATUS_IDS} ids")
+    return [parse_int(p, "id", 1, None) for p in parts]
+
+def normalize_tag_filters(values):
+    tags = []
+    for value in values:
+        tag = normalize_query(value, "tag", MAX_TAG_QUERY_LENGTH)
+        if tag:
+            tags.append(tag)
+    if len(tags) > MAX_TAGS:
+        raise ValueError("too many tags")
+    return tags
+
+def handle_import(query_params, content_length):
+    import importer
+
+    if content_length <= 0:
+        send_error("invalid_request", "Request body is required", status=400)
+        return
+    if content_length > MAX_IMPORT_BYTES:
+        send_error("payload_too_large", "Request body too large", status=400)
+        return
+    fmt = query_params.get('format', [None])[0]
+    fetch = query_params.get('fetch', ['defer'])[0]
+    if (fmt is not None and fmt not in importer.FORMATS) or fetch not in importer.FETCH_MODES:
+        send_error("invalid_param", "Invalid query parameter", status=400)
+        return
+
+    errors = []
+
+    def collect_error(result):
+        if result['result'] == 'invalid' and len(errors) < MAX_IMPORT_ERRORS:
+            errors.append(result)
+
+    entries = importer.iter_entries(importer.iter_chunks(sys.stdin.buffer, content_length), fmt)
+    summary = importer.summarize(importer.import_entries(entries, fetch), collect_error)
+    malformed = summary.pop('error', None) is not None
+    if malformed and summary['total'] == 0:
+        send_error("invalid_body", "Malformed import file", status=400)
+        return
+    data = {"summary": summary, "errors": errors, "complete": not malformed}
+    if malformed:
+        # Entries before the malformed part are already stored.
+        data["error"] = {"code": "invalid_body", "message": "Malformed import file"}
+    send_json({"ok": True, "data": data})
+
+def handle_export(query_params):
+    import datetime
+    import exporter
+
+    try:
+        fmt = query_params.get('format', ['ndjson'])[0]
+        if fmt not in exporter.FORMATS:
+            raise ValueError("unknown format")
+        q = normalize_query(query_params.get('q', [None])[0], "q", MAX_QUERY_LENGTH)
+        tags = normalize_tag_filters(query_params.get('tag', []))
+        mode = query_params.get('mode', ['any'])[0]
+        if mode not in ('any', 'all'):
+            raise ValueError("mode must be any or all")
+        since = normalize_query(query_params.get('since', [None])[0], "since", MAX_SINCE_LENGTH)
+        since = exporter.parse_since(since)
+    except ValueError:
+        send_error("invalid_param", "Invalid query parameter", status=400)
+        return
+
+    filename = f"bookmarks-{datetime.date.today():%Y%m%d}.{exporter.EXTENSIONS[fmt]}"
+    print(f"Content-Type: {exporter.CONTENT_TYPES[fmt]}")
+    print(f'Content-Disposition: attachment; filename="{filename}"')
+    print()
+    sys.stdout.flush()
+    try:
+        exporter.export(sys.stdout, fmt, q, tags, mode, since)
+    except Exception:
+        # Headers are already out; a truncated body is all we can signal.
+        log_exception()
+
 def check_same_origin():
     host = os.environ.get('HTTP_HOST')
     if not host:
@@ -155,18 +270,47 @@ def main():
                     limit = parse_int(query_params.get('limit', [50])[0], "limit", 1, 200)
                     offset = parse_int(query_params.get('offset', [0])[0], "offset", 0, MAX_OFFSET)
                     q = normalize_query(query_params.get('q', [None])[0], "q", MAX_QUERY_LENGTH)
-                    tag = normalize_query(query_params.get('tag', [None])[0], "tag", MAX_TAG_QUERY_LENGTH)
+                    tags = normalize_tag_filters(query_params.get('tag', []))
+                    mode = query_params.get('mode', ['any'])[0]
+                    if mode not in ('any', 'all'):
+                        raise ValueError("mode must be any or all")
+                    snippet = parse_int(query_params.get('snippet', [0])[0], "snippet", 0, 1) == 1
+                    count = parse_int(query_params.get('count', [1])[0], "count", 0, 1) == 1
+                    cursor = normalize_query(query_params.get('cursor', [None])[0], "cursor", MAX_CURSOR_LENGTH)
+                    after = app.decode_cursor(cursor)
                 except ValueError:
                     send_error("invalid_param", "Invalid query parameter", status=400)
                     return
-                result = app.get_bookmarks(limit, offset, q, tag)
-                send_json({"ok": True, "data": result})
+                etag = data_etag()
+                if etag_matches(etag):
+                    send_not_modified(etag)
+                    return
+                try:
+                    result = app.get_bookmarks(limit, offset, q, tags, snippet=snippet, mode=mode, cursor=after, count=count)
+                except ValueError:
+                    send_error("invalid_param", "Cursor does not match query", status=400)
+                    return
+                send_json({"ok": True, "data": result}, etag=etag)
+            elif action == 'status':
+                try:
+                    ids = parse_id_list(query_params.get('ids', [''])[0])
+                except ValueError:
+                    send_error("invalid_param", "Invalid ids", status=400)
+                    return
+                result = app.get_bookmark_statuses(ids)
+                send_json({"ok": True, "data": {"items": result}})
             elif action == 'tags':
+                etag = data_etag()
+                if etag_matches(etag):
+                    send_not_modified(etag)
+                    return
                 result = app.get_tags()
-                send_json({"ok": True, "data": {"tags": result}})
+                send_json({"ok": True, "data": {"tags": result}}, etag=etag)
             elif action == 'health':
                 result = app.check_health()
                 send_json({"ok": True, "data": result})
+            elif action == 'export':
+                handle_export(query_params)
             elif action == 'get':
                 try:
                     id_ = parse_int(query_params.get('id', [None])[0], "id", 1, None)
@@ -187,6 +331,9 @@ def main():
             except Exception:
                 send_error("invalid_request", "Invalid Content-Length", status=400)
                 return
+            if action == 'import':
+                handle_import(query_params, content_length)
+                return
             if content_length > MAX_BODY_BYTES:
                 send_error("payload_too_large", "Request body too large", status=400)
                 return
@@ -205,6 +352,9 @@ def main():
                     url = validate_url(data.get('url'))
                     tags = normalize_tags_input(data.get('tags'))
                     note = normalize_note(data.get('note'))
+                    defer = data.get('defer', False)
+                    if not isinstance(defer, bool):
+                        raise ValueError("defer must be a boolean")
                 except ValueError:
                     send_error("invalid_param", "Invalid input", status=400)
                     return
@@ -213,7 +363,7 @@ def main():
                     send_error("invalid_param", "URL is not allowed", status=400)
                     return
 
-                result = app.add_bookmark(url, tags, note)
+                result = app.add_bookmark(url, tags, note, defer=defer)
                 send_json({"ok": True, "data": {"bookmark": result}})
             elif action == 'delete':
                 try:
@@ -1,69 +1,77 @@
 import sqlite3
 import os
-import urllib.request
+import sys
 import urllib.parse
-import socket
-import ipaddress
 import datetime
-from html.parser import HTMLParser
+import json
+import base64
+import time
 
 # Database path relative to this file
 DB_PATH_DEFAULT = os.path.join(os.path.dirname(__file__), 'data', 'bookmarks.sqlite3')
-
-MAX_FETCH_BYTES = 1024 * 1024  # 1MB
-
-class MetaParser(HTMLParser):
-    def __init__(self):
-        super().__init__()
-        self.title = None
-        self.og_title = None
-        self.og_description = None
-        self.description = None
-        self.og_image = None
-        self.og_site_name = None
-        self.in_title = False
-
-    def handle_starttag(self, tag, attrs):
-        attrs_dict = dict(attrs)
-        if tag == 'title':
-            self.in_title = True
-        elif tag == 'meta':
-            name = attrs_dict.get('name', '').lower()
-            property_ = attrs_dict.get('property', '').lower()
-            content = attrs_dict.get('content', '')
-            
-            if property_ == 'og:title':
-                self.og_title = content
-            elif property_ == 'og:description':
-                self.og_description = content
-            elif property_ == 'og:image':
-                self.og_image = content
-            elif property_ == 'og:site_name':
-                self.og_site_name = content
-            elif name == 'description':
-                self.description = content
-
-    def handle_endtag(self, tag):
-        if tag == 'title':
-            self.in_title = False
-
-    def handle_data(self, data):
-        if self.in_title and not self.title:
-            text = data.strip()
-            if text:
-                self.title = text
+# WAL lets readers run alongside a writer; concurrent writers wait up to
+# DB_BUSY_TIMEOUT seconds for the lock instead of failing "database is locked".
+DB_BUSY_TIMEOUT = 5.0
+DB_CACHE_SIZE_KIB = 8 * 1024
+
+# The trigram tokenizer indexes every 3-character window, so MATCH keeps the
+# substring semantics of the old LIKE '%q%' search (including Japanese text).
+FTS_MIN_QUERY_LENGTH = 3
+FTS_COLUMNS = ('title', 'description', 'url', 'tags', 'note')
+FTS_WEIGHTS = (10.0, 5.0, 2.0, 5.0, 1.0)
+SNIPPET_TOKENS = 16
+
+MAX_STATUS_IDS = 100
+EXPORT_BATCH_SIZE = 500
+# Stays under SQLITE_MAX_VARIABLE_NUMBER (999 on older builds) for IN (...) lists.
+SQL_CHUNK_SIZE = 500
 
 def get_db_path():
     return os.environ.get('BOOKMARK_DB_PATH', DB_PATH_DEFAULT)
 
-def get_db_connection():
-    conn = sqlite3.connect(get_db_path())
+# Paths whose schema this process has already checked; later connections
+# skip the user_version read entirely.
+_schema_ready = set()
+
+def get_db_connection(path=None):
+    path = path or get_db_path()
+    conn = sqlite3.connect(path, timeout=DB_BUSY_TIMEOUT)
     conn.row_factory = sqlite3.Row
+    conn.execute('PRAGMA synchronous = NORMAL')
+    conn.execute(f'PRAGMA cache_size = -{DB_CACHE_SIZE_KIB}')
+    if path not in _schema_ready:
+        migrate(conn)
+        _schema_ready.add(path)
     return conn
 
 def init_db():
-    conn = get_db_connection()
+    # Checks the schema version now instead of on first use.
+    _schema_ready.discard(get_db_path())
+    get_db_connection().close()
+
+def migrate(conn):
     c = conn.cursor()
+    # Persistent in the database file; a no-op once the file is in WAL mode.
+    c.execute('PRAGMA journal_mode = WAL')
+    c.execute('PRAGMA user_version')
+    if c.fetchone()[0] >= SCHEMA_VERSION:
+        return
+    c.execute('BEGIN IMMEDIATE')
+    try:
+        # Another process may have migrated while we waited for the lock.
+        c.execute('PRAGMA user_version')
+        version = c.fetchone()[0]
+        for step in MIGRATIONS[version:]:
+            step(c)
+        c.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+def migrate_v1(c):
+    # Baseline schema. Every statement is idempotent so databases created
+    # before user_version was tracked (version 0) are adopted as they are.
     c.execute('''
         CREATE TABLE IF NOT EXISTS bookmarks (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -87,8 +95,201 @@ def init_db():
     columns = {row[1] for row in c.fetchall()}
     if 'site_name' not in columns:
         c.execute('ALTER TABLE bookmarks ADD COLUMN site_name TEXT')
-    conn.commit()
-    conn.close()
+    init_fts(c)
+    init_tag_tables(c)
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS fetch_jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            bookmark_id INTEGER NOT NULL UNIQUE,
+            url TEXT NOT NULL,
+            host TEXT NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at REAL NOT NULL,
+            last_error TEXT,
+            created_at TEXT
+        )
+    ''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_fetch_jobs_next_attempt_at ON fetch_jobs(next_attempt_at)')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS fetch_cache (
+            url_norm TEXT PRIMARY KEY,
+            status TEXT,
+            title TEXT,
+            description TEXT,
+            image_url TEXT,
+            site_name TEXT,
+            http_status INTEGER,
+            error_message TEXT,
+            etag TEXT,
+            last_modified TEXT,
+            fetched_at REAL NOT NULL
+        )
+    ''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_fetch_cache_fetched_at ON fetch_cache(fetched_at)')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS dns_cache (
+            host TEXT PRIMARY KEY,
+            addresses TEXT NOT NULL,
+            expires_at REAL NOT NULL
+        )
+    ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS fetch_cache_stats (
+            name TEXT PRIMARY KEY,
+            value INTEGER NOT NULL
+        )
+    ''')
+    c.execute('''
+        CREATE TRIGGER IF NOT EXISTS bookmarks_jobs_ad AFTER DELETE ON bookmarks BEGIN
+            DELETE FROM fetch_jobs WHERE bookmark_id = old.id;
+        END
+    ''')
+
+def migrate_v2(c):
+    # fetched_at (epoch seconds, 0 = never) drives recrawl.py. Existing rows
+    # are backdated to created_at, which is when their metadata was fetched.
+    c.execute("PRAGMA table_info(bookmarks)")
+    if 'fetched_at' not in {row[1] for row in c.fetchall()}:
+        c.execute('ALTER TABLE bookmarks ADD COLUMN fetched_at REAL NOT NULL DEFAULT 0')
+        c.execute('''
+            UPDATE bookmarks SET fetched_at = COALESCE((julianday(created_at) - 2440587.5) * 86400.0, 0)
+            WHERE status != 'pending'
+        ''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_bookmarks_fetched_at ON bookmarks(fetched_at)')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS recrawl_checkpoints (
+            name TEXT PRIMARY KEY,
+            state TEXT NOT NULL,
+            updated_at TEXT
+        )
+    ''')
+
+def migrate_v3(c):
+    # data_versions.version changes with every write to bookmarks, so list and
+    # tags responses get an ETag without reading the rows. It starts at the
+    # creation time in ms so a recreated database does not reuse old ETags.
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS data_versions (
+            name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL
+        )
+    ''')
+    c.execute("INSERT OR IGNORE INTO data_versions (name, version) VALUES ('bookmarks', ?)",
+              (int(time.time() * 1000),))
+    for event, suffix in (('INSERT', 'ai'), ('UPDATE', 'au'), ('DELETE', 'ad')):
+        c.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS bookmarks_version_{suffix} AFTER {event} ON bookmarks BEGIN
+                UPDATE data_versions SET version = version + 1 WHERE name = 'bookmarks';
+            END
+        ''')
+
+def migrate_v4(c):
+    # fetch_failures counts failed refreshes in a row, so recrawl.py can keep
+    # an ok bookmark ok through a transient outage.
+    c.execute("PRAGMA table_info(bookmarks)")
+    if 'fetch_failures' not in {row[1] for row in c.fetchall()}:
+        c.execute('ALTER TABLE bookmarks ADD COLUMN fetch_failures INTEGER NOT NULL DEFAULT 0')
+
+MIGRATIONS = [migrate_v1, migrate_v2, migrate_v3, migrate_v4]
+SCHEMA_VERSION = len(MIGRATIONS)
+
+def init_tag_tables(c):
+    c.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'bookmark_tags'")
+    exists = c.fetchone() is not None
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS bookmark_tags (
+            bookmark_id INTEGER NOT NULL,
+            tag TEXT NOT NULL,
+            PRIMARY KEY (bookmark_id, tag)
+        )
+    ''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_bookmark_tags_tag ON bookmark_tags(tag, bookmark_id)')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS tag_counts (
+            tag TEXT PRIMARY KEY,
+            count INTEGER NOT NULL
+        )
+    ''')
+    c.execute('''
+        CREATE TRIGGER IF NOT EXISTS bookmark_tags_ai AFTER INSERT ON bookmark_tags BEGIN
+            INSERT INTO tag_counts(tag, count) VALUES (new.tag, 1)
+                ON CONFLICT(tag) DO UPDATE SET count = count + 1;
+        END
+    ''')
+    c.execute('''
+        CREATE TRIGGER IF NOT EXISTS bookmark_tags_ad AFTER DELETE ON bookmark_tags BEGIN
+            UPDATE tag_counts SET count = count - 1 WHERE tag = old.tag;
+            DELETE FROM tag_counts WHERE tag = old.tag AND count <= 0;
+        END
+    ''')
+    c.execute('''
+        CREATE TRIGGER IF NOT EXISTS bookmarks_tags_ad AFTER DELETE ON bookmarks BEGIN
+            DELETE FROM bookmark_tags WHERE bookmark_id = old.id;
+        END
+    ''')
+    if not exists:
+        # One-time migration from the comma-joined tags column.
+        c.execute("SELECT id, tags FROM bookmarks WHERE tags IS NOT NULL AND tags != ''")
+        for row in c.fetchall():
+            set_bookmark_tags(c, row[0], row[1])
+
+def split_tags(tags):
+    if not tags:
+        return []
+    return [t.strip() for t in tags.split(',') if t.strip()]
+
+def set_bookmark_tags(c, bookmark_id, tags):
+    c.execute('DELETE FROM bookmark_tags WHERE bookmark_id = ?', (bookmark_id,))
+    c.executemany(
+        'INSERT OR IGNORE INTO bookmark_tags (bookmark_id, tag) VALUES (?, ?)',
+        [(bookmark_id, t) for t in split_tags(tags)]
+    )
+
+def init_fts(c):
+    c.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'bookmarks_fts'")
+    exists = c.fetchone() is not None
+    if not exists:
+        try:
+            c.execute('''
+                CREATE VIRTUAL TABLE bookmarks_fts USING fts5(
+                    title, description, url, tags, note,
+                    content='bookmarks', content_rowid='id', tokenize='trigram'
+                )
+            ''')
+        except sqlite3.OperationalError:
+            # SQLite built without FTS5 (or older than 3.34): keep LIKE search.
+            return False
+
+    cols = ', '.join(FTS_COLUMNS)
+    new_cols = ', '.join(f'new.{col}' for col in FTS_COLUMNS)
+    old_cols = ', '.join(f'old.{col}' for col in FTS_COLUMNS)
+    c.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS bookmarks_fts_ai AFTER INSERT ON bookmarks BEGIN
+            INSERT INTO bookmarks_fts(rowid, {cols}) VALUES (new.id, {new_cols});
+        END
+    ''')
+    c.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS bookmarks_fts_ad AFTER DELETE ON bookmarks BEGIN
+            INSERT INTO bookmarks_fts(bookmarks_fts, rowid, {cols}) VALUES ('delete', old.id, {old_cols});
+        END
+    ''')
+    c.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS bookmarks_fts_au AFTER UPDATE ON bookmarks BEGIN
+            INSERT INTO bookmarks_fts(bookmarks_fts, rowid, {cols}) VALUES ('delete', old.id, {old_cols});
+            INSERT INTO bookmarks_fts(rowid, {cols}) VALUES (new.id, {new_cols});
+        END
+    ''')
+    if not exists:
+        # Index rows that were stored before the FTS table existed.
+        c.execute("INSERT INTO bookmarks_fts(bookmarks_fts) VALUES ('rebuild')")
+    return True
+
+def has_fts(c):
+    c.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'bookmarks_fts'")
+    return c.fetchone() is not None
+
+def fts_phrase(q):
+    return '"' + q.replace('"', '""') + '"'
 
 def normalize_tags(tags):
     if tags is None:
@@ -113,36 +314,6 @@ def normalize_tags(tags):
 
     return ','.join(cleaned) if cleaned else None
 
-def is_safe_url(url):
-    try:
-        parsed = urllib.parse.urlparse(url)
-        hostname = parsed.hostname
-        if not hostname or parsed.scheme not in ('http', 'https'):
-            return False
-
-
-        try:
-            ip = ipaddress.ip_address(hostname)
-            return ip.is_global
-        except ValueError:
-            pass
-
-        # Resolve hostname to all addresses and ensure all are global
-        try:
-            infos = socket.getaddrinfo(hostname, None)
-        except socket.gaierror:
-            return False
-
-        for info in infos:
-            ip_str = info[4][0]
-            ip = ipaddress.ip_address(ip_str)
-            if not ip.is_global:
-                return False
-
-        return True
-    except Exception:
-        return False
-
 def normalize_url(url):
     parsed = urllib.parse.urlparse(url.strip())
     scheme = parsed.scheme.lower()
@@ -164,62 +335,37 @@ def normalize_url(url):
 
     return urllib.parse.urlunparse(parsed._replace(scheme=scheme, netloc=netloc, path=path, fragment=''))
 
-def fetch_metadata(url):
-    if not is_safe_url(url):
-        return {'status': 'fetch_error', 'error_message': 'Unsafe URL or invalid hostname'}
-
-    if os.environ.get('BOOKMARK_FETCH_STUB') == '1':
-        return {
-            'status': 'ok',
-            'title': 'Stub Title',
-            'description': 'Stub Description',
-            'image_url': 'https://example.com/stub.png',
-            'site_name': 'Stub Site',
-            'http_status': 200
-        }
-
-    try:
-        req = urllib.request.Request(
-            url, 
-            headers={'User-Agent': 'Mozilla/5.0 (compatible; BookmarkBot/1.0)'}
-        )
-        with urllib.request.urlopen(req, timeout=10) as response:
-            if response.status != 200:
-                return {'status': 'fetch_error', 'http_status': response.status}
-
-            raw = response.read(MAX_FETCH_BYTES + 1)
-            if len(raw) > MAX_FETCH_BYTES:
-                return {'status': 'fetch_error', 'http_status': response.status, 'error_message': 'Response too large'}
-
-            html_content = raw.decode('utf-8', errors='ignore')
-
-            parser = MetaParser()
-            try:
-                parser.feed(html_content)
-            except Exception:
-                return {'status': 'parse_error', 'http_status': response.status, 'error_message': 'Parse error'}
-
-            title = parser.og_title or parser.title
-            description = parser.og_description or parser.description
-            image_url = parser.og_image
-            site_name = parser.og_site_name
-
-            return {
-                'status': 'ok',
-                'title': title,
-                'description': description,
-                'image_url': image_url,
-                'site_name': site_name,
-                'http_status': 200
-            }
-    except Exception as e:
-        return {'status': 'fetch_error', 'error_message': str(e)}
-
-def add_bookmark(url, tags=None, note=None):
-    init_db()
+def is_safe_url(url):
+    # The network stack lives in fetcher.py and loads only when needed.
+    import fetcher
+    return fetcher.is_safe_url(url)
+
+def fetch_metadata(url, negative_cache=True):
+    import fetcher
+    return fetcher.fetch_metadata(url, negative_cache)
+
+def get_cache_stats(c):
+    c.execute('SELECT name, value FROM fetch_cache_stats')
+    stats = {'hits': 0, 'misses': 0, 'revalidated': 0}
+    stats.update((row[0], row[1]) for row in c.fetchall())
+    # Plus this process's counts that are not written yet; a process that
+    # never imported fetcher has none.
+    fetcher = sys.modules.get('fetcher')
+    if fetcher is not None:
+        for name, value in fetcher.pending_cache_events().items():
+            stats[name] = stats.get(name, 0) + value
+    c.execute('SELECT COUNT(*) FROM fetch_cache')
+    stats['entries'] = c.fetchone()[0]
+    return stats
+
+def add_bookmark(url, tags=None, note=None, defer=False):
     url_norm = normalize_url(url)
     
-    meta = fetch_metadata(url_norm)
+    if defer:
+        # Store now, enrich later: worker.py drains fetch_jobs.
+        meta = {'status': 'pending'}
+    else:
+        meta = fetch_metadata(url_norm)
     
     tags = normalize_tags(tags)
     
@@ -228,14 +374,18 @@ def add_bookmark(url, tags=None, note=None):
     now = datetime.datetime.now().isoformat()
     
     c.execute('''
-        INSERT INTO bookmarks (created_at, url, url_norm, title, description, image_url, site_name, tags, note, status, http_status, error_message)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        INSERT INTO bookmarks (created_at, url, url_norm, title, description, image_url, site_name, tags, note, status, http_status, error_message, fetched_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
     ''', (
         now, url, url_norm, 
         meta.get('title'), meta.get('description'), meta.get('image_url'), meta.get('site_name'),
-        tags, note, meta.get('status'), meta.get('http_status'), meta.get('error_message')
+        tags, note, meta.get('status'), meta.get('http_status'), meta.get('error_message'),
+        0 if defer else time.time()
     ))
     new_id = c.lastrowid
+    set_bookmark_tags(c, new_id, tags)
+    if defer:
+        enqueue_fetch_job(c, new_id, url_norm)
     conn.commit()
     
     c.execute('SELECT * FROM bookmarks WHERE id = ?', (new_id,))
@@ -243,8 +393,110 @@ def add_bookmark(url, tags=None, note=None):
     conn.close()
     return dict(row)
 
+def find_existing_url_norms(c, url_norms):
+    existing = set()
+    url_norms = list(url_norms)
+    for i in range(0, len(url_norms), SQL_CHUNK_SIZE):
+        chunk = url_norms[i:i + SQL_CHUNK_SIZE]
+        placeholders = ', '.join(['?'] * len(chunk))
+        c.execute(f"SELECT url_norm FROM bookmarks WHERE url_norm IN ({placeholders})", chunk)
+        existing.update(row[0] for row in c.fetchall())
+    return existing
+
+def get_existing_url_norms(url_norms):
+    conn = get_db_connection()
+    try:
+        return find_existing_url_norms(conn.cursor(), url_norms)
+    finally:
+        conn.close()
+
+def add_bookmarks(entries, defer=False):
+    # Bulk insert for imports. entries carry url, url_norm, normalized tags,
+    # note, created_at and any metadata already fetched; rows whose url_norm
+    # is already stored are skipped. Returns ({url_norm: id}, stored url_norms).
+    conn = get_db_connection()
+    c = conn.cursor()
+    existing = find_existing_url_norms(c, {e['url_norm'] for e in entries})
+    now = time.time()
+    fresh = []
+    seen = set()
+    for e in entries:
+        if e['url_norm'] in existing or e['url_norm'] in seen:
+            continue
+        seen.add(e['url_norm'])
+        fresh.append(e)
+
+    c.executemany('''
+        INSERT INTO bookmarks (created_at, url, url_norm, title, description, image_url, site_name, tags, note, status, http_status, error_message, fetched_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', [(
+        e.get('created_at') or datetime.datetime.now().isoformat(), e['url'], e['url_norm'],
+        e.get('title'), e.get('description'), e.get('image_url'), e.get('site_name'),
+        e.get('tags'), e.get('note'), 'pending' if defer else e.get('status', 'ok'),
+        e.get('http_status'), e.get('error_message'),
+        # Entries imported with fetch=none were never fetched: recrawl picks them up.
+        now if not defer and 'status' in e else 0
+    ) for e in fresh])
+
+    ids = {}
+    norms = [e['url_norm'] for e in fresh]
+    for i in range(0, len(norms), SQL_CHUNK_SIZE):
+        chunk = norms[i:i + SQL_CHUNK_SIZE]
+        placeholders = ', '.join(['?'] * len(chunk))
+        c.execute(f"SELECT id, url_norm FROM bookmarks WHERE url_norm IN ({placeholders})", chunk)
+        ids.update((row['url_norm'], row['id']) for row in c.fetchall())
+
+    c.executemany(
+        'INSERT OR IGNORE INTO bookmark_tags (bookmark_id, tag) VALUES (?, ?)',
+        [(ids[e['url_norm']], t) for e in fresh for t in split_tags(e.get('tags'))]
+    )
+    if defer:
+        created = datetime.datetime.now().isoformat()
+        c.executemany('''
+            INSERT OR IGNORE INTO fetch_jobs (bookmark_id, url, host, next_attempt_at, created_at)
+            VALUES (?, ?, ?, ?, ?)
+        ''', [(
+            ids[e['url_norm']], e['url_norm'], urllib.parse.urlparse(e['url_norm']).hostname or '', now, created
+        ) for e in fresh])
+    conn.commit()
+    conn.close()
+    return ids, existing
+
+def enqueue_fetch_job(c, bookmark_id, url_norm, delay=0):
+    host = urllib.parse.urlparse(url_norm).hostname or ''
+    c.execute('''
+        INSERT OR IGNORE INTO fetch_jobs (bookmark_id, url, host, next_attempt_at, created_at)
+        VALUES (?, ?, ?, ?, ?)
+    ''', (bookmark_id, url_norm, host, time.time() + delay, datetime.datetime.now().isoformat()))
+
+def update_bookmark_metadata(c, bookmark_id, meta):
+    c.execute('''
+        UPDATE bookmarks
+        SET title = COALESCE(?, title), description = COALESCE(?, description),
+            image_url = ?, site_name = ?, status = ?, http_status = ?, error_message = ?, fetched_at = ?,
+            fetch_failures = 0
+        WHERE id = ?
+    ''', (
+        meta.get('title'), meta.get('description'), meta.get('image_url'), meta.get('site_name'),
+        meta.get('status'), meta.get('http_status'), meta.get('error_message'), time.time(), bookmark_id
+    ))
+
+def get_bookmark_statuses(ids):
+    ids = list(ids)[:MAX_STATUS_IDS]
+    if not ids:
+        return []
+    conn = get_db_connection()
+    c = conn.cursor()
+    placeholders = ', '.join(['?'] * len(ids))
+    c.execute(f'''
+        SELECT id, status, title, description, image_url, site_name, http_status, error_message
+        FROM bookmarks WHERE id IN ({placeholders})
+    ''', ids)
+    rows = c.fetchall()
+    conn.close()
+    return [dict(row) for row in rows]
+
 def get_bookmark(id):
-    init_db()
     conn = get_db_connection()
     c = conn.cursor()
     c.execute('SELECT * FROM bookmarks WHERE id = ?', (id,))
@@ -252,51 +504,134 @@ def get_bookmark(id):
     conn.close()
     return dict(row) if row else None
 
-def get_bookmarks(limit=50, offset=0, q=None, tag=None):
-    init_db()
-    conn = get_db_connection()
-    c = conn.cursor()
-    
-    query = "SELECT * FROM bookmarks WHERE 1=1"
+def encode_cursor(row, ranked):
+    if ranked:
+        payload = {'r': row['rank'], 'i': row['id']}
+    else:
+        payload = {'c': row['created_at'], 'i': row['id']}
+    raw = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor):
+    if cursor is None:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        payload = json.loads(raw.decode('utf-8'))
+    except Exception:
+        raise ValueError("invalid cursor")
+    if not isinstance(payload, dict) or not isinstance(payload.get('i'), int):
+        raise ValueError("invalid cursor")
+    if isinstance(payload.get('r'), (int, float)) or isinstance(payload.get('c'), str):
+        return payload
+    raise ValueError("invalid cursor")
+
+def bookmark_filters(c, q=None, tag=None, mode='any'):
+    # Shared WHERE clause for list and export: returns (use_fts, where, params).
+    use_fts = bool(q) and len(q) >= FTS_MIN_QUERY_LENGTH and has_fts(c)
+    where = "1=1"
     params = []
-    
-    if q:
-        query += " AND (title LIKE ? OR description LIKE ? OR url LIKE ? OR tags LIKE ? OR note LIKE ?)"
+
+    if q and use_fts:
+        where += " AND bookmarks_fts MATCH ?"
+        params.append(fts_phrase(q))
+    elif q:
+        where += " AND (b.title LIKE ? OR b.description LIKE ? OR b.url LIKE ? OR b.tags LIKE ? OR b.note LIKE ?)"
         wild = f"%{q}%"
         params.extend([wild, wild, wild, wild, wild])
-    
-    if tag:
-        tag_norm = normalize_tags([tag])
-        if tag_norm:
-            query += " AND (tags = ? OR tags LIKE ? OR tags LIKE ? OR tags LIKE ?)"
-            params.extend([tag_norm, f"{tag_norm},%", f"%,{tag_norm}", f"%,{tag_norm},%"])
-        
-    query += " ORDER BY created_at DESC LIMIT ? OFFSET ?"
-    params.extend([limit, offset])
-    
-    c.execute(query, params)
+
+    tag_list = split_tags(normalize_tags([tag] if isinstance(tag, str) else tag))
+    if tag_list:
+        placeholders = ', '.join(['?'] * len(tag_list))
+        subquery = f"SELECT bookmark_id FROM bookmark_tags WHERE tag IN ({placeholders})"
+        if mode == 'all' and len(tag_list) > 1:
+            subquery += " GROUP BY bookmark_id HAVING COUNT(*) = ?"
+            params.extend(tag_list + [len(tag_list)])
+        else:
+            params.extend(tag_list)
+        where += f" AND b.id IN ({subquery})"
+    return use_fts, where, params
+
+def get_bookmarks(limit=50, offset=0, q=None, tag=None, snippet=False, mode='any', cursor=None, count=True):
+    conn = get_db_connection()
+    c = conn.cursor()
+
+    use_fts, where, params = bookmark_filters(c, q, tag, mode)
+    after = decode_cursor(cursor) if isinstance(cursor, str) else cursor
+    if after is not None and ('r' in after) != use_fts:
+        raise ValueError("cursor does not match query")
+
+    if use_fts:
+        weights = ', '.join(str(w) for w in FTS_WEIGHTS)
+        columns = "b.*, bm25(bookmarks_fts, " + weights + ") AS rank"
+        if snippet:
+            columns += f", snippet(bookmarks_fts, -1, '<mark>', '</mark>', '…', {SNIPPET_TOKENS}) AS snippet"
+        source = "bookmarks_fts JOIN bookmarks b ON b.id = bookmarks_fts.rowid"
+        # Ranking needs every match scored, so the keyset filter wraps the scored set.
+        query = f"SELECT * FROM (SELECT {columns} FROM {source} WHERE {where})"
+        page_params = list(params)
+        if after is not None:
+            query += " WHERE (rank > ? OR (rank = ? AND id < ?))"
+            page_params.extend([after['r'], after['r'], after['i']])
+        query += " ORDER BY rank, id DESC"
+    else:
+        source = "bookmarks b"
+        query = f"SELECT b.* FROM {source} WHERE {where}"
+        page_params = list(params)
+        if after is not None:
+            # Seeks idx_bookmarks_created_at, whose entries are (created_at, rowid).
+            query += " AND (b.created_at, b.id) < (?, ?)"
+            page_params.extend([after['c'], after['i']])
+        query += " ORDER BY b.created_at DESC, b.id DESC"
+
+    if after is not None:
+        offset = 0
+    query += " LIMIT ? OFFSET ?"
+    c.execute(query, page_params + [limit + 1, offset])
     rows = c.fetchall()
-    
-    count_query = "SELECT COUNT(*) FROM bookmarks WHERE 1=1"
-    count_params = []
-    if q:
-        count_query += " AND (title LIKE ? OR description LIKE ? OR url LIKE ? OR tags LIKE ? OR note LIKE ?)"
-        wild = f"%{q}%"
-        count_params.extend([wild, wild, wild, wild, wild])
-    if tag:
-        tag_norm = normalize_tags([tag])
-        if tag_norm:
-            count_query += " AND (tags = ? OR tags LIKE ? OR tags LIKE ? OR tags LIKE ?)"
-            count_params.extend([tag_norm, f"{tag_norm},%", f"%,{tag_norm}", f"%,{tag_norm},%"])
-        
-    c.execute(count_query, count_params)
-    total = c.fetchone()[0]
-    
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1], use_fts)
+
+    total = None
+    if count:
+        c.execute(f"SELECT COUNT(*) FROM {source} WHERE {where}", params)
+        total = c.fetchone()[0]
+
     conn.close()
-    return {'items': [dict(row) for row in rows], 'total': total, 'limit': limit, 'offset': offset}
+    items = []
+    for row in rows:
+        item = dict(row)
+        item.pop('rank', None)
+        if snippet and 'snippet' not in item:
+            item['snippet'] = None
+        items.append(item)
+    return {'items': items, 'total': total, 'limit': limit, 'offset': offset, 'next_cursor': next_cursor}
+
+def iter_bookmarks(q=None, tag=None, mode='any', since=None, batch_size=EXPORT_BATCH_SIZE):
+    # Yields matching rows as lists of dicts, batch_size at a time, oldest
+    # first. Rows come off one cursor with fetchmany, so memory stays flat.
+    conn = get_db_connection()
+    try:
+        c = conn.cursor()
+        use_fts, where, params = bookmark_filters(c, q, tag, mode)
+        if since:
+            where += " AND b.created_at >= ?"
+            params.append(since)
+        source = "bookmarks_fts JOIN bookmarks b ON b.id = bookmarks_fts.rowid" if use_fts else "bookmarks b"
+        # Walks idx_bookmarks_created_at in order; no sort for unfiltered exports.
+        c.execute(f"SELECT b.* FROM {source} WHERE {where} ORDER BY b.created_at, b.id", params)
+        while True:
+            rows = c.fetchmany(batch_size)
+            if not rows:
+                break
+            yield [dict(row) for row in rows]
+    finally:
+        conn.close()
 
 def delete_bookmark(id):
-    init_db()
     conn = get_db_connection()
     c = conn.cursor()
     c.execute("DELETE FROM bookmarks WHERE id = ?", (id,))
@@ -304,29 +639,30 @@ def delete_bookmark(id):
     conn.close()
     return True
 
+def get_data_version():
+    # Bumped by triggers on every bookmarks write; backs the list/tags ETags.
+    conn = get_db_connection()
+    try:
+        row = conn.execute("SELECT version FROM data_versions WHERE name = 'bookmarks'").fetchone()
+    finally:
+        conn.close()
+    return row[0] if row else 0
+
 def get_tags():
-    init_db()
     conn = get_db_connection()
     c = conn.cursor()
-    c.execute("SELECT tags FROM bookmarks WHERE tags IS NOT NULL AND tags != ''")
+    c.execute("SELECT tag, count FROM tag_counts ORDER BY count DESC, tag")
     rows = c.fetchall()
     conn.close()
-    
-    tag_counts = {}
-    for row in rows:
-        tags_str = row['tags']
-        if tags_str:
-            for t in tags_str.split(','):
-                t = t.strip()
-                if t:
-                    tag_counts[t] = tag_counts.get(t, 0) + 1
-                    
-    sorted_tags = [{'tag': k, 'count': v} for k, v in sorted(tag_counts.items(), key=lambda item: item[1], reverse=True)]
-    return sorted_tags
+    return [{'tag': row['tag'], 'count': row['count']} for row in rows]
 
 def check_health():
     try:
-        init_db()
-        return {"time": datetime.datetime.now().isoformat(), "db": "ok"}
+        conn = get_db_connection()
+        try:
+            fetch_cache = get_cache_stats(conn.cursor())
+        finally:
+            conn.close()
+        return {"time": datetime.datetime.now().isoformat(), "db": "ok", "fetch_cache": fetch_cache}
     except Exception:
         return {"time": datetime.datetime.now().isoformat(), "db": "ng"}
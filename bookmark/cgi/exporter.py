@@ -0,0 +1,108 @@
+#!/usr/local/bin/python3
+import argparse
+import csv
+import datetime
+import html
+import json
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+import app
+
+# Streaming export of the archive; the counterpart of importer.py.
+#   API: GET ?action=export&format=ndjson|csv|netscape[&q=...][&tag=...][&since=2026-01-01]
+#   CLI: python3 exporter.py --format netscape > bookmarks.html
+# Rows are written and flushed one fetchmany batch at a time.
+
+FORMATS = ('ndjson', 'csv', 'netscape')
+CONTENT_TYPES = {
+    'ndjson': 'application/x-ndjson; charset=utf-8',
+    'csv': 'text/csv; charset=utf-8',
+    'netscape': 'text/html; charset=utf-8',
+}
+EXTENSIONS = {'ndjson': 'ndjson', 'csv': 'csv', 'netscape': 'html'}
+COLUMNS = ('id', 'url', 'title', 'description', 'image_url', 'site_name', 'tags', 'note',
+           'status', 'http_status', 'created_at')
+
+NETSCAPE_HEADER = '''<!DOCTYPE NETSCAPE-Bookmark-file-1>
+<META HTTP-EQUIV="Content-Type" CONTENT="text/html; charset=UTF-8">
+<TITLE>Bookmarks</TITLE>
+<H1>Bookmarks</H1>
+<DL><p>
+'''
+NETSCAPE_FOOTER = '</DL><p>\n'
+
+def parse_since(value):
+    # Accepts an ISO 8601 date or datetime; returns it in the created_at format.
+    if value is None:
+        return None
+    since = datetime.datetime.fromisoformat(value)
+    if since.tzinfo is not None:
+        since = since.astimezone().replace(tzinfo=None)
+    return since.isoformat()
+
+def add_date(created_at):
+    try:
+        return int(datetime.datetime.fromisoformat(created_at).timestamp())
+    except (TypeError, ValueError):
+        return None
+
+def write_ndjson(batches, out):
+    for rows in batches:
+        for row in rows:
+            item = {key: row.get(key) for key in COLUMNS}
+            item['tags'] = app.split_tags(item['tags'])
+            out.write(json.dumps(item, ensure_ascii=False) + '\n')
+        out.flush()
+
+def write_csv(batches, out):
+    writer = csv.writer(out, lineterminator='\n')
+    writer.writerow(COLUMNS)
+    for rows in batches:
+        writer.writerows([row.get(key) for key in COLUMNS] for row in rows)
+        out.flush()
+
+def write_netscape(batches, out):
+    out.write(NETSCAPE_HEADER)
+    for rows in batches:
+        for row in rows:
+            attrs = f'HREF="{html.escape(row["url"])}"'
+            timestamp = add_date(row.get('created_at'))
+            if timestamp is not None:
+                attrs += f' ADD_DATE="{timestamp}"'
+            if row.get('tags'):
+                attrs += f' TAGS="{html.escape(row["tags"])}"'
+            title = html.escape(row.get('title') or row['url'], quote=False)
+            out.write(f'    <DT><A {attrs}>{title}</A>\n')
+            if row.get('note'):
+                out.write(f'    <DD>{html.escape(row["note"], quote=False)}\n')
+        out.flush()
+    out.write(NETSCAPE_FOOTER)
+    out.flush()
+
+WRITERS = {'ndjson': write_ndjson, 'csv': write_csv, 'netscape': write_netscape}
+
+def export(out, fmt='ndjson', q=None, tag=None, mode='any', since=None, batch_size=app.EXPORT_BATCH_SIZE):
+    WRITERS[fmt](app.iter_bookmarks(q, tag, mode, since, batch_size), out)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Export bookmarks as NDJSON, CSV or Netscape HTML.')
+    parser.add_argument('--format', choices=FORMATS, default='ndjson', help='output format')
+    parser.add_argument('--q', help='search query, as in action=list')
+    parser.add_argument('--tag', action='append', default=[], help='tag filter (repeatable)')
+    parser.add_argument('--mode', choices=('any', 'all'), default='any', help='match any or all --tag values')
+    parser.add_argument('--since', type=parse_since, help='only bookmarks created at or after this ISO 8601 time')
+    parser.add_argument('--output', '-o', help='file to write (default: stdout)')
+    args = parser.parse_args(argv)
+
+    out = open(args.output, 'w', encoding='utf-8', newline='') if args.output else sys.stdout
+    try:
+        export(out, args.format, args.q, args.tag, args.mode, args.since)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,659 @@
+import atexit
+import codecs
+import http.client
+import ipaddress
+import json
+import os
+import re
+import socket
+import sqlite3
+import ssl
+import threading
+import time
+import urllib.parse
+import zlib
+from collections import OrderedDict
+from html.parser import HTMLParser
+
+import app
+
+# Metadata fetching: URL vetting, DNS and fetch caches, the keep-alive client
+# and incremental HTML parsing. Imported lazily through app.fetch_metadata and
+# app.is_safe_url, so actions that never touch the network skip this stack.
+
+MAX_FETCH_BYTES = 1024 * 1024  # 1MB
+# Pages are read and parsed incrementally and reading stops at </head> or
+# <body>; MAX_FETCH_BYTES only caps how much (decompressed) HTML is examined.
+FETCH_CHUNK_SIZE = 16 * 1024
+CHARSET_SNIFF_BYTES = 1024
+META_CHARSET_RE = re.compile(rb'<meta[^>]+charset\s*=\s*["\']?\s*([a-zA-Z0-9_.:-]+)', re.IGNORECASE)
+
+# Parsed metadata cached per url_norm. Fresh entries skip the network; stale
+# ones are revalidated with If-None-Match / If-Modified-Since.
+FETCH_CACHE_TTL = 24 * 60 * 60
+FETCH_CACHE_NEGATIVE_TTL = 5 * 60
+FETCH_CACHE_MAX_ENTRIES = 10000
+FETCH_TIMEOUT = 10
+# Hit/miss/revalidated counters are kept in memory per database and written to
+# fetch_cache_stats with the next cache write, once CACHE_STATS_FLUSH_EVENTS
+# are pending or CACHE_STATS_FLUSH_SECONDS have passed, and at exit. A cache
+# hit therefore does not write to SQLite on its own.
+CACHE_STATS_FLUSH_EVENTS = 100
+CACHE_STATS_FLUSH_SECONDS = 60
+
+# Resolved addresses are cached in-process (LRU) and in the database so a CGI
+# add resolves a host once: the safety check and the connection share it.
+DNS_CACHE_TTL = 300
+DNS_CACHE_MAX_ENTRIES = 256
+
+MAX_REDIRECTS = 5
+REDIRECT_STATUSES = (301, 302, 303, 307, 308)
+POOL_MAX_IDLE_PER_HOST = 4
+POOL_MAX_IDLE_TOTAL = 32
+POOL_IDLE_TIMEOUT = 30
+POOL_DRAIN_BYTES = 64 * 1024
+
+META_FIELDS = ('status', 'title', 'description', 'image_url', 'site_name', 'http_status', 'error_message')
+
+class MetaParser(HTMLParser):
+    def __init__(self):
+        super().__init__()
+        self.title = None
+        self.og_title = None
+        self.og_description = None
+        self.description = None
+        self.og_image = None
+        self.og_site_name = None
+        self.in_title = False
+        self.done = False
+
+    def handle_starttag(self, tag, attrs):
+        attrs_dict = dict(attrs)
+        if tag == 'body':
+            self.done = True
+        elif tag == 'title':
+            self.in_title = True
+        elif tag == 'meta':
+            name = attrs_dict.get('name', '').lower()
+            property_ = attrs_dict.get('property', '').lower()
+            content = attrs_dict.get('content', '')
+            
+            if property_ == 'og:title':
+                self.og_title = content
+            elif property_ == 'og:description':
+                self.og_description = content
+            elif property_ == 'og:image':
+                self.og_image = content
+            elif property_ == 'og:site_name':
+                self.og_site_name = content
+            elif name == 'description':
+                self.description = content
+
+    def handle_endtag(self, tag):
+        if tag == 'title':
+            self.in_title = False
+        elif tag == 'head':
+            self.done = True
+
+    def handle_data(self, data):
+        if self.in_title and not self.title:
+            text = data.strip()
+            if text:
+                self.title = text
+
+class DnsCache:
+    def __init__(self, ttl=DNS_CACHE_TTL, max_entries=DNS_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, host):
+        with self.lock:
+            entry = self.entries.get(host)
+            if entry is None:
+                return None
+            if entry[0] <= time.time():
+                del self.entries[host]
+                return None
+            self.entries.move_to_end(host)
+            return entry[1]
+
+    def put(self, host, addresses, expires_at=None):
+        with self.lock:
+            self.entries[host] = (expires_at or time.time() + self.ttl, addresses)
+            self.entries.move_to_end(host)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+dns_cache = DnsCache()
+
+def resolve_host(hostname):
+    addresses = dns_cache.get(hostname)
+    if addresses is not None:
+        return addresses
+
+    stored = dns_store_lookup(hostname)
+    if stored is not None:
+        dns_cache.put(hostname, stored[0], stored[1])
+        return stored[0]
+
+    infos = socket.getaddrinfo(hostname, None, proto=socket.IPPROTO_TCP)
+    addresses = []
+    for info in infos:
+        if info[4][0] not in addresses:
+            addresses.append(info[4][0])
+    dns_cache.put(hostname, addresses)
+    dns_store_save(hostname, addresses)
+    return addresses
+
+def dns_store_lookup(hostname):
+    try:
+        conn = app.get_db_connection()
+        try:
+            row = conn.execute(
+                'SELECT addresses, expires_at FROM dns_cache WHERE host = ? AND expires_at > ?',
+                (hostname, time.time())
+            ).fetchone()
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        return None
+    return (json.loads(row[0]), row[1]) if row else None
+
+def dns_store_save(hostname, addresses):
+    try:
+        conn = app.get_db_connection()
+        try:
+            now = time.time()
+            conn.execute('DELETE FROM dns_cache WHERE expires_at <= ?', (now,))
+            conn.execute(
+                'INSERT OR REPLACE INTO dns_cache (host, addresses, expires_at) VALUES (?, ?, ?)',
+                (hostname, json.dumps(addresses), now + DNS_CACHE_TTL)
+            )
+            conn.commit()
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        pass
+
+def is_allowed_address(ip_str):
+    return ipaddress.ip_address(ip_str).is_global
+
+def vetted_addresses(hostname):
+    # Addresses that may be connected to, or None when the host resolves to
+    # anything non-global (all addresses must pass, as before).
+    try:
+        ipaddress.ip_address(hostname)
+        addresses = [hostname]
+    except ValueError:
+        try:
+            addresses = resolve_host(hostname)
+        except (socket.gaierror, UnicodeError):
+            return None
+    if not addresses or not all(is_allowed_address(a) for a in addresses):
+        return None
+    return addresses
+
+def is_safe_url(url):
+    try:
+        parsed = urllib.parse.urlparse(url)
+        hostname = parsed.hostname
+        if not hostname or parsed.scheme not in ('http', 'https'):
+            return False
+        return vetted_addresses(hostname) is not None
+    except Exception:
+        return False
+
+def pinned_create_connection(address, timeout=socket._GLOBAL_DEFAULT_TIMEOUT, source_address=None):
+    # Connects to an address that passed vetted_addresses(), so the checked IP
+    # is the connected IP (no second lookup, no DNS rebinding window).
+    host, port = address
+    addresses = vetted_addresses(host)
+    if addresses is None:
+        raise OSError(f"Unsafe address for host {host}")
+    last_error = None
+    for ip in addresses:
+        try:
+            return socket.create_connection((ip, port), timeout, source_address)
+        except OSError as e:
+            last_error = e
+    raise last_error
+
+class PinnedHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._create_connection = pinned_create_connection
+
+class PinnedHTTPSConnection(http.client.HTTPSConnection):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._create_connection = pinned_create_connection
+
+class FetchError(Exception):
+    pass
+
+class PooledResponse:
+    def __init__(self, client, key, conn, response, url):
+        self.client = client
+        self.key = key
+        self.conn = conn
+        self.response = response
+        self.url = url
+        self.status = response.status
+        self.headers = response.headers
+
+    def read(self, amt=None):
+        return self.response.read(amt)
+
+    def close(self):
+        if self.conn is None:
+            return
+        response = self.response
+        reusable = not response.will_close
+        if reusable and not response.isclosed():
+            # Left over after an early stop: drain a short tail to keep the
+            # connection, otherwise drop it rather than download the page.
+            if response.length is not None and response.length <= POOL_DRAIN_BYTES:
+                try:
+                    response.read()
+                except (OSError, http.client.HTTPException):
+                    reusable = False
+            else:
+                reusable = False
+        response.close()
+        if reusable:
+            self.client.release(self.key, self.conn)
+        else:
+            self.conn.close()
+        self.conn = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class FetchClient:
+    # Keep-alive metadata client: reuses pinned http.client connections per
+    # (scheme, host, port) from a bounded idle pool, follows redirects itself
+    # and re-checks is_safe_url on every hop. Safe to share between threads.
+    def __init__(self, timeout=FETCH_TIMEOUT, max_idle_per_host=POOL_MAX_IDLE_PER_HOST,
+                 max_idle_total=POOL_MAX_IDLE_TOTAL, idle_timeout=POOL_IDLE_TIMEOUT,
+                 max_redirects=MAX_REDIRECTS, context=None):
+        self.timeout = timeout
+        self.max_idle_per_host = max_idle_per_host
+        self.max_idle_total = max_idle_total
+        self.idle_timeout = idle_timeout
+        self.max_redirects = max_redirects
+        self.context = context or ssl.create_default_context()
+        self.idle = {}
+        self.idle_count = 0
+        self.lock = threading.Lock()
+
+    def request(self, url, headers=None):
+        for _ in range(self.max_redirects + 1):
+            if not is_safe_url(url):
+                raise FetchError('Unsafe URL or invalid hostname')
+            response = self.send(url, headers or {})
+            location = response.headers.get('Location')
+            if response.status in REDIRECT_STATUSES and location:
+                response.close()
+                url = urllib.parse.urljoin(url, location)
+                continue
+            return response
+        raise FetchError('Too many redirects')
+
+    def send(self, url, headers):
+        parts = urllib.parse.urlsplit(url)
+        default_port = 443 if parts.scheme == 'https' else 80
+        key = (parts.scheme, parts.hostname, parts.port or default_port)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+
+        conn, reused = self.acquire(key)
+        try:
+            conn.request('GET', path, headers=headers)
+            response = conn.getresponse()
+        except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+            conn.close()
+            if not reused:
+                raise
+            # The server closed an idle keep-alive connection; retry once fresh.
+            conn = self.connect(key)
+            try:
+                conn.request('GET', path, headers=headers)
+                response = conn.getresponse()
+            except Exception:
+                conn.close()
+                raise
+        except Exception:
+            conn.close()
+            raise
+        return PooledResponse(self, key, conn, response, url)
+
+    def connect(self, key):
+        scheme, host, port = key
+        if scheme == 'https':
+            return PinnedHTTPSConnection(host, port, timeout=self.timeout, context=self.context)
+        return PinnedHTTPConnection(host, port, timeout=self.timeout)
+
+    def acquire(self, key):
+        now = time.time()
+        with self.lock:
+            idle = self.idle.get(key, [])
+            while idle:
+                conn, since = idle.pop()
+                self.idle_count -= 1
+                if now - since < self.idle_timeout:
+                    return conn, True
+                conn.close()
+        return self.connect(key), False
+
+    def release(self, key, conn):
+        with self.lock:
+            idle = self.idle.setdefault(key, [])
+            if len(idle) < self.max_idle_per_host and self.idle_count < self.max_idle_total:
+                idle.append((conn, time.time()))
+                self.idle_count += 1
+                return
+        conn.close()
+
+    def close(self):
+        with self.lock:
+            for idle in self.idle.values():
+                for conn, _ in idle:
+                    conn.close()
+            self.idle = {}
+            self.idle_count = 0
+
+_fetch_client = None
+
+def get_fetch_client():
+    global _fetch_client
+    if _fetch_client is None:
+        _fetch_client = FetchClient()
+    return _fetch_client
+
+def fetch_metadata(url, negative_cache=True):
+    # The cache lookup, the hit/miss counter and the cache write share one
+    # connection, and the writes go out in a single commit.
+    conn = cache_connect()
+    try:
+        return fetch_cached(conn, url, negative_cache)
+    finally:
+        if conn is not None:
+            conn.close()
+
+def fetch_cached(conn, url, negative_cache):
+    cached = cache_lookup(conn, url)
+    if cached and cache_is_fresh(cached, negative_cache):
+        count_cache_event('hits')
+        if write_cache_events(conn):
+            cache_commit(conn)
+        return cache_meta(cached)
+
+    if not is_safe_url(url):
+        return {'status': 'fetch_error', 'error_message': 'Unsafe URL or invalid hostname', 'permanent': True}
+
+    if os.environ.get('BOOKMARK_FETCH_STUB') == '1':
+        return {
+            'status': 'ok',
+            'title': 'Stub Title',
+            'description': 'Stub Description',
+            'image_url': 'https://example.com/stub.png',
+            'site_name': 'Stub Site',
+            'http_status': 200
+        }
+
+    validators = cached if cached and cached['status'] == 'ok' else None
+    result = fetch_remote(url, validators)
+    if result.get('not_modified'):
+        cache_touch(conn, url, result)
+        count_cache_event('revalidated')
+        write_cache_events(conn, force=True)
+        cache_commit(conn)
+        return cache_meta(cached)
+
+    cache_store(conn, url, result)
+    count_cache_event('misses')
+    write_cache_events(conn, force=True)
+    cache_commit(conn)
+    meta = {k: result.get(k) for k in META_FIELDS}
+    if result.get('permanent'):
+        meta['permanent'] = True
+    return meta
+
+def fetch_remote(url, validators=None):
+    headers = {
+        'User-Agent': 'Mozilla/5.0 (compatible; BookmarkBot/1.0)',
+        'Accept-Encoding': 'gzip, deflate',
+    }
+    if validators:
+        if validators['etag']:
+            headers['If-None-Match'] = validators['etag']
+        if validators['last_modified']:
+            headers['If-Modified-Since'] = validators['last_modified']
+
+    try:
+        with get_fetch_client().request(url, headers) as response:
+            if response.status == 304:
+                return {'not_modified': True, 'etag': response.headers.get('ETag'),
+                        'last_modified': response.headers.get('Last-Modified')}
+            if not 200 <= response.status < 300:
+                return {'status': 'fetch_error', 'http_status': response.status,
+                        'error_message': f"HTTP Error {response.status}"}
+
+            try:
+                parser = read_metadata(response)
+            except (zlib.error, ValueError) as e:
+                return {'status': 'fetch_error', 'http_status': response.status, 'error_message': str(e)}
+            except Exception:
+                return {'status': 'parse_error', 'http_status': response.status, 'error_message': 'Parse error'}
+
+            title = parser.og_title or parser.title
+            description = parser.og_description or parser.description
+            image_url = parser.og_image
+            site_name = parser.og_site_name
+
+            return {
+                'status': 'ok',
+                'title': title,
+                'description': description,
+                'image_url': image_url,
+                'site_name': site_name,
+                'http_status': response.status,
+                'etag': response.headers.get('ETag'),
+                'last_modified': response.headers.get('Last-Modified'),
+            }
+    except FetchError as e:
+        # Unsafe redirects and redirect loops do not get better with retries.
+        return {'status': 'fetch_error', 'error_message': str(e), 'permanent': True}
+    except Exception as e:
+        return {'status': 'fetch_error', 'error_message': str(e)}
+
+def make_decompressor(content_encoding):
+    encoding = (content_encoding or '').strip().lower()
+    if encoding in ('', 'identity'):
+        return None
+    if encoding in ('gzip', 'x-gzip', 'deflate'):
+        # wbits | 32 accepts both gzip and zlib framing.
+        return zlib.decompressobj(zlib.MAX_WBITS | 32)
+    raise ValueError(f"Unsupported Content-Encoding: {encoding}")
+
+def lookup_charset(name):
+    if not name:
+        return None
+    try:
+        return codecs.lookup(name.strip()).name
+    except LookupError:
+        return None
+
+def sniff_meta_charset(head):
+    match = META_CHARSET_RE.search(head)
+    return match.group(1).decode('ascii', errors='ignore') if match else None
+
+def read_metadata(response, limit=MAX_FETCH_BYTES):
+    # Feeds MetaParser chunk by chunk and stops once the <head> is over, so
+    # large pages cost only their head. Charset comes from Content-Type, then
+    # <meta charset> in the first bytes, then UTF-8.
+    decompressor = make_decompressor(response.headers.get('Content-Encoding'))
+    charset = lookup_charset(response.headers.get_content_charset())
+    parser = MetaParser()
+    decoder = None
+    pending = b''
+    received = 0
+    while not parser.done and received < limit:
+        chunk = response.read(FETCH_CHUNK_SIZE)
+        eof = not chunk
+        if decompressor is not None and chunk:
+            chunk = decompressor.decompress(chunk, limit - received)
+        received += len(chunk)
+        if decoder is None:
+            pending += chunk
+            if len(pending) < CHARSET_SNIFF_BYTES and not eof and received < limit:
+                continue
+            charset = charset or lookup_charset(sniff_meta_charset(pending)) or 'utf-8'
+            decoder = codecs.getincrementaldecoder(charset)(errors='replace')
+            chunk, pending = pending, b''
+        parser.feed(decoder.decode(chunk, final=eof))
+        if eof:
+            break
+    return parser
+
+def cache_is_fresh(entry, negative_cache=True):
+    age = time.time() - entry['fetched_at']
+    if entry['status'] == 'ok':
+        return age < FETCH_CACHE_TTL
+    return negative_cache and age < FETCH_CACHE_NEGATIVE_TTL
+
+def cache_meta(entry):
+    return {k: entry[k] for k in META_FIELDS}
+
+# The cache is best effort: a missing table or a locked database must never
+# fail the fetch itself. Without a connection every helper is a no-op.
+def cache_connect():
+    try:
+        return app.get_db_connection()
+    except sqlite3.Error:
+        return None
+
+def cache_commit(conn):
+    if conn is None:
+        return
+    try:
+        conn.commit()
+    except sqlite3.Error:
+        pass
+
+def cache_lookup(conn, url_norm):
+    if conn is None:
+        return None
+    try:
+        row = conn.execute('SELECT * FROM fetch_cache WHERE url_norm = ?', (url_norm,)).fetchone()
+    except sqlite3.Error:
+        return None
+    return dict(row) if row else None
+
+def cache_store(conn, url_norm, result):
+    if conn is None:
+        return
+    try:
+        c = conn.cursor()
+        c.execute('''
+            INSERT OR REPLACE INTO fetch_cache
+                (url_norm, status, title, description, image_url, site_name, http_status, error_message, etag, last_modified, fetched_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (
+            url_norm, result.get('status'), result.get('title'), result.get('description'),
+            result.get('image_url'), result.get('site_name'), result.get('http_status'),
+            result.get('error_message'), result.get('etag'), result.get('last_modified'), time.time()
+        ))
+        c.execute('SELECT COUNT(*) FROM fetch_cache')
+        excess = c.fetchone()[0] - FETCH_CACHE_MAX_ENTRIES
+        if excess > 0:
+            # Evict the oldest tenth at once so eviction does not run on every store.
+            c.execute('''
+                DELETE FROM fetch_cache WHERE url_norm IN (
+                    SELECT url_norm FROM fetch_cache ORDER BY fetched_at LIMIT ?
+                )
+            ''', (excess + FETCH_CACHE_MAX_ENTRIES // 10,))
+    except sqlite3.Error:
+        pass
+
+def cache_touch(conn, url_norm, result):
+    if conn is None:
+        return
+    try:
+        conn.execute('''
+            UPDATE fetch_cache SET fetched_at = ?, etag = COALESCE(?, etag), last_modified = COALESCE(?, last_modified)
+            WHERE url_norm = ?
+        ''', (time.time(), result.get('etag'), result.get('last_modified'), url_norm))
+    except sqlite3.Error:
+        pass
+
+# db path -> {event name: count} not yet written to fetch_cache_stats
+_cache_events = {}
+_cache_events_lock = threading.Lock()
+_cache_events_flushed_at = time.monotonic()
+
+def count_cache_event(name):
+    path = app.get_db_path()
+    with _cache_events_lock:
+        events = _cache_events.setdefault(path, {})
+        events[name] = events.get(name, 0) + 1
+
+def pending_cache_events():
+    with _cache_events_lock:
+        return dict(_cache_events.get(app.get_db_path(), {}))
+
+def take_cache_events(path, force=False):
+    global _cache_events_flushed_at
+    with _cache_events_lock:
+        pending = sum(_cache_events.get(path, {}).values())
+        if not pending:
+            return {}
+        if (not force and pending < CACHE_STATS_FLUSH_EVENTS
+                and time.monotonic() - _cache_events_flushed_at < CACHE_STATS_FLUSH_SECONDS):
+            return {}
+        _cache_events_flushed_at = time.monotonic()
+        return _cache_events.pop(path)
+
+def write_cache_events(conn, force=False, path=None):
+    # Adds the pending counters for conn's database when due (always with
+    # force); the caller commits. Returns True if anything was written.
+    if conn is None:
+        return False
+    path = path or app.get_db_path()
+    events = take_cache_events(path, force)
+    if not events:
+        return False
+    try:
+        conn.executemany('''
+            INSERT INTO fetch_cache_stats (name, value) VALUES (?, ?)
+            ON CONFLICT(name) DO UPDATE SET value = value + excluded.value
+        ''', list(events.items()))
+    except sqlite3.Error:
+        return False
+    return True
+
+def flush_cache_events():
+    with _cache_events_lock:
+        paths = list(_cache_events)
+    for path in paths:
+        try:
+            conn = app.get_db_connection(path)
+        except sqlite3.Error:
+            continue
+        try:
+            if write_cache_events(conn, force=True, path=path):
+                cache_commit(conn)
+        finally:
+            conn.close()
+
+atexit.register(flush_cache_events)
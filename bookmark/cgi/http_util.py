@@ -0,0 +1,44 @@
+import os
+
+# Conditional requests and response compression for api.cgi. Same rules as
+# the api/ endpoints' _lib.py (weak If-None-Match, Accept-Encoding q-values),
+# kept here so bookmark/ deploys on its own.
+
+GZIP_MIN_BYTES = 1024  # smaller bodies are not worth the CPU
+
+def etag_matches(etag):
+    # Weak comparison, as If-None-Match requires.
+    header = os.environ.get('HTTP_IF_NONE_MATCH', '').strip()
+    if not header or not etag:
+        return False
+    if header == '*':
+        return True
+    wanted = etag[2:] if etag.startswith('W/') else etag
+    for candidate in header.split(','):
+        candidate = candidate.strip()
+        if candidate.startswith('W/'):
+            candidate = candidate[2:]
+        if candidate == wanted:
+            return True
+    return False
+
+def accepts_gzip():
+    for item in os.environ.get('HTTP_ACCEPT_ENCODING', '').split(','):
+        coding, _, params = item.partition(';')
+        if coding.strip().lower() not in ('gzip', 'x-gzip'):
+            continue
+        q = params.replace(' ', '').lower()
+        if q.startswith('q='):
+            try:
+                return float(q[2:]) > 0
+            except ValueError:
+                return False
+        return True
+    return False
+
+def gzip_bytes(data):
+    import zlib
+
+    # wbits=31 writes the gzip container instead of a raw zlib stream.
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    return compressor.compress(data) + compressor.flush()
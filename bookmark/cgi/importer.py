@@ -0,0 +1,335 @@
+#!/usr/local/bin/python3
+import argparse
+import codecs
+import datetime
+import json
+import os
+import sys
+import urllib.parse
+from html.parser import HTMLParser
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+import app
+import worker
+
+# Bulk import of browser bookmark exports (Netscape HTML) and NDJSON/JSON lists.
+#   API: POST ?action=import[&format=netscape|ndjson|json][&fetch=defer|now|none]
+#   CLI: python3 importer.py bookmarks.html --fetch now --workers 16
+
+FORMATS = ('netscape', 'ndjson', 'json')
+FETCH_MODES = ('defer', 'now', 'none')
+CHUNK_SIZE = 64 * 1024
+DEFAULT_BATCH_SIZE = 500
+MAX_URL_LENGTH = 2048
+MAX_TAGS = 20
+MAX_TAG_LENGTH = 50
+MAX_NOTE_LENGTH = 500
+MAX_TITLE_LENGTH = 500
+
+class NetscapeParser(HTMLParser):
+    def __init__(self):
+        super().__init__()
+        self.items = []
+        self.current = None
+        self.in_dd = False
+
+    def handle_starttag(self, tag, attrs):
+        attrs_dict = dict(attrs)
+        if tag == 'a':
+            self.current = {
+                'url': attrs_dict.get('href'),
+                'tags': attrs_dict.get('tags'),
+                'add_date': attrs_dict.get('add_date'),
+                'title': '',
+            }
+            self.items.append(self.current)
+            self.in_dd = False
+        elif tag == 'dd':
+            self.in_dd = bool(self.items)
+        elif tag in ('dt', 'dl', 'h3'):
+            self.in_dd = False
+
+    def handle_endtag(self, tag):
+        if tag == 'a':
+            self.current = None
+
+    def handle_data(self, data):
+        if self.current is not None:
+            self.current['title'] += data
+        elif self.in_dd:
+            self.items[-1]['note'] = self.items[-1].get('note', '') + data
+
+    def drain(self, final=False):
+        # The newest item may still receive its <DD> text in the next chunk.
+        keep = 0 if final else 1
+        ready = self.items[:len(self.items) - keep] if len(self.items) > keep else []
+        self.items = self.items[len(ready):]
+        return ready
+
+def iter_chunks(stream, limit, chunk_size=CHUNK_SIZE):
+    remaining = limit
+    while remaining is None or remaining > 0:
+        size = chunk_size if remaining is None else min(chunk_size, remaining)
+        chunk = stream.read(size)
+        if not chunk:
+            break
+        if remaining is not None:
+            remaining -= len(chunk)
+        yield chunk
+
+def iter_text(chunks):
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    first = True
+    for chunk in chunks:
+        text = decoder.decode(chunk)
+        if first and text:
+            text = text.lstrip('\ufeff')
+            first = False
+        if text:
+            yield text
+    tail = decoder.decode(b'', final=True)
+    if tail:
+        yield tail
+
+def detect_format(text):
+    head = text.lstrip()[:1]
+    if head == '[':
+        return 'json'
+    if head == '<':
+        return 'netscape'
+    return 'ndjson'
+
+def iter_netscape(texts):
+    parser = NetscapeParser()
+    for text in texts:
+        parser.feed(text)
+        yield from parser.drain()
+    parser.close()
+    yield from parser.drain(final=True)
+
+def iter_ndjson(texts):
+    buf = ''
+    for text in texts:
+        buf += text
+        lines = buf.split('\n')
+        buf = lines.pop()
+        for line in lines:
+            yield parse_json_line(line)
+    if buf.strip():
+        yield parse_json_line(buf)
+
+def parse_json_line(line):
+    line = line.strip()
+    if not line:
+        return None
+    try:
+        return json.loads(line)
+    except json.JSONDecodeError:
+        return {'error': 'Invalid JSON line'}
+
+def iter_json_array(texts):
+    decoder = json.JSONDecoder()
+    buf = ''
+    started = False
+    for text in texts:
+        buf += text
+        pos = 0
+        while True:
+            while pos < len(buf) and buf[pos] in ' \t\r\n,':
+                pos += 1
+            if pos >= len(buf):
+                break
+            if not started:
+                if buf[pos] != '[':
+                    raise ValueError("expected a JSON array")
+                started = True
+                pos += 1
+                continue
+            if buf[pos] == ']':
+                return
+            try:
+                obj, pos = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                # Item split across chunks: wait for more text.
+                break
+            yield obj
+        buf = buf[pos:]
+    raise ValueError("unterminated JSON array")
+
+def iter_entries(chunks, fmt=None):
+    texts = iter_text(chunks)
+    first = ''
+    for text in texts:
+        first += text
+        if first.strip():
+            break
+    fmt = fmt or detect_format(first)
+
+    def replay():
+        if first:
+            yield first
+        yield from texts
+
+    if fmt == 'netscape':
+        return iter_netscape(replay())
+    if fmt == 'json':
+        return iter_json_array(replay())
+    return iter_ndjson(replay())
+
+def clean_entry(raw):
+    if isinstance(raw, str):
+        raw = {'url': raw}
+    if not isinstance(raw, dict):
+        raise ValueError("entry must be an object or URL string")
+    if raw.get('error'):
+        raise ValueError(raw['error'])
+
+    url = raw.get('url')
+    if not isinstance(url, str) or not url.strip():
+        raise ValueError("url is required")
+    url = url.strip()
+    if len(url) > MAX_URL_LENGTH:
+        raise ValueError("url is too long")
+    parsed = urllib.parse.urlparse(url)
+    if parsed.scheme not in ('http', 'https') or not parsed.hostname:
+        raise ValueError("url must be http(s) with a hostname")
+    # Same check as action=add: no loopback, private or unresolvable hosts.
+    if not app.is_safe_url(url):
+        raise ValueError("url is not allowed")
+
+    tags = raw.get('tags')
+    if isinstance(tags, str):
+        tags = tags.split(',')
+    if tags is not None and not isinstance(tags, list):
+        raise ValueError("tags must be string or list")
+    tags = [t for t in (tags or []) if isinstance(t, str) and t.strip() and len(t.strip()) <= MAX_TAG_LENGTH]
+
+    note = raw.get('note')
+    note = note.strip()[:MAX_NOTE_LENGTH] if isinstance(note, str) and note.strip() else None
+    title = raw.get('title')
+    title = title.strip()[:MAX_TITLE_LENGTH] if isinstance(title, str) and title.strip() else None
+
+    created_at = None
+    add_date = raw.get('add_date')
+    if add_date:
+        try:
+            created_at = datetime.datetime.fromtimestamp(int(add_date)).isoformat()
+        except (ValueError, OverflowError, OSError):
+            created_at = None
+
+    return {
+        'url': url,
+        'url_norm': app.normalize_url(url),
+        'tags': app.normalize_tags(tags[:MAX_TAGS]),
+        'note': note,
+        'title': title,
+        'created_at': created_at,
+    }
+
+def import_entries(raw_entries, fetch='defer', batch_size=DEFAULT_BATCH_SIZE, workers=None, per_host=None):
+    # Yields one result dict per input entry, in input order, a batch at a time.
+    workers = workers or worker.DEFAULT_WORKERS
+    per_host = per_host or worker.DEFAULT_PER_HOST
+    seen = set()
+    batch = []
+
+    def flush():
+        entries = [e for _, e, _ in batch if e is not None]
+        if fetch == 'now' and entries:
+            # Only URLs that are not stored yet are worth a fetch.
+            stored = app.get_existing_url_norms(e['url_norm'] for e in entries)
+            items = [{'url': e['url_norm'], 'host': urllib.parse.urlparse(e['url_norm']).hostname, 'entry': e}
+                     for e in entries if e['url_norm'] not in stored]
+            for item, meta in worker.fetch_many(items, workers, per_host):
+                entry = item['entry']
+                for key in ('image_url', 'site_name', 'status', 'http_status', 'error_message'):
+                    entry[key] = meta.get(key)
+                # Keep the title from the export when the page has none.
+                for key in ('title', 'description'):
+                    if meta.get(key):
+                        entry[key] = meta[key]
+        ids, existing = app.add_bookmarks(entries, defer=(fetch == 'defer')) if entries else ({}, set())
+        for index, e, result in batch:
+            if result is not None:
+                yield result
+            elif e['url_norm'] in existing:
+                yield {'index': index, 'url': e['url'], 'result': 'duplicate'}
+            else:
+                result = {'index': index, 'url': e['url'], 'result': 'added', 'id': ids[e['url_norm']]}
+                if fetch == 'now':
+                    result['status'] = e.get('status')
+                yield result
+        batch.clear()
+
+    index = 0
+    inserts = 0
+    try:
+        for raw in raw_entries:
+            if raw is None:
+                continue
+            try:
+                entry = clean_entry(raw)
+            except ValueError as e:
+                batch.append((index, None, {'index': index, 'result': 'invalid', 'error': str(e)}))
+            else:
+                if entry['url_norm'] in seen:
+                    batch.append((index, None, {'index': index, 'url': entry['url'], 'result': 'duplicate'}))
+                else:
+                    seen.add(entry['url_norm'])
+                    batch.append((index, entry, None))
+                    inserts += 1
+            index += 1
+            if inserts >= batch_size:
+                yield from flush()
+                inserts = 0
+    except ValueError:
+        # Malformed file: everything parsed before the bad part is imported,
+        # like the batches already committed, then the error is passed on.
+        if batch:
+            yield from flush()
+        raise
+    if batch:
+        yield from flush()
+
+def summarize(results, on_result=None):
+    # Counts what was imported. Batches are committed as they go, so a
+    # malformed file still returns the counts so far, with 'error' set.
+    summary = {'total': 0, 'added': 0, 'duplicate': 0, 'invalid': 0}
+    try:
+        for result in results:
+            summary['total'] += 1
+            summary[result['result']] += 1
+            if on_result:
+                on_result(result)
+    except ValueError as e:
+        summary['error'] = str(e)
+    return summary
+
+def print_result(result):
+    print(json.dumps(result, ensure_ascii=False))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Import bookmarks from a Netscape HTML, NDJSON or JSON file.')
+    parser.add_argument('path', help="file to import ('-' for stdin)")
+    parser.add_argument('--format', choices=FORMATS, help='input format (detected from content by default)')
+    parser.add_argument('--fetch', choices=FETCH_MODES, default='defer',
+                        help='defer: queue for worker.py, now: fetch concurrently during import, none: keep file titles only')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help='rows per insert transaction')
+    parser.add_argument('--workers', type=worker.positive_int, help='fetch thread pool size with --fetch now')
+    parser.add_argument('--per-host', type=worker.positive_int, help='concurrent fetches per host with --fetch now')
+    parser.add_argument('--results', action='store_true', help='print one NDJSON result line per entry')
+    args = parser.parse_args(argv)
+
+    stream = sys.stdin.buffer if args.path == '-' else open(args.path, 'rb')
+    try:
+        entries = iter_entries(iter_chunks(stream, None), args.format)
+        results = import_entries(entries, args.fetch, args.batch_size, args.workers, args.per_host)
+        summary = summarize(results, print_result if args.results else None)
+    finally:
+        if stream is not sys.stdin.buffer:
+            stream.close()
+    print(json.dumps(summary), file=sys.stderr if args.results else sys.stdout)
+    return 1 if 'error' in summary else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,225 @@
+#!/usr/local/bin/python3
+import argparse
+import datetime
+import json
+import os
+import sys
+import time
+import urllib.parse
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+import app
+import worker
+
+# Refreshes metadata of stale bookmarks (status ok, fetched long ago) and
+# retries failed ones (fetch_error / parse_error), oldest fetched_at first.
+#   cron:    0 4 * * * /usr/local/bin/python3 /path/to/bookmark/cgi/recrawl.py
+#   preview: python3 recrawl.py --dry-run --stale-days 7
+# Progress is checkpointed with every batch; an interrupted run (or one cut
+# short by --limit) resumes where it stopped unless --restart is given.
+
+RECRAWL_STATUSES = ('ok', 'fetch_error', 'parse_error')
+DEFAULT_STALE_DAYS = 30
+DEFAULT_RETRY_HOURS = 24
+DEFAULT_BATCH_SIZE = 200
+DEFAULT_HOST_INTERVAL = 1.0
+DEFAULT_CHECKPOINT = 'default'
+# Failed refreshes in a row before an ok bookmark is marked failed; until
+# then it stays ok and is retried on the --retry-hours schedule.
+MAX_REFRESH_FAILURES = 3
+
+def new_state(stale_days=DEFAULT_STALE_DAYS, retry_hours=DEFAULT_RETRY_HOURS, statuses=RECRAWL_STATUSES, now=None):
+    # Cutoffs are fixed when a run starts so a resumed run selects the same
+    # rows; refreshed rows move past them and are never selected twice.
+    now = time.time() if now is None else now
+    return {
+        'stale_before': now - stale_days * 24 * 60 * 60,
+        'failed_before': now - retry_hours * 60 * 60,
+        'statuses': list(statuses),
+        'after': [-1, 0],
+        'started_at': datetime.datetime.fromtimestamp(now).isoformat(),
+    }
+
+def select_batch(c, state, limit):
+    # Keyset walk of idx_bookmarks_fetched_at on (fetched_at, id).
+    clauses = []
+    params = []
+    bounds = []
+    if 'ok' in state['statuses']:
+        clauses.append("(status = 'ok' AND fetched_at < CASE WHEN fetch_failures > 0 THEN ? ELSE ? END)")
+        params.extend([state['failed_before'], state['stale_before']])
+        bounds.extend([state['failed_before'], state['stale_before']])
+    failed = [s for s in state['statuses'] if s != 'ok']
+    if failed:
+        placeholders = ', '.join(['?'] * len(failed))
+        clauses.append(f"(status IN ({placeholders}) AND fetched_at < ?)")
+        params.extend(failed)
+        params.append(state['failed_before'])
+        bounds.append(state['failed_before'])
+    if not clauses:
+        return []
+    c.execute(f'''
+        SELECT id, url_norm, status, fetch_failures, fetched_at FROM bookmarks
+        WHERE fetched_at < ? AND (fetched_at, id) > (?, ?) AND ({' OR '.join(clauses)})
+        ORDER BY fetched_at, id LIMIT ?
+    ''', [max(bounds), *state['after'], *params, limit])
+    return [dict(row) for row in c.fetchall()]
+
+def load_checkpoint(c, name):
+    c.execute('SELECT state FROM recrawl_checkpoints WHERE name = ?', (name,))
+    row = c.fetchone()
+    return json.loads(row[0]) if row else None
+
+def save_checkpoint(c, name, state):
+    c.execute('''
+        INSERT INTO recrawl_checkpoints (name, state, updated_at) VALUES (?, ?, ?)
+        ON CONFLICT(name) DO UPDATE SET state = excluded.state, updated_at = excluded.updated_at
+    ''', (name, json.dumps(state), datetime.datetime.now().isoformat()))
+
+def clear_checkpoint(c, name):
+    c.execute('DELETE FROM recrawl_checkpoints WHERE name = ?', (name,))
+
+def write_results(c, results):
+    for item, meta in results:
+        if meta.get('status') == 'ok':
+            app.update_bookmark_metadata(c, item['id'], meta)
+        elif item['status'] == 'ok' and item['fetch_failures'] + 1 < MAX_REFRESH_FAILURES:
+            # One failed refresh of a working bookmark: record it, stay ok.
+            c.execute('''
+                UPDATE bookmarks SET error_message = ?, fetched_at = ?, fetch_failures = fetch_failures + 1
+                WHERE id = ?
+            ''', (meta.get('error_message'), time.time(), item['id']))
+        else:
+            # A failed refresh records the error but keeps the metadata we had.
+            c.execute('''
+                UPDATE bookmarks SET status = ?, http_status = ?, error_message = ?, fetched_at = ?,
+                    fetch_failures = fetch_failures + 1
+                WHERE id = ?
+            ''', (meta.get('status') or 'fetch_error', meta.get('http_status'), meta.get('error_message'),
+                  time.time(), item['id']))
+
+def timed(fetch):
+    def run(url, **options):
+        start = time.perf_counter()
+        meta = fetch(url, **options)
+        return dict(meta, elapsed=time.perf_counter() - start)
+    return run
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    return sorted_values[round(fraction * (len(sorted_values) - 1))]
+
+def summarize(selected, results, elapsed, cache_before=None, cache_after=None):
+    summary = {'selected': len(selected), 'by_status': {}, 'hosts': len({row['host'] for row in selected})}
+    for row in selected:
+        summary['by_status'][row['status']] = summary['by_status'].get(row['status'], 0) + 1
+    if results is None:
+        return summary
+
+    outcomes = {'ok': 0, 'recovered': 0, 'failed': 0}
+    latencies = []
+    for item, meta in results:
+        if meta.get('status') == 'ok':
+            outcomes['ok'] += 1
+            if item['status'] != 'ok':
+                outcomes['recovered'] += 1
+        else:
+            outcomes['failed'] += 1
+        if meta.get('elapsed') is not None:
+            latencies.append(meta['elapsed'])
+    latencies.sort()
+    summary.update(outcomes)
+    summary['elapsed_seconds'] = round(elapsed, 3)
+    summary['rows_per_second'] = round(len(results) / elapsed, 2) if elapsed > 0 else None
+    summary['latency_ms'] = {
+        name: round(value * 1000, 1) if value is not None else None
+        for name, value in (('p50', percentile(latencies, 0.5)), ('p95', percentile(latencies, 0.95)),
+                            ('max', latencies[-1] if latencies else None))
+    }
+    if cache_before is not None and cache_after is not None:
+        summary['cache'] = {k: cache_after.get(k, 0) - cache_before.get(k, 0) for k in ('hits', 'misses', 'revalidated')}
+    return summary
+
+def recrawl(stale_days=DEFAULT_STALE_DAYS, retry_hours=DEFAULT_RETRY_HOURS, statuses=RECRAWL_STATUSES,
+            batch_size=DEFAULT_BATCH_SIZE, workers=worker.DEFAULT_WORKERS, per_host=worker.DEFAULT_PER_HOST,
+            host_interval=DEFAULT_HOST_INTERVAL, limit=None, dry_run=False, checkpoint=DEFAULT_CHECKPOINT,
+            restart=False, fetch=None):
+    fetch = timed(fetch or app.fetch_metadata)
+    conn = app.get_db_connection()
+    c = conn.cursor()
+    state = None if restart or dry_run else load_checkpoint(c, checkpoint)
+    resumed = state is not None
+    if state is None:
+        state = new_state(stale_days, retry_hours, statuses)
+    cache_before = app.get_cache_stats(c)
+
+    start = time.perf_counter()
+    selected = []
+    results = []
+    finished = False
+    while True:
+        size = batch_size if limit is None else min(batch_size, limit - len(selected))
+        rows = select_batch(c, state, size) if size > 0 else []
+        if not rows:
+            finished = size > 0
+            break
+        state['after'] = [rows[-1]['fetched_at'], rows[-1]['id']]
+        for row in rows:
+            row['host'] = urllib.parse.urlparse(row['url_norm']).hostname or ''
+        selected.extend(rows)
+        if dry_run:
+            continue
+
+        # A recrawl must reach the network, not a cached failure.
+        items = [dict(row, url=row['url_norm'], options={'negative_cache': False}) for row in rows]
+        batch = list(worker.fetch_many(items, workers, per_host, fetch, host_interval))
+        write_results(c, batch)
+        save_checkpoint(c, checkpoint, state)
+        conn.commit()
+        results.extend(batch)
+
+    if finished and not dry_run:
+        clear_checkpoint(c, checkpoint)
+        conn.commit()
+    summary = summarize(selected, None if dry_run else results, time.perf_counter() - start,
+                        cache_before, None if dry_run else app.get_cache_stats(c))
+    conn.close()
+    summary.update({'dry_run': dry_run, 'resumed': resumed, 'finished': finished, 'started_at': state['started_at']})
+    return summary
+
+def parse_statuses(value):
+    statuses = [s.strip() for s in value.split(',') if s.strip()]
+    unknown = [s for s in statuses if s not in RECRAWL_STATUSES]
+    if unknown or not statuses:
+        raise argparse.ArgumentTypeError(f"choose from {', '.join(RECRAWL_STATUSES)}")
+    return statuses
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Refresh metadata of stale bookmarks and retry failed fetches.')
+    parser.add_argument('--stale-days', type=float, default=DEFAULT_STALE_DAYS,
+                        help='refresh ok bookmarks fetched more than this many days ago')
+    parser.add_argument('--retry-hours', type=float, default=DEFAULT_RETRY_HOURS,
+                        help='retry failed bookmarks last tried more than this many hours ago')
+    parser.add_argument('--status', type=parse_statuses, default=list(RECRAWL_STATUSES),
+                        help='comma-separated statuses to consider (default: ok,fetch_error,parse_error)')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help='rows selected and written per transaction')
+    parser.add_argument('--workers', type=worker.positive_int, default=worker.DEFAULT_WORKERS, help='size of the fetch thread pool')
+    parser.add_argument('--per-host', type=worker.positive_int, default=worker.DEFAULT_PER_HOST, help='concurrent fetches allowed per host')
+    parser.add_argument('--host-interval', type=float, default=DEFAULT_HOST_INTERVAL,
+                        help='minimum seconds between fetch starts to the same host')
+    parser.add_argument('--limit', type=int, help='stop after this many rows (the checkpoint keeps the rest for the next run)')
+    parser.add_argument('--checkpoint', default=DEFAULT_CHECKPOINT, help='checkpoint name, for independent runs')
+    parser.add_argument('--restart', action='store_true', help='discard a saved checkpoint and start a new run')
+    parser.add_argument('--dry-run', action='store_true', help='only report what would be recrawled')
+    args = parser.parse_args(argv)
+
+    app.init_db()
+    summary = recrawl(args.stale_days, args.retry_hours, args.status, args.batch_size, args.workers,
+                      args.per_host, args.host_interval, args.limit, args.dry_run, args.checkpoint,
+                      args.restart)
+    print(json.dumps(summary))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
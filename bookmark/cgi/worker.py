@@ -0,0 +1,164 @@
+#!/usr/local/bin/python3
+import argparse
+import contextvars
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+import app
+
+# Drains the fetch_jobs queue filled by add_bookmark(defer=True).
+#   cron:       * * * * * /usr/local/bin/python3 /path/to/bookmark/cgi/worker.py
+#   long-lived: python3 worker.py --loop --interval 5
+
+DEFAULT_WORKERS = 8
+DEFAULT_PER_HOST = 2
+DEFAULT_BATCH_SIZE = 100
+DEFAULT_MAX_ATTEMPTS = 5
+BACKOFF_BASE_SECONDS = 30
+BACKOFF_MAX_SECONDS = 6 * 60 * 60
+# A claimed job is invisible to other workers for this long; if the worker
+# dies mid-batch the job simply becomes due again.
+LEASE_SECONDS = 300
+
+def fetch_many(items, workers=DEFAULT_WORKERS, per_host=DEFAULT_PER_HOST, fetch=None, host_interval=0):
+    # items are dicts with 'url', 'host' and optional fetch 'options';
+    # yields (item, meta) as fetches finish. host_interval spaces out the
+    # start of consecutive fetches to the same host (seconds).
+    if workers < 1 or per_host < 1:
+        # per_host 0 would leave every item waiting with nothing in flight.
+        raise ValueError('workers and per_host must be at least 1')
+    fetch = fetch or app.fetch_metadata
+    pending = list(items)
+    active = {}
+    next_start = {}
+    in_flight = {}
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        while pending or in_flight:
+            now = time.monotonic()
+            waiting = []
+            for item in pending:
+                host = item['host']
+                if (len(in_flight) < workers and active.get(host, 0) < per_host
+                        and next_start.get(host, 0) <= now):
+                    active[host] = active.get(host, 0) + 1
+                    next_start[host] = now + host_interval
+                    # Each fetch runs in a copy of the caller's context, so context
+                    # variables set for a request (api/_server.py) follow it.
+                    context = contextvars.copy_context()
+                    in_flight[pool.submit(context.run, fetch, item['url'], **item.get('options', {}))] = item
+                else:
+                    waiting.append(item)
+            pending = waiting
+
+            # Wake up for a finished fetch or when a rate-limited host
+            # becomes eligible, whichever comes first.
+            starts = [next_start[item['host']] for item in pending if next_start.get(item['host'], 0) > now]
+            timeout = min(starts) - now if starts else None
+            if not in_flight:
+                time.sleep(timeout)
+                continue
+            done, _ = wait(in_flight, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                item = in_flight.pop(future)
+                active[item['host']] -= 1
+                try:
+                    meta = future.result()
+                except Exception as e:
+                    meta = {'status': 'fetch_error', 'error_message': str(e)}
+                yield item, meta
+
+def positive_int(value):
+    # argparse type for --workers and --per-host.
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError('must be at least 1')
+    return number
+
+def is_retryable(meta):
+    # Network errors and timeouts (no HTTP status), 429 and 5xx. Failures
+    # marked permanent (unsafe URL or host, bad redirects) are final.
+    if meta.get('status') != 'fetch_error' or meta.get('permanent'):
+        return False
+    http_status = meta.get('http_status')
+    return http_status is None or http_status == 429 or http_status >= 500
+
+def backoff_delay(attempts):
+    return min(BACKOFF_BASE_SECONDS * (2 ** max(attempts - 1, 0)), BACKOFF_MAX_SECONDS)
+
+def claim_jobs(limit, lease=LEASE_SECONDS):
+    conn = app.get_db_connection()
+    c = conn.cursor()
+    now = time.time()
+    c.execute('BEGIN IMMEDIATE')
+    c.execute('''
+        SELECT id, bookmark_id, url, host, attempts FROM fetch_jobs
+        WHERE next_attempt_at <= ? ORDER BY next_attempt_at LIMIT ?
+    ''', (now, limit))
+    jobs = [dict(row) for row in c.fetchall()]
+    c.executemany(
+        'UPDATE fetch_jobs SET next_attempt_at = ?, attempts = attempts + 1 WHERE id = ?',
+        [(now + lease, job['id']) for job in jobs]
+    )
+    conn.commit()
+    conn.close()
+    for job in jobs:
+        job['attempts'] += 1
+        if job['attempts'] > 1:
+            # A retry must reach the network, not the cached failure.
+            job['options'] = {'negative_cache': False}
+    return jobs
+
+def finish_jobs(results, max_attempts=DEFAULT_MAX_ATTEMPTS):
+    stats = {'ok': 0, 'failed': 0, 'retried': 0}
+    conn = app.get_db_connection()
+    c = conn.cursor()
+    now = time.time()
+    for job, meta in results:
+        if is_retryable(meta) and job['attempts'] < max_attempts:
+            c.execute(
+                'UPDATE fetch_jobs SET next_attempt_at = ?, last_error = ? WHERE id = ?',
+                (now + backoff_delay(job['attempts']), meta.get('error_message'), job['id'])
+            )
+            stats['retried'] += 1
+            continue
+        app.update_bookmark_metadata(c, job['bookmark_id'], meta)
+        c.execute('DELETE FROM fetch_jobs WHERE id = ?', (job['id'],))
+        stats['ok' if meta.get('status') == 'ok' else 'failed'] += 1
+    conn.commit()
+    conn.close()
+    return stats
+
+def run_batch(workers=DEFAULT_WORKERS, per_host=DEFAULT_PER_HOST, batch_size=DEFAULT_BATCH_SIZE,
+              max_attempts=DEFAULT_MAX_ATTEMPTS):
+    jobs = claim_jobs(batch_size)
+    results = list(fetch_many(jobs, workers, per_host)) if jobs else []
+    stats = finish_jobs(results, max_attempts) if results else {'ok': 0, 'failed': 0, 'retried': 0}
+    stats['claimed'] = len(jobs)
+    return stats
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Fetch metadata for bookmarks stored with status=pending.')
+    parser.add_argument('--loop', action='store_true', help='keep polling the queue instead of exiting when it is empty')
+    parser.add_argument('--interval', type=float, default=5.0, help='seconds to sleep between polls in --loop mode')
+    parser.add_argument('--workers', type=positive_int, default=DEFAULT_WORKERS, help='size of the fetch thread pool')
+    parser.add_argument('--per-host', type=positive_int, default=DEFAULT_PER_HOST, help='concurrent fetches allowed per host')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help='jobs claimed per batch')
+    parser.add_argument('--max-attempts', type=int, default=DEFAULT_MAX_ATTEMPTS, help='attempts before giving up on a job')
+    args = parser.parse_args(argv)
+
+    app.init_db()
+    while True:
+        stats = run_batch(args.workers, args.per_host, args.batch_size, args.max_attempts)
+        if stats['claimed']:
+            print(json.dumps(stats), flush=True)
+            continue
+        if not args.loop:
+            return 0
+        time.sleep(args.interval)
+
+if __name__ == '__main__':
+    sys.exit(main())
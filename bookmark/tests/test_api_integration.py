@@ -1,5 +1,7 @@
+import gzip
 import json
 import os
+import shutil
 import subprocess
 import sys
 import tempfile
@@ -19,12 +21,20 @@ class ApiIntegrationTests(unittest.TestCase):
     def tearDown(self):
         self.tmpdir.cleanup()
 
-    def run_cgi(self, method, action, body_obj=None, extra_query=None, extra_env=None):
+    def run_cgi(self, method, action, body_obj=None, extra_query=None, extra_env=None, body_bytes=b''):
+        status, _, body_text, stderr = self.run_cgi_raw(method, action, body_obj, extra_query, extra_env, body_bytes)
+        try:
+            data = json.loads(body_text) if body_text else None
+        except json.JSONDecodeError as exc:
+            raise AssertionError(f"Invalid JSON response: {body_text}") from exc
+
+        return status, data, stderr
+
+    def run_cgi_raw(self, method, action, body_obj=None, extra_query=None, extra_env=None, body_bytes=b''):
         query = f"action={action}"
         if extra_query:
             query = f"{query}&{extra_query}"
 
-        body_bytes = b''
         if body_obj is not None:
             body_bytes = json.dumps(body_obj).encode('utf-8')
 
@@ -48,11 +58,18 @@ class ApiIntegrationTests(unittest.TestCase):
             check=False,
         )
 
-        raw = proc.stdout.decode('utf-8', errors='replace').replace('\r\n', '\n')
-        if '\n\n' in raw:
-            headers_text, body_text = raw.split('\n\n', 1)
+        # Only the header block is normalised: a gzip body may contain CRLF.
+        raw = proc.stdout
+        ends = [(raw.find(sep), sep) for sep in (b'\r\n\r\n', b'\n\n') if sep in raw]
+        if ends:
+            end, sep = min(ends)
+            head, body = raw[:end].replace(b'\r\n', b'\n'), raw[end + len(sep):]
         else:
-            headers_text, body_text = '', raw
+            head, body = b'', raw
+        headers_text = head.decode('utf-8', errors='replace')
+        if 'content-encoding: gzip' in headers_text.lower():
+            body = gzip.decompress(body)
+        body_text = body.decode('utf-8', errors='replace')
 
         status = 200
         for line in headers_text.splitlines():
@@ -61,13 +78,7 @@ class ApiIntegrationTests(unittest.TestCase):
                 if len(parts) >= 2 and parts[1].isdigit():
                     status = int(parts[1])
 
-        body_text = body_text.strip()
-        try:
-            data = json.loads(body_text) if body_text else None
-        except json.JSONDecodeError as exc:
-            raise AssertionError(f"Invalid JSON response: {body_text}") from exc
-
-        return status, data, proc.stderr.decode('utf-8', errors='replace')
+        return status, headers_text, body_text.strip(), proc.stderr.decode('utf-8', errors='replace')
 
     def add_sample(self):
         status, data, _ = self.run_cgi(
@@ -120,6 +131,175 @@ class ApiIntegrationTests(unittest.TestCase):
         self.assertEqual(status, 200)
         self.assertEqual(data['data']['total'], 0)
 
+    def test_list_and_tags_revalidate_with_etag(self):
+        self.add_sample()
+        for action in ('list', 'tags'):
+            status, headers, _, _ = self.run_cgi_raw('GET', action)
+            self.assertEqual(status, 200)
+            self.assertIn('Cache-Control: private, no-cache', headers)
+            etag = next(line.split(':', 1)[1].strip() for line in headers.splitlines() if line.startswith('ETag:'))
+
+            status, headers, body, _ = self.run_cgi_raw('GET', action, extra_env={'HTTP_IF_NONE_MATCH': etag})
+            self.assertEqual((status, body), (304, ''))
+            self.assertIn(f'ETag: {etag}', headers)
+
+        # Any write to bookmarks changes the ETag.
+        self.run_cgi('POST', 'add', body_obj={'url': 'http://93.184.216.34/other'})
+        status, headers, _, _ = self.run_cgi_raw('GET', 'list', extra_env={'HTTP_IF_NONE_MATCH': etag})
+        self.assertEqual(status, 200)
+        self.assertNotIn(f'ETag: {etag}', headers)
+
+    def test_large_list_is_gzipped_when_accepted(self):
+        for i in range(10):
+            self.run_cgi('POST', 'add', body_obj={'url': f'http://93.184.216.34/page{i}', 'defer': True})
+
+        status, headers, body, _ = self.run_cgi_raw('GET', 'list', extra_env={'HTTP_ACCEPT_ENCODING': 'gzip, br'})
+        self.assertEqual(status, 200)
+        self.assertIn('Content-Encoding: gzip', headers)
+        self.assertIn('Vary: Accept-Encoding', headers)
+        self.assertEqual(json.loads(body)['data']['total'], 10)
+
+        for accept in ('gzip;q=0', 'gzip; q=0.0000', 'br, gzip;q=0'):
+            with self.subTest(accept=accept):
+                status, headers, body, _ = self.run_cgi_raw('GET', 'list', extra_env={'HTTP_ACCEPT_ENCODING': accept})
+                self.assertNotIn('Content-Encoding', headers)
+                self.assertEqual(json.loads(body)['data']['total'], 10)
+
+        status, headers, _, _ = self.run_cgi_raw('GET', 'list', extra_env={'HTTP_ACCEPT_ENCODING': 'gzip;q=0.5'})
+        self.assertIn('Content-Encoding: gzip', headers)
+
+    def test_if_none_match_star_matches_any_version(self):
+        self.add_sample()
+        status, headers, body, _ = self.run_cgi_raw('GET', 'list', extra_env={'HTTP_IF_NONE_MATCH': '*'})
+        self.assertEqual((status, body), (304, ''))
+
+    def test_runs_without_the_rest_of_the_repo(self):
+        # bookmark/ is deployed on its own: api.cgi must not reach outside cgi/.
+        cgi_dir = os.path.join(self.tmpdir.name, 'standalone', 'cgi')
+        shutil.copytree(os.path.dirname(SCRIPT_PATH), cgi_dir,
+                        ignore=shutil.ignore_patterns('__pycache__', 'data'))
+        env = dict(os.environ, BOOKMARK_DB_PATH=self.db_path, REQUEST_METHOD='GET',
+                   QUERY_STRING='action=health', CONTENT_LENGTH='0')
+        proc = subprocess.run([sys.executable, os.path.join(cgi_dir, 'api.cgi')],
+                              stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env, check=False)
+        self.assertEqual(proc.returncode, 0, proc.stderr)
+        body = proc.stdout.replace(b'\r\n', b'\n').split(b'\n\n', 1)[1]
+        self.assertTrue(json.loads(body)['ok'])
+
+    def test_list_with_multiple_tags(self):
+        self.add_sample()
+        status, data, _ = self.run_cgi('POST', 'add', body_obj={'url': 'http://93.184.216.34/other', 'tags': ['ai']})
+        self.assertEqual(status, 200)
+
+        status, data, _ = self.run_cgi('GET', 'list', extra_query='tag=ai&tag=work&mode=all')
+        self.assertEqual(status, 200)
+        self.assertEqual(data['data']['total'], 1)
+
+        status, data, _ = self.run_cgi('GET', 'list', extra_query='tag=ai&tag=work&mode=any')
+        self.assertEqual(data['data']['total'], 2)
+
+        status, data, _ = self.run_cgi('GET', 'list', extra_query='tag=ai&mode=both')
+        self.assertEqual(status, 400)
+
+    def test_list_cursor_pagination(self):
+        for i in range(3):
+            status, _, _ = self.run_cgi('POST', 'add', body_obj={'url': f'http://93.184.216.34/{i}'})
+            self.assertEqual(status, 200)
+
+        status, data, _ = self.run_cgi('GET', 'list', extra_query='limit=2&count=0')
+        self.assertEqual(status, 200)
+        self.assertIsNone(data['data']['total'])
+        self.assertEqual(len(data['data']['items']), 2)
+        cursor = data['data']['next_cursor']
+        self.assertTrue(cursor)
+
+        status, data, _ = self.run_cgi('GET', 'list', extra_query=f'limit=2&cursor={cursor}')
+        self.assertEqual(status, 200)
+        self.assertEqual(len(data['data']['items']), 1)
+        self.assertEqual(data['data']['total'], 3)
+        self.assertIsNone(data['data']['next_cursor'])
+
+        status, data, _ = self.run_cgi('GET', 'list', extra_query='cursor=%25%25%25')
+        self.assertEqual(status, 400)
+
+    def test_deferred_add_and_status_poll(self):
+        status, data, _ = self.run_cgi('POST', 'add', body_obj={'url': 'http://93.184.216.34/later', 'defer': True})
+        self.assertEqual(status, 200)
+        bookmark = data['data']['bookmark']
+        self.assertEqual(bookmark['status'], 'pending')
+
+        status, data, _ = self.run_cgi('GET', 'status', extra_query=f"ids={bookmark['id']},999")
+        self.assertEqual(status, 200)
+        self.assertEqual(data['data']['items'], [
+            {'id': bookmark['id'], 'status': 'pending', 'title': None, 'description': None,
+             'image_url': None, 'site_name': None, 'http_status': None, 'error_message': None}
+        ])
+
+        status, data, _ = self.run_cgi('GET', 'status', extra_query='ids=abc')
+        self.assertEqual(status, 400)
+
+    def test_import_ndjson_above_json_body_limit(self):
+        lines = [json.dumps({'url': f'http://93.184.216.34/{i}', 'note': 'x' * 100}) for i in range(600)]
+        lines.append(json.dumps({'url': 'http://93.184.216.34/0'}))
+        body = ('\n'.join(lines) + '\n').encode('utf-8')
+        self.assertGreater(len(body), 64 * 1024)
+
+        status, data, _ = self.run_cgi('POST', 'import', body_bytes=body, extra_query='format=ndjson')
+        self.assertEqual(status, 200)
+        self.assertEqual(data['data']['summary'], {'total': 601, 'added': 600, 'duplicate': 1, 'invalid': 0})
+        self.assertEqual(data['data']['errors'], [])
+        self.assertTrue(data['data']['complete'])
+
+        status, data, _ = self.run_cgi('GET', 'list', extra_query='limit=1')
+        self.assertEqual(data['data']['total'], 600)
+        self.assertEqual(data['data']['items'][0]['status'], 'pending')
+
+        status, data, _ = self.run_cgi('POST', 'import', body_bytes=b'{"url": "http://93.184.216.34/x"}',
+                                       extra_query='format=json')
+        self.assertEqual(status, 400)
+        self.assertEqual(data['error']['code'], 'invalid_body')
+
+    def test_import_reports_partial_success_and_caps_errors(self):
+        lines = ['"not a url"'] * 150 + ['"http://93.184.216.34/ok"']
+        body = ('[' + ', '.join(lines)).encode('utf-8')  # never closed
+        status, data, _ = self.run_cgi('POST', 'import', body_bytes=body)
+        self.assertEqual(status, 200)
+        self.assertFalse(data['data']['complete'])
+        self.assertEqual(data['data']['error']['code'], 'invalid_body')
+        self.assertEqual(data['data']['summary'], {'total': 151, 'added': 1, 'duplicate': 0, 'invalid': 150})
+        self.assertEqual(len(data['data']['errors']), 100)
+        self.assertEqual(data['data']['errors'][0], {'index': 0, 'result': 'invalid', 'error': 'url must be http(s) with a hostname'})
+
+        status, data, _ = self.run_cgi('GET', 'list')
+        self.assertEqual(data['data']['total'], 1)
+
+    def test_export_streams_ndjson_and_csv(self):
+        self.add_sample()
+        status, data, _ = self.run_cgi('POST', 'add', body_obj={'url': 'http://93.184.216.34/other', 'tags': ['home']})
+        self.assertEqual(status, 200)
+
+        status, headers, body, _ = self.run_cgi_raw('GET', 'export', extra_query='format=ndjson&tag=ai')
+        self.assertEqual(status, 200)
+        self.assertIn('application/x-ndjson', headers)
+        self.assertIn('attachment; filename="bookmarks-', headers)
+        rows = [json.loads(line) for line in body.splitlines()]
+        self.assertEqual([r['url'] for r in rows], ['http://93.184.216.34/sample'])
+        self.assertEqual(rows[0]['tags'], ['ai', 'work'])
+
+        status, headers, body, _ = self.run_cgi_raw('GET', 'export', extra_query='format=csv')
+        self.assertEqual(status, 200)
+        lines = body.splitlines()
+        self.assertTrue(lines[0].startswith('id,url,title'))
+        self.assertEqual(len(lines), 3)
+
+        status, _, body, _ = self.run_cgi_raw('GET', 'export', extra_query='since=2999-01-01')
+        self.assertEqual((status, body), (200, ''))
+
+        status, data, _ = self.run_cgi('GET', 'export', extra_query='format=xml')
+        self.assertEqual(status, 400)
+        status, data, _ = self.run_cgi('GET', 'export', extra_query='since=yesterday')
+        self.assertEqual(status, 400)
+
     def test_invalid_url_rejected(self):
         status, data, _ = self.run_cgi(
             'POST',
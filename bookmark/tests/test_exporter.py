@@ -0,0 +1,74 @@
+import io
+import json
+import os
+import sys
+import tempfile
+import unittest
+from unittest.mock import patch
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'cgi'))
+import app
+import exporter
+import importer
+
+class FlushCountingWriter(io.StringIO):
+    def __init__(self):
+        super().__init__()
+        self.flushes = 0
+
+    def flush(self):
+        self.flushes += 1
+        super().flush()
+
+class ExporterTests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        os.environ['BOOKMARK_DB_PATH'] = os.path.join(self.tmpdir.name, 'test.sqlite3')
+        entries = [
+            {'url': f'https://example.com/{i}', 'url_norm': f'https://example.com/{i}',
+             'title': f'Page <{i}>', 'tags': 'ai,work' if i % 2 else 'home', 'note': f'note {i}',
+             'created_at': f'2026-01-{i + 1:02d}T12:00:00'}
+            for i in range(5)
+        ]
+        app.add_bookmarks(entries)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+        os.environ.pop('BOOKMARK_DB_PATH', None)
+
+    def test_ndjson_flushes_per_batch_with_filters(self):
+        out = FlushCountingWriter()
+        exporter.export(out, 'ndjson', batch_size=2)
+        rows = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual([r['url'] for r in rows], [f'https://example.com/{i}' for i in range(5)])
+        self.assertEqual(out.flushes, 3)
+
+        out = io.StringIO()
+        exporter.export(out, 'ndjson', tag=['work'], since=exporter.parse_since('2026-01-03'))
+        self.assertEqual([json.loads(line)['url'] for line in out.getvalue().splitlines()],
+                         ['https://example.com/3'])
+
+        out = io.StringIO()
+        exporter.export(out, 'csv', q='note 4')
+        self.assertEqual(len(out.getvalue().splitlines()), 2)
+
+    def test_netscape_export_round_trips_through_importer(self):
+        out = io.StringIO()
+        exporter.export(out, 'netscape')
+        entries = list(importer.iter_entries(importer.iter_chunks(io.BytesIO(out.getvalue().encode('utf-8')), None)))
+        self.assertEqual(len(entries), 5)
+        with patch('fetcher.resolve_host', return_value=['93.184.216.34']):
+            first = importer.clean_entry(entries[0])
+        self.assertEqual(first['url'], 'https://example.com/0')
+        self.assertEqual(first['title'], 'Page <0>')
+        self.assertEqual(first['tags'], 'home')
+        self.assertEqual(first['note'], 'note 0')
+        self.assertEqual(first['created_at'], '2026-01-01T12:00:00')
+
+    def test_parse_since_rejects_garbage(self):
+        self.assertEqual(exporter.parse_since('2026-01-02'), '2026-01-02T00:00:00')
+        with self.assertRaises(ValueError):
+            exporter.parse_since('last week')
+
+if __name__ == '__main__':
+    unittest.main()
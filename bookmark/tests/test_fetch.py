@@ -0,0 +1,344 @@
+import gzip
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import patch
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'cgi'))
+import app
+import fetcher
+
+PAGE = b'''<html><head>
+<title>Local Page</title>
+<meta property="og:description" content="Served locally">
+</head><body>hello</body></html>'''
+
+SJIS_PAGE = '<html><head><meta charset="shift_jis"><title>日本語のページ</title></head><body></body></html>'.encode('shift_jis')
+BIG_HEAD = b'<html><head><title>Big Page</title></head><body>'
+BIG_BODY_BYTES = 32 * 1024 * 1024
+
+class PageHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    requests = []
+    connections = 0
+    big_bytes_sent = 0
+
+    def setup(self):
+        super().setup()
+        type(self).connections += 1
+
+    def log_message(self, format, *args):
+        return
+
+    def send_page(self, body, content_type='text/html', encoding=None, status=200):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        if encoding:
+            self.send_header('Content-Encoding', encoding)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_big_page(self):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(BIG_HEAD) + BIG_BODY_BYTES))
+        self.end_headers()
+        self.wfile.write(BIG_HEAD)
+        filler = b'x' * 65536
+        try:
+            for _ in range(BIG_BODY_BYTES // len(filler)):
+                self.wfile.write(filler)
+                type(self).big_bytes_sent += len(filler)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def do_GET(self):
+        type(self).requests.append((self.path, dict(self.headers)))
+        if self.path == '/big':
+            self.send_big_page()
+            return
+        if self.path == '/sjis':
+            self.send_page(SJIS_PAGE)
+            return
+        if self.path.startswith('/redirect'):
+            target = '/page' if self.path == '/redirect' else 'http://10.0.0.1/'
+            self.send_response(302)
+            self.send_header('Location', target)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        if self.path == '/accepted':
+            self.send_page(PAGE, 'text/html; charset=utf-8', status=203)
+            return
+        if self.path == '/gzip':
+            self.send_page(gzip.compress(PAGE), 'text/html; charset=utf-8', 'gzip')
+            return
+        if self.path.startswith('/missing'):
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        if self.headers.get('If-None-Match') == '"v1"':
+            self.send_response(304)
+            self.send_header('ETag', '"v1"')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(PAGE)))
+        self.send_header('ETag', '"v1"')
+        self.end_headers()
+        self.wfile.write(PAGE)
+
+class FetchTestCase(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.httpd = ThreadingHTTPServer(('127.0.0.1', 0), PageHandler)
+        cls.base = f"http://127.0.0.1:{cls.httpd.server_address[1]}"
+        cls.thread = threading.Thread(target=cls.httpd.serve_forever, daemon=True)
+        cls.thread.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.httpd.shutdown()
+        cls.httpd.server_close()
+        cls.thread.join(timeout=2)
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        os.environ['BOOKMARK_DB_PATH'] = os.path.join(self.tmpdir.name, 'test.sqlite3')
+        app.init_db()
+        PageHandler.requests = []
+        PageHandler.connections = 0
+        fetcher.dns_cache.clear()
+        # The local test server lives on a loopback address.
+        self.safe_patch = patch('fetcher.is_allowed_address', return_value=True)
+        self.safe_patch.start()
+
+    def tearDown(self):
+        self.safe_patch.stop()
+        self.tmpdir.cleanup()
+        os.environ.pop('BOOKMARK_DB_PATH', None)
+
+class FetchCacheTests(FetchTestCase):
+    def age_cache(self, seconds):
+        conn = app.get_db_connection()
+        conn.execute('UPDATE fetch_cache SET fetched_at = fetched_at - ?', (seconds,))
+        conn.commit()
+        conn.close()
+
+    def cache_stats(self):
+        conn = app.get_db_connection()
+        stats = app.get_cache_stats(conn.cursor())
+        conn.close()
+        return stats
+
+    def test_fresh_hit_skips_network_and_stale_entry_revalidates(self):
+        url = f"{self.base}/page"
+        first = app.fetch_metadata(url)
+        self.assertEqual(first['title'], 'Local Page')
+        self.assertEqual(first['description'], 'Served locally')
+
+        second = app.fetch_metadata(url)
+        self.assertEqual(second, first)
+        self.assertEqual(len(PageHandler.requests), 1)
+
+        self.age_cache(fetcher.FETCH_CACHE_TTL + 1)
+        third = app.fetch_metadata(url)
+        self.assertEqual(third, first)
+        self.assertEqual(len(PageHandler.requests), 2)
+        self.assertEqual(PageHandler.requests[1][1].get('If-None-Match'), '"v1"')
+
+        stats = self.cache_stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['revalidated'], stats['entries']), (1, 1, 1, 1))
+        self.assertEqual(app.check_health()['fetch_cache']['hits'], 1)
+
+    def test_cache_uses_one_connection_per_fetch(self):
+        url = f"{self.base}/page"
+        app.fetch_metadata(url)
+        with patch('app.get_db_connection', wraps=app.get_db_connection) as connect:
+            app.fetch_metadata(url)
+        self.assertEqual(connect.call_count, 1)
+        self.assertEqual(self.cache_stats()['hits'], 1)
+
+    def test_hits_are_counted_in_memory_until_flushed(self):
+        url = f"{self.base}/page"
+        app.fetch_metadata(url)
+        with patch('fetcher.cache_commit') as commit:
+            for _ in range(3):
+                app.fetch_metadata(url)
+        commit.assert_not_called()
+
+        def stored():
+            conn = app.get_db_connection()
+            rows = dict(conn.execute('SELECT name, value FROM fetch_cache_stats').fetchall())
+            conn.close()
+            return rows
+
+        self.assertEqual(stored(), {'misses': 1})
+        self.assertEqual(self.cache_stats()['hits'], 3)
+        fetcher.flush_cache_events()
+        self.assertEqual(stored(), {'misses': 1, 'hits': 3})
+        self.assertEqual(self.cache_stats()['hits'], 3)
+
+    def test_any_2xx_status_is_ok(self):
+        meta = app.fetch_metadata(f"{self.base}/accepted")
+        self.assertEqual(meta['status'], 'ok')
+        self.assertEqual(meta['http_status'], 203)
+        self.assertEqual(meta['title'], 'Local Page')
+
+    def test_failures_use_negative_ttl(self):
+        url = f"{self.base}/missing"
+        meta = app.fetch_metadata(url)
+        self.assertEqual(meta['status'], 'fetch_error')
+        self.assertEqual(meta['http_status'], 404)
+        app.fetch_metadata(url)
+        self.assertEqual(len(PageHandler.requests), 1)
+
+        app.fetch_metadata(url, negative_cache=False)
+        self.assertEqual(len(PageHandler.requests), 2)
+
+        self.age_cache(fetcher.FETCH_CACHE_NEGATIVE_TTL + 1)
+        app.fetch_metadata(url)
+        self.assertEqual(len(PageHandler.requests), 3)
+
+    def test_cache_evicts_oldest_entries(self):
+        conn = app.get_db_connection()
+        self.addCleanup(conn.close)
+        with patch('fetcher.FETCH_CACHE_MAX_ENTRIES', 10):
+            for i in range(12):
+                fetcher.cache_store(conn, f"https://example.com/{i}", {'status': 'ok', 'title': str(i)})
+                fetcher.cache_commit(conn)
+                time.sleep(0.001)
+            self.assertLessEqual(self.cache_stats()['entries'], 10)
+            self.assertIsNone(fetcher.cache_lookup(conn, 'https://example.com/0'))
+            self.assertIsNotNone(fetcher.cache_lookup(conn, 'https://example.com/11'))
+
+class StreamingExtractionTests(FetchTestCase):
+    def test_large_page_stops_after_head(self):
+        PageHandler.big_bytes_sent = 0
+        meta = fetcher.fetch_remote(f"{self.base}/big")
+        self.assertEqual(meta['status'], 'ok')
+        self.assertEqual(meta['title'], 'Big Page')
+        # The server is cut off long before the 32MB body is written.
+        self.assertLess(PageHandler.big_bytes_sent, BIG_BODY_BYTES)
+
+    def test_charset_from_meta_tag(self):
+        meta = fetcher.fetch_remote(f"{self.base}/sjis")
+        self.assertEqual(meta['title'], '日本語のページ')
+
+    def test_gzip_response_is_decompressed(self):
+        meta = fetcher.fetch_remote(f"{self.base}/gzip")
+        self.assertEqual(meta['title'], 'Local Page')
+        self.assertEqual(PageHandler.requests[0][1].get('Accept-Encoding'), 'gzip, deflate')
+
+class FetchClientTests(FetchTestCase):
+    def test_connections_are_reused(self):
+        client = fetcher.FetchClient()
+        try:
+            for _ in range(5):
+                with client.request(f"{self.base}/page") as response:
+                    self.assertEqual(response.status, 200)
+                    self.assertEqual(response.read(), PAGE)
+        finally:
+            client.close()
+        self.assertEqual(len(PageHandler.requests), 5)
+        self.assertEqual(PageHandler.connections, 1)
+
+    def test_early_stop_drops_connection_instead_of_downloading(self):
+        client = fetcher.FetchClient()
+        try:
+            with client.request(f"{self.base}/big") as response:
+                response.read(1024)
+            self.assertEqual(client.idle_count, 0)
+        finally:
+            client.close()
+
+    def test_redirects_are_followed_and_rechecked(self):
+        client = fetcher.FetchClient()
+        try:
+            with client.request(f"{self.base}/redirect") as response:
+                self.assertEqual(response.status, 200)
+                self.assertTrue(response.url.endswith('/page'))
+            with patch('fetcher.is_allowed_address', side_effect=lambda ip: ip == '127.0.0.1'):
+                with self.assertRaises(fetcher.FetchError):
+                    client.request(f"{self.base}/redirect-private")
+        finally:
+            client.close()
+        self.assertEqual(PageHandler.connections, 1)
+
+    def test_idle_pool_is_bounded(self):
+        client = fetcher.FetchClient(max_idle_per_host=1)
+        try:
+            first = client.request(f"{self.base}/page")
+            second = client.request(f"{self.base}/page")
+            first.read()
+            second.read()
+            first.close()
+            second.close()
+            self.assertEqual(client.idle_count, 1)
+        finally:
+            client.close()
+
+class DnsCacheTests(FetchTestCase):
+    def fake_getaddrinfo(self, calls):
+        real_getaddrinfo = socket.getaddrinfo
+
+        def getaddrinfo(host, *args, **kwargs):
+            if host == '127.0.0.1':
+                # Numeric connect to the pinned address; not a DNS lookup.
+                return real_getaddrinfo(host, *args, **kwargs)
+            calls.append(host)
+            if host == 'pinned.test':
+                return [(socket.AF_INET, socket.SOCK_STREAM, 6, '', ('127.0.0.1', 0))]
+            raise socket.gaierror('unknown host')
+        return getaddrinfo
+
+    def test_add_resolves_once_and_connects_to_vetted_address(self):
+        calls = []
+        port = self.httpd.server_address[1]
+        with patch('socket.getaddrinfo', side_effect=self.fake_getaddrinfo(calls)):
+            url = f"http://pinned.test:{port}/page"
+            self.assertTrue(app.is_safe_url(url))
+            meta = app.fetch_metadata(url)
+        self.assertEqual(meta['title'], 'Local Page')
+        self.assertEqual(calls, ['pinned.test'])
+        self.assertEqual(PageHandler.requests[0][1].get('Host'), f"pinned.test:{port}")
+
+    def test_store_shares_addresses_across_processes(self):
+        calls = []
+        with patch('socket.getaddrinfo', side_effect=self.fake_getaddrinfo(calls)):
+            self.assertEqual(fetcher.resolve_host('pinned.test'), ['127.0.0.1'])
+            fetcher.dns_cache.clear()
+            self.assertEqual(fetcher.resolve_host('pinned.test'), ['127.0.0.1'])
+        self.assertEqual(calls, ['pinned.test'])
+
+    def test_connection_refuses_non_global_addresses(self):
+        self.safe_patch.stop()
+        try:
+            meta = fetcher.fetch_remote(f"{self.base}/page")
+        finally:
+            self.safe_patch.start()
+        self.assertEqual(meta['status'], 'fetch_error')
+        self.assertEqual(PageHandler.requests, [])
+
+    def test_lru_eviction(self):
+        cache = fetcher.DnsCache(ttl=60, max_entries=2)
+        cache.put('a', ['1.1.1.1'])
+        cache.put('b', ['1.1.1.2'])
+        cache.get('a')
+        cache.put('c', ['1.1.1.3'])
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), ['1.1.1.1'])
+        cache.put('d', ['1.1.1.4'], expires_at=time.time() - 1)
+        self.assertIsNone(cache.get('d'))
+
+if __name__ == '__main__':
+    unittest.main()
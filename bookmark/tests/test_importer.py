@@ -0,0 +1,125 @@
+import io
+import json
+import os
+import sys
+import tempfile
+import unittest
+from unittest.mock import patch
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'cgi'))
+import app
+import importer
+
+NETSCAPE_HTML = b'''<!DOCTYPE NETSCAPE-Bookmark-file-1>
+<META HTTP-EQUIV="Content-Type" CONTENT="text/html; charset=UTF-8">
+<TITLE>Bookmarks</TITLE>
+<H1>Bookmarks</H1>
+<DL><p>
+    <DT><H3>Folder</H3>
+    <DL><p>
+        <DT><A HREF="https://example.com/a/" ADD_DATE="1700000000" TAGS="AI,Work">Example A</A>
+        <DD>First note
+        <DT><A HREF="https://example.com/b">\xe6\x97\xa5\xe6\x9c\xac\xe8\xaa\x9e</A>
+        <DT><A HREF="https://example.com/a#dup">Duplicate of A</A>
+        <DT><A HREF="javascript:alert(1)">Bad</A>
+    </DL><p>
+</DL><p>
+'''
+
+def chunked(data, size):
+    return importer.iter_chunks(io.BytesIO(data), None, chunk_size=size)
+
+class ImporterTests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        os.environ['BOOKMARK_DB_PATH'] = os.path.join(self.tmpdir.name, 'test.sqlite3')
+        # Host names resolve to a public address; IP literals are checked as given.
+        resolve = patch('fetcher.resolve_host', return_value=['93.184.216.34'])
+        resolve.start()
+        self.addCleanup(resolve.stop)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+        os.environ.pop('BOOKMARK_DB_PATH', None)
+
+    def test_netscape_parse_survives_tiny_chunks(self):
+        entries = list(importer.iter_entries(chunked(NETSCAPE_HTML, 7)))
+        self.assertEqual([e['url'] for e in entries], [
+            'https://example.com/a/', 'https://example.com/b', 'https://example.com/a#dup', 'javascript:alert(1)'
+        ])
+        self.assertEqual(entries[0]['tags'], 'AI,Work')
+        self.assertEqual(entries[0]['note'].strip(), 'First note')
+        self.assertEqual(entries[1]['title'], '日本語')
+
+    def test_json_array_and_ndjson_streaming(self):
+        data = json.dumps([{'url': 'https://example.com/x', 'tags': ['a']}, 'https://example.com/y']).encode()
+        entries = list(importer.iter_entries(chunked(data, 5)))
+        self.assertEqual(entries, [{'url': 'https://example.com/x', 'tags': ['a']}, 'https://example.com/y'])
+
+        data = b'{"url": "https://example.com/x"}\n\n{"url": "https://example.com/y"}\nnot json\n'
+        entries = list(importer.iter_entries(chunked(data, 4)))
+        self.assertEqual(entries[0], {'url': 'https://example.com/x'})
+        self.assertIsNone(entries[1])
+        self.assertEqual(entries[3], {'error': 'Invalid JSON line'})
+
+        with self.assertRaises(ValueError):
+            list(importer.iter_entries(chunked(b'[{"url": "https://example.com/x"}', 8)))
+
+    def test_import_dedupes_and_queues_fetches(self):
+        app.add_bookmark('https://example.com/b', None, None, defer=True)
+        entries = importer.iter_entries(chunked(NETSCAPE_HTML, 64))
+        items = []
+        summary = importer.summarize(importer.import_entries(entries, batch_size=2), items.append)
+        self.assertEqual(summary, {'total': 4, 'added': 1, 'duplicate': 2, 'invalid': 1})
+        self.assertEqual([i['result'] for i in items], ['added', 'duplicate', 'duplicate', 'invalid'])
+
+        bookmark = app.get_bookmark(items[0]['id'])
+        self.assertEqual(bookmark['status'], 'pending')
+        self.assertEqual(bookmark['title'], 'Example A')
+        self.assertEqual(bookmark['created_at'][:4], '2023')
+        tag_map = {t['tag']: t['count'] for t in app.get_tags()}
+        self.assertEqual(tag_map, {'ai': 1, 'work': 1})
+
+        conn = app.get_db_connection()
+        self.assertEqual(conn.execute('SELECT COUNT(*) FROM fetch_jobs').fetchone()[0], 2)
+        conn.close()
+
+    @patch('app.fetch_metadata')
+    def test_import_with_concurrent_fetch(self, mock_fetch):
+        mock_fetch.return_value = {'status': 'ok', 'title': None, 'description': 'Fetched', 'http_status': 200}
+        entries = [{'url': f'https://example.com/{i}', 'title': f'Title {i}'} for i in range(5)]
+        items = []
+        summary = importer.summarize(importer.import_entries(entries, fetch='now', batch_size=2), items.append)
+        self.assertEqual(summary['added'], 5)
+        self.assertEqual(mock_fetch.call_count, 5)
+        bookmark = app.get_bookmark(items[3]['id'])
+        self.assertEqual(bookmark['status'], 'ok')
+        self.assertEqual(bookmark['title'], 'Title 3')
+        self.assertEqual(bookmark['description'], 'Fetched')
+
+        # Stored URLs are skipped before fetching.
+        mock_fetch.reset_mock()
+        entries.append({'url': 'https://example.com/new'})
+        summary = importer.summarize(importer.import_entries(entries, fetch='now', batch_size=2))
+        self.assertEqual((summary['added'], summary['duplicate']), (1, 5))
+        mock_fetch.assert_called_once_with('https://example.com/new')
+
+    def test_unsafe_urls_are_invalid(self):
+        entries = ['http://127.0.0.1/internal', 'http://10.0.0.1/', 'http://[::1]/', 'https://example.com/ok']
+        items = []
+        summary = importer.summarize(importer.import_entries(entries), items.append)
+        self.assertEqual((summary['added'], summary['invalid']), (1, 3))
+        self.assertEqual(items[0], {'index': 0, 'result': 'invalid', 'error': 'url is not allowed'})
+        conn = app.get_db_connection()
+        self.assertEqual(conn.execute('SELECT COUNT(*) FROM fetch_jobs').fetchone()[0], 1)
+        conn.close()
+
+    def test_malformed_file_keeps_earlier_entries(self):
+        data = b'[{"url": "https://example.com/x"}, {"url": "https://example.com/y"}'
+        entries = importer.iter_entries(chunked(data, 8))
+        summary = importer.summarize(importer.import_entries(entries, batch_size=1))
+        self.assertEqual(summary, {'total': 2, 'added': 2, 'duplicate': 0, 'invalid': 0,
+                                   'error': 'unterminated JSON array'})
+
+if __name__ == '__main__':
+    unittest.main()
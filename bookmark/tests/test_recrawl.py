@@ -0,0 +1,131 @@
+import os
+import sys
+import tempfile
+import time
+import unittest
+from unittest.mock import patch
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'cgi'))
+import app
+import recrawl
+import worker
+
+OK_META = {'status': 'ok', 'title': 'Fresh Title', 'description': 'Fresh Desc', 'image_url': None,
+           'site_name': 'Fresh', 'http_status': 200, 'error_message': None}
+DAY = 24 * 60 * 60
+
+class RecrawlTests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        os.environ['BOOKMARK_DB_PATH'] = os.path.join(self.tmpdir.name, 'test.sqlite3')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+        os.environ.pop('BOOKMARK_DB_PATH', None)
+
+    def add(self, url, status, age_days, title='Old Title'):
+        with patch('app.fetch_metadata', return_value={'status': status, 'title': title, 'http_status': 200}):
+            created = app.add_bookmark(url, None, None)
+        conn = app.get_db_connection()
+        conn.execute('UPDATE bookmarks SET fetched_at = ? WHERE id = ?', (time.time() - age_days * DAY, created['id']))
+        conn.commit()
+        conn.close()
+        return created['id']
+
+    def fetch_recorder(self, meta=OK_META):
+        calls = []
+
+        def fetch(url, **options):
+            calls.append(url)
+            return dict(meta)
+        return fetch, calls
+
+    def test_selects_stale_and_failed_rows_only(self):
+        stale = self.add('https://a.example/stale', 'ok', 40)
+        self.add('https://a.example/fresh', 'ok', 1)
+        failed = self.add('https://b.example/failed', 'fetch_error', 2)
+        app.add_bookmark('https://c.example/pending', None, None, defer=True)
+
+        fetch, calls = self.fetch_recorder()
+        summary = recrawl.recrawl(host_interval=0, fetch=fetch)
+        self.assertEqual(sorted(calls), ['https://a.example/stale', 'https://b.example/failed'])
+        self.assertEqual(summary['selected'], 2)
+        self.assertEqual(summary['ok'], 2)
+        self.assertEqual(summary['recovered'], 1)
+        self.assertTrue(summary['finished'])
+        self.assertIsNotNone(summary['latency_ms']['p95'])
+
+        self.assertEqual(app.get_bookmark(stale)['title'], 'Fresh Title')
+        self.assertEqual(app.get_bookmark(failed)['status'], 'ok')
+        self.assertGreater(app.get_bookmark(stale)['fetched_at'], time.time() - 60)
+
+        # Everything refreshed moved past the cutoffs.
+        fetch, calls = self.fetch_recorder()
+        self.assertEqual(recrawl.recrawl(host_interval=0, fetch=fetch)['selected'], 0)
+
+    def test_failed_refresh_keeps_metadata(self):
+        bookmark_id = self.add('https://a.example/gone', 'ok', 40)
+        fetch, calls = self.fetch_recorder({'status': 'fetch_error', 'http_status': 404, 'error_message': 'HTTP Error 404'})
+        summary = recrawl.recrawl(host_interval=0, fetch=fetch)
+        self.assertEqual(summary['failed'], 1)
+        row = app.get_bookmark(bookmark_id)
+        self.assertEqual((row['status'], row['http_status'], row['fetch_failures']), ('ok', 200, 1))
+        self.assertEqual(row['error_message'], 'HTTP Error 404')
+
+        # Retried on the failure schedule; only repeated failures flip the status.
+        for _ in range(recrawl.MAX_REFRESH_FAILURES - 1):
+            recrawl.recrawl(retry_hours=0, host_interval=0, fetch=fetch)
+        self.assertEqual(len(calls), recrawl.MAX_REFRESH_FAILURES)
+        row = app.get_bookmark(bookmark_id)
+        self.assertEqual((row['status'], row['http_status']), ('fetch_error', 404))
+        self.assertEqual(row['title'], 'Old Title')
+
+        fetch, _ = self.fetch_recorder()
+        self.assertEqual(recrawl.recrawl(retry_hours=0, host_interval=0, fetch=fetch)['recovered'], 1)
+        row = app.get_bookmark(bookmark_id)
+        self.assertEqual((row['status'], row['fetch_failures']), ('ok', 0))
+
+    def test_limit_leaves_checkpoint_and_resume_continues(self):
+        for i in range(5):
+            self.add(f'https://a.example/{i}', 'ok', 40 + i)
+
+        fetch, first = self.fetch_recorder()
+        summary = recrawl.recrawl(batch_size=2, limit=3, host_interval=0, fetch=fetch)
+        self.assertEqual(summary['selected'], 3)
+        self.assertFalse(summary['finished'])
+
+        fetch, second = self.fetch_recorder()
+        summary = recrawl.recrawl(batch_size=2, host_interval=0, fetch=fetch)
+        self.assertTrue(summary['resumed'])
+        self.assertTrue(summary['finished'])
+        self.assertEqual(len(second), 2)
+        self.assertEqual(sorted(first + second), sorted(f'https://a.example/{i}' for i in range(5)))
+
+        conn = app.get_db_connection()
+        self.assertIsNone(recrawl.load_checkpoint(conn.cursor(), recrawl.DEFAULT_CHECKPOINT))
+        conn.close()
+
+    def test_dry_run_writes_nothing(self):
+        bookmark_id = self.add('https://a.example/stale', 'ok', 40)
+        fetch, calls = self.fetch_recorder()
+        summary = recrawl.recrawl(dry_run=True, fetch=fetch)
+        self.assertEqual(calls, [])
+        self.assertEqual(summary['selected'], 1)
+        self.assertEqual(summary['by_status'], {'ok': 1})
+        self.assertEqual(app.get_bookmark(bookmark_id)['title'], 'Old Title')
+
+    def test_fetch_many_spaces_requests_per_host(self):
+        starts = []
+
+        def fetch(url):
+            starts.append(time.monotonic())
+            return OK_META
+
+        items = [{'url': f'https://a.example/{i}', 'host': 'a.example'} for i in range(3)]
+        results = list(worker.fetch_many(items, workers=4, per_host=4, fetch=fetch, host_interval=0.05))
+        self.assertEqual(len(results), 3)
+        gaps = [b - a for a, b in zip(starts, starts[1:])]
+        self.assertTrue(all(gap >= 0.045 for gap in gaps), gaps)
+
+if __name__ == '__main__':
+    unittest.main()
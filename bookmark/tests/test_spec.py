@@ -1,6 +1,7 @@
 import os
 import sys
 import tempfile
+import threading
 import unittest
 from unittest.mock import patch
 
@@ -83,6 +84,144 @@ class BookmarkSpecTests(unittest.TestCase):
             self.assertIn('ai', item['tags'])
             self.assertNotIn('mail', item['tags'])
 
+    @patch('app.fetch_metadata')
+    def test_multi_tag_filters_and_counts(self, mock_fetch):
+        mock_fetch.return_value = {'status': 'ok', 'title': 'Title', 'http_status': 200}
+        a = app.add_bookmark('https://example.com/a', ['ai', 'work'], None)
+        app.add_bookmark('https://example.com/b', ['ai'], None)
+        app.add_bookmark('https://example.com/c', ['work', 'mail'], None)
+
+        self.assertEqual(app.get_bookmarks(tag=['ai', 'work'], mode='all')['total'], 1)
+        self.assertEqual(app.get_bookmarks(tag=['ai', 'work'], mode='any')['total'], 3)
+        self.assertEqual(app.get_bookmarks(tag=['AI', 'mail'])['total'], 3)
+
+        app.delete_bookmark(a['id'])
+        tag_map = {t['tag']: t['count'] for t in app.get_tags()}
+        self.assertEqual(tag_map, {'ai': 1, 'work': 1, 'mail': 1})
+
+    @patch('app.fetch_metadata')
+    def test_tag_tables_migrate_from_tags_column(self, mock_fetch):
+        mock_fetch.return_value = {'status': 'ok', 'title': 'Title', 'http_status': 200}
+        app.add_bookmark('https://example.com/a', ['ai', 'work'], None)
+        app.add_bookmark('https://example.com/b', ['ai'], None)
+
+        conn = app.get_db_connection()
+        for name in ('bookmark_tags_ai', 'bookmark_tags_ad', 'bookmarks_tags_ad'):
+            conn.execute(f'DROP TRIGGER {name}')
+        conn.execute('DROP TABLE bookmark_tags')
+        conn.execute('DROP TABLE tag_counts')
+        conn.execute('PRAGMA user_version = 0')
+        conn.commit()
+        conn.close()
+        app.init_db()
+
+        tag_map = {t['tag']: t['count'] for t in app.get_tags()}
+        self.assertEqual(tag_map, {'ai': 2, 'work': 1})
+        self.assertEqual(app.get_bookmarks(tag='work')['total'], 1)
+
+    @patch('app.fetch_metadata')
+    def test_search_uses_fts_ranking_and_snippets(self, mock_fetch):
+        mock_fetch.side_effect = [
+            {'status': 'ok', 'title': 'Cooking notes', 'description': 'python mentioned once',
+             'http_status': 200},
+            {'status': 'ok', 'title': 'Python tutorial', 'description': 'Learn python with python examples',
+             'http_status': 200},
+            {'status': 'ok', 'title': 'Unrelated', 'description': 'Nothing here', 'http_status': 200},
+        ]
+        app.add_bookmark('https://example.com/cooking', None, None)
+        app.add_bookmark('https://example.com/tutorial', None, None)
+        app.add_bookmark('https://example.com/other', None, None)
+
+        result = app.get_bookmarks(q='Python', snippet=True)
+        self.assertEqual(result['total'], 2)
+        self.assertEqual(result['items'][0]['title'], 'Python tutorial')
+        self.assertIn('<mark>', result['items'][0]['snippet'])
+        self.assertNotIn('rank', result['items'][0])
+
+        # Short queries cannot use the trigram index and fall back to LIKE.
+        self.assertEqual(app.get_bookmarks(q='tu')['total'], 1)
+
+    @patch('app.fetch_metadata')
+    def test_fts_index_follows_delete_and_existing_rows(self, mock_fetch):
+        mock_fetch.return_value = {'status': 'ok', 'title': 'Searchable page', 'http_status': 200}
+        created = app.add_bookmark('https://example.com/a', ['ai'], 'memo')
+
+        conn = app.get_db_connection()
+        conn.execute('DROP TABLE bookmarks_fts')
+        for name in ('bookmarks_fts_ai', 'bookmarks_fts_ad', 'bookmarks_fts_au'):
+            conn.execute(f'DROP TRIGGER {name}')
+        conn.execute('PRAGMA user_version = 0')
+        conn.commit()
+        conn.close()
+
+        # Migrating a pre-FTS database recreates the index and indexes its rows.
+        app.init_db()
+        self.assertEqual(app.get_bookmarks(q='searchable')['total'], 1)
+
+        app.delete_bookmark(created['id'])
+        self.assertEqual(app.get_bookmarks(q='searchable')['total'], 0)
+
+    @patch('app.fetch_metadata')
+    def test_cursor_pagination_walks_all_rows_once(self, mock_fetch):
+        mock_fetch.return_value = {'status': 'ok', 'title': 'Page python', 'http_status': 200}
+        for i in range(7):
+            app.add_bookmark(f'https://example.com/{i}', None, None)
+
+        for q in (None, 'python'):
+            seen = []
+            cursor = None
+            while True:
+                page = app.get_bookmarks(limit=3, q=q, cursor=cursor, count=False)
+                self.assertIsNone(page['total'])
+                seen.extend(item['id'] for item in page['items'])
+                cursor = page['next_cursor']
+                if cursor is None:
+                    break
+            self.assertEqual(len(seen), 7)
+            self.assertEqual(len(set(seen)), 7)
+
+        first = app.get_bookmarks(limit=3)
+        self.assertEqual(first['total'], 7)
+        self.assertEqual([i['id'] for i in first['items']], [7, 6, 5])
+
+        with self.assertRaises(ValueError):
+            app.decode_cursor('not-a-cursor')
+        with self.assertRaises(ValueError):
+            app.get_bookmarks(q='python', cursor=first['next_cursor'])
+
+    def test_schema_is_migrated_once_per_process(self):
+        conn = app.get_db_connection()
+        self.assertEqual(conn.execute('PRAGMA user_version').fetchone()[0], app.SCHEMA_VERSION)
+        self.assertEqual(conn.execute('PRAGMA journal_mode').fetchone()[0], 'wal')
+        conn.close()
+
+        with patch('app.migrate') as mock_migrate:
+            app.get_bookmarks()
+            app.get_tags()
+            mock_migrate.assert_not_called()
+
+        # An up-to-date database is only checked, never rebuilt.
+        with patch('app.migrate_v1') as mock_step:
+            app.init_db()
+            mock_step.assert_not_called()
+
+    def test_concurrent_writers_wait_for_the_lock(self):
+        errors = []
+
+        def add(i):
+            try:
+                app.add_bookmark(f'https://example.com/{i}', ['ai'], None, defer=True)
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=add, args=(i,)) for i in range(16)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(app.get_bookmarks()['total'], 16)
+
     def test_health_check(self):
         result = app.check_health()
         self.assertEqual(result.get('db'), 'ok')
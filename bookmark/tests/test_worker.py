@@ -0,0 +1,125 @@
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from unittest.mock import patch
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'cgi'))
+import app
+import worker
+
+OK_META = {
+    'status': 'ok',
+    'title': 'Fetched Title',
+    'description': 'Fetched Desc',
+    'image_url': None,
+    'site_name': 'Fetched',
+    'http_status': 200,
+    'error_message': None,
+}
+
+class FetchWorkerTests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        os.environ['BOOKMARK_DB_PATH'] = os.path.join(self.tmpdir.name, 'test.sqlite3')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+        os.environ.pop('BOOKMARK_DB_PATH', None)
+
+    def pending_jobs(self):
+        conn = app.get_db_connection()
+        rows = conn.execute('SELECT * FROM fetch_jobs').fetchall()
+        conn.close()
+        return [dict(row) for row in rows]
+
+    @patch('app.fetch_metadata')
+    def test_deferred_add_is_enriched_by_worker(self, mock_fetch):
+        mock_fetch.return_value = OK_META
+        created = app.add_bookmark('https://example.com/page', ['ai'], None, defer=True)
+        self.assertEqual(created['status'], 'pending')
+        self.assertIsNone(created['title'])
+        mock_fetch.assert_not_called()
+        self.assertEqual(len(self.pending_jobs()), 1)
+
+        stats = worker.run_batch(workers=2)
+        self.assertEqual(stats, {'ok': 1, 'failed': 0, 'retried': 0, 'claimed': 1})
+        self.assertEqual(self.pending_jobs(), [])
+
+        statuses = app.get_bookmark_statuses([created['id']])
+        self.assertEqual(statuses[0]['status'], 'ok')
+        self.assertEqual(statuses[0]['title'], 'Fetched Title')
+        self.assertEqual(app.get_bookmarks(q='Fetched')['total'], 1)
+
+    @patch('app.fetch_metadata')
+    def test_transient_errors_retry_with_backoff(self, mock_fetch):
+        mock_fetch.return_value = {'status': 'fetch_error', 'error_message': 'timed out'}
+        created = app.add_bookmark('https://example.com/slow', None, None, defer=True)
+
+        stats = worker.run_batch(max_attempts=2)
+        self.assertEqual(stats['retried'], 1)
+        job = self.pending_jobs()[0]
+        self.assertEqual(job['attempts'], 1)
+        self.assertGreater(job['next_attempt_at'], time.time() + worker.BACKOFF_BASE_SECONDS - 5)
+        self.assertEqual(worker.run_batch()['claimed'], 0)
+
+        conn = app.get_db_connection()
+        conn.execute('UPDATE fetch_jobs SET next_attempt_at = 0')
+        conn.commit()
+        conn.close()
+
+        stats = worker.run_batch(max_attempts=2)
+        self.assertEqual(stats['failed'], 1)
+        self.assertEqual(self.pending_jobs(), [])
+        self.assertEqual(app.get_bookmark(created['id'])['status'], 'fetch_error')
+
+    def test_unsafe_urls_are_not_retried(self):
+        created = app.add_bookmark('https://example.com/moved', None, None, defer=True)
+        conn = app.get_db_connection()
+        conn.execute("UPDATE fetch_jobs SET url = 'http://127.0.0.1/internal'")
+        conn.commit()
+        conn.close()
+
+        stats = worker.run_batch()
+        self.assertEqual((stats['failed'], stats['retried']), (1, 0))
+        self.assertEqual(self.pending_jobs(), [])
+        self.assertEqual(app.get_bookmark(created['id'])['status'], 'fetch_error')
+        self.assertFalse(worker.is_retryable({'status': 'fetch_error', 'error_message': 'Too many redirects',
+                                              'permanent': True}))
+        self.assertTrue(worker.is_retryable({'status': 'fetch_error', 'http_status': 503}))
+        self.assertFalse(worker.is_retryable({'status': 'fetch_error', 'http_status': 404}))
+
+    def test_fetch_many_respects_per_host_limit(self):
+        lock = threading.Lock()
+        active = {}
+        peak = {}
+
+        def fetch(url):
+            host = url.split('/')[2]
+            with lock:
+                active[host] = active.get(host, 0) + 1
+                peak[host] = max(peak.get(host, 0), active[host])
+            time.sleep(0.02)
+            with lock:
+                active[host] -= 1
+            return OK_META
+
+        items = [{'url': f'https://{h}/{i}', 'host': h} for h in ('a.example', 'b.example') for i in range(6)]
+        results = list(worker.fetch_many(items, workers=6, per_host=2, fetch=fetch))
+        self.assertEqual(len(results), 12)
+        self.assertEqual(peak, {'a.example': 2, 'b.example': 2})
+
+    def test_limits_below_one_are_rejected(self):
+        items = [{'url': 'https://a.example/', 'host': 'a.example'}]
+        for limits in ({'per_host': 0}, {'per_host': -1}, {'workers': 0}):
+            with self.subTest(**limits), self.assertRaises(ValueError):
+                list(worker.fetch_many(items, fetch=lambda url: OK_META, **limits))
+        with self.assertRaises(SystemExit), contextlib.redirect_stderr(io.StringIO()):
+            worker.main(['--per-host', '0'])
+
+if __name__ == '__main__':
+    unittest.main()